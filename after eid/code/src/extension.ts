@@ -38,6 +38,7 @@ export class Config {
 
 	inferenceMode: InferenceModes = InferenceModes.local;
 	useCUDA: boolean = false;
+	compressRequests: boolean = false;
 	infoLevel: InfoLevels = InfoLevels.fluent;
 	customDiagInfos: DiagnosticInformation | undefined;
 	showDescription: boolean = true;
@@ -99,6 +100,7 @@ export class Config {
 
 		this.inferenceMode = vsConfig.inference.inferenceMode;
 		this.useCUDA = vsConfig.inference.useCUDA;
+		this.compressRequests = vsConfig.inference.compressRequests;
 		this.infoLevel = vsConfig.diagnostics.informationLevel;
 		this.customDiagInfos = vsConfig.diagnostics.diagnosticMessageInformation;
 		this.showDescription = vsConfig.diagnostics.showDescription;
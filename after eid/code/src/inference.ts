@@ -4,6 +4,7 @@ import { debugMessage } from "./common";
 import { PythonShell } from 'python-shell';
 import { config, progressEmitter, VulDiagnostic } from "./extension";
 import path = require("path");
+import zlib = require("zlib");
 
 const axios = require('axios');
 
@@ -133,6 +134,27 @@ export class LocalInference extends InferenceEngine implements Inference{
 	}
 }
 
+/**
+ * Results of the remote inference engine are JSON objects, older servers sent them as a JSON-encoded string
+ * @param data Response body as parsed by axios
+ * @returns The result object
+ */
+function parseResult(data: any): any {
+	return (typeof data === "string") ? JSON.parse(data) : data;
+}
+
+/**
+ * Request body and headers for the remote inference engine, gzip compressed if enabled and large enough to benefit
+ * @param jsonObject JSON of the functions to analyse
+ * @returns The data and headers options of the request
+ */
+function requestBody(jsonObject: string): {data: string | Buffer, headers: {[key: string]: string}} {
+	if (config.compressRequests && jsonObject.length >= 1024) {
+		return {data: zlib.gzipSync(jsonObject), headers: {"Content-Type": "application/json", "Content-Encoding": "gzip"}};
+	}
+	return {data: jsonObject, headers: {"Content-Type": "application/json"}};
+}
+
 export class RemoteInference extends InferenceEngine implements Inference{
 
 	/**
@@ -158,15 +180,14 @@ export class RemoteInference extends InferenceEngine implements Inference{
 		await axios({
 			method: "post",
 			url: ((config.inferenceMode === InferenceModes.onpremise)? config.inferenceURLs.onPremise : config.inferenceURLs.cloud) + ((config.useCUDA)? "/api/v1/gpu/predict" : "/api/v1/cpu/predict"),
-			data: jsonObject,
 			signal: signal.signal,
-			headers: { "Content-Type":"application/json"},
+			...requestBody(jsonObject),
 		  })
 			.then(async  (response: any) => {
 				var end = new Date().getTime();
 				var diffInSeconds = (end - start) / 1000;
 
-				this.targetDiagnostic.predictions.line = JSON.parse(response.data);
+				this.targetDiagnostic.predictions.line = parseResult(response.data);
 
 				debugMessage(DebugTypes.info, "Received response from model in " + diffInSeconds + " seconds");
 
@@ -201,16 +222,15 @@ export class RemoteInference extends InferenceEngine implements Inference{
 		await axios({
 			method: "post",
 			url: ((config.inferenceMode === InferenceModes.onpremise)? config.inferenceURLs.onPremise : config.inferenceURLs.cloud) + ((config.useCUDA)? "/api/v1/gpu/cwe" : "/api/v1/cpu/cwe"),
-			data: jsonObject,
 			signal: signal.signal,
-			headers: { "Content-Type":"application/json"},
+			...requestBody(jsonObject),
 		})
 			.then( (response: any) => {
 				var end = new Date().getTime();
 				var diffInSeconds = (end - start) / 1000;
 
 				debugMessage(DebugTypes.info, "Received response from model in " + diffInSeconds + " seconds");
-				this.targetDiagnostic.predictions.cwe = JSON.parse(response.data);
+				this.targetDiagnostic.predictions.cwe = parseResult(response.data);
 
 				return Promise.resolve(response.data);
 			})
@@ -243,16 +263,15 @@ export class RemoteInference extends InferenceEngine implements Inference{
 		await axios({
 			method: "post",
 			url: ((config.inferenceMode === InferenceModes.onpremise)? config.inferenceURLs.onPremise : config.inferenceURLs.cloud) + ((config.useCUDA)? "/api/v1/gpu/sev" : "/api/v1/cpu/sev"),
-			data: jsonObject,
 			signal: signal.signal,
-			headers: { "Content-Type":"application/json"},
+			...requestBody(jsonObject),
 			})
 			.then( (response: any) => {
 				var end = new Date().getTime();
 				var diffInSeconds = (end - start) / 1000;
 
 				debugMessage(DebugTypes.info, "Received response from model in " + diffInSeconds + " seconds");
-				this.targetDiagnostic.predictions.sev = JSON.parse(response.data);
+				this.targetDiagnostic.predictions.sev = parseResult(response.data);
 
 				return Promise.resolve(response.data);
 			})
@@ -0,0 +1,112 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """Merge the functions of concurrent requests into a single model call.
+
+    Requests are queued and picked up by one worker thread, which keeps collecting
+    requests until ``max_batch_size`` functions are waiting or ``max_wait_ms`` has
+    passed since the first one arrived. The merged list is passed to ``run_batch``
+    (in chunks of at most ``max_batch_size`` functions) and the resulting dict of
+    per-function lists is sliced back to each caller. If the merged call raises, the
+    functions of each request are run again on their own, so an error only reaches
+    the request that caused it.
+
+    Parameters
+    ----------
+    run_batch : callable
+        Takes a list of String functions and returns a dict whose values are lists with one entry per function,
+        e.g. :func:`deploy.main`.
+    max_batch_size : int
+        Maximum number of functions passed to ``run_batch`` at once.
+    max_wait_ms : float
+        Maximum time the first request of a batch waits for other requests to join it.
+    """
+
+    _STOP = object()
+
+    def __init__(self, run_batch, max_batch_size: int = 32, max_wait_ms: float = 5.0, name: str = "batcher"):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.name = name
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, functions: list) -> Future:
+        """ queue a list of functions, the returned future resolves to the result dict for exactly these functions """
+        future = Future()
+        self._ensure_started()
+        self._queue.put((list(functions), future))
+        return future
+
+    @property
+    def pending(self) -> int:
+        """ requests queued for the next batches """
+        return self._queue.qsize()
+
+    def close(self):
+        with self._lock:
+            if self._thread is not None:
+                self._queue.put(self._STOP)
+                self._thread.join()
+                self._thread = None
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._worker, name=self.name, daemon=True)
+                    self._thread.start()
+
+    def _worker(self):
+        carry = None
+        while True:
+            first = carry if carry is not None else self._queue.get()
+            carry = None
+            if first is self._STOP:
+                return
+            batch = [first]
+            size = len(first[0])
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is self._STOP or size + len(item[0]) > self.max_batch_size:
+                    # does not fit, it opens the next batch instead
+                    carry = item
+                    break
+                batch.append(item)
+                size += len(item[0])
+            self._run(batch)
+
+    def _run(self, batch: list):
+        functions = [function for functions, _ in batch for function in functions]
+        try:
+            merged = {} if not functions else None
+            for start in range(0, len(functions), self.max_batch_size):
+                result = self.run_batch(functions[start:start + self.max_batch_size])
+                if merged is None:
+                    merged = {key: list(value) for key, value in result.items()}
+                else:
+                    for key, value in result.items():
+                        merged[key].extend(value)
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            # one bad request must not fail the others merged with it
+            for item in batch:
+                self._run([item])
+            return
+        offset = 0
+        for functions, future in batch:
+            future.set_result({key: value[offset:offset + len(functions)] for key, value in merged.items()})
+            offset += len(functions)
@@ -0,0 +1,112 @@
+"""Bytes on the wire and end-to-end latency of requests with and without gzip/zstd compression.
+
+Posts batches of synthetic functions to an endpoint of the ASGI app, in process through
+``httpx.ASGITransport``, once uncompressed and once per encoding with the request body
+compressed and ``Accept-Encoding`` set, and records the request and response bytes and the
+time from compressing the request to decompressing the response. The transfer time is not
+measured but modelled: the end-to-end latency at each ``--bandwidths`` link speed adds the
+bytes on the wire over that bandwidth and one ``--rtt-ms`` round trip to the measured time.
+
+Runs on the stub models of ``stub_models.py`` unless ``--real-models`` is given, like
+``inference_benchmark.py``.
+
+Usage::
+
+    python benchmarks/compression_benchmark.py [--path predict] [--batch-sizes 10,50,200] [--distribution typical]
+        [--bandwidths 1,10,100] [--rtt-ms 50] [--repeat 5]
+"""
+import argparse
+import asyncio
+import contextlib
+import gzip
+import json
+import os
+import statistics
+import sys
+import time
+
+import httpx
+import zstandard
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+from inference_benchmark import use_stub_models  # noqa: E402
+from synthetic import synthetic_functions  # noqa: E402
+
+ENCODINGS = ["identity", "gzip", "zstd"]
+
+
+def compress(encoding: str, body: bytes) -> bytes:
+    if encoding == "gzip":
+        return gzip.compress(body, mtime=0)
+    return zstandard.ZstdCompressor().compress(body)
+
+
+def decompress(encoding: str, body: bytes) -> bytes:
+    if encoding == "gzip":
+        return gzip.decompress(body)
+    return zstandard.ZstdDecompressor().decompress(body, max_output_size=1 << 30)
+
+
+async def post(client, url: str, functions: list, encoding: str) -> tuple:
+    """ (request bytes, response bytes, milliseconds) of one request, the time includes the client side compression """
+    start = time.perf_counter()
+    body = json.dumps(functions).encode()
+    headers = {"Content-Type": "application/json", "Accept-Encoding": encoding}
+    if encoding != "identity":
+        body = compress(encoding, body)
+        headers["Content-Encoding"] = encoding
+    async with client.stream("POST", url, content=body, headers=headers) as response:
+        response.raise_for_status()
+        raw = b"".join([chunk async for chunk in response.aiter_raw()])
+    content_encoding = response.headers.get("content-encoding", "identity")
+    result = json.loads(decompress(content_encoding, raw) if content_encoding != "identity" else raw)
+    elapsed = (time.perf_counter() - start) * 1000
+    if "error" in result:
+        raise RuntimeError(f"{url} failed: {result}")
+    return len(body), len(raw), elapsed
+
+
+async def measure(app, url: str, functions: list, encoding: str, repeat: int) -> tuple:
+    """ (request bytes, response bytes, median milliseconds) after one warm-up request """
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark") as client:
+        await post(client, url, functions, encoding)
+        runs = [await post(client, url, functions, encoding) for _ in range(repeat)]
+    return runs[0][0], runs[0][1], statistics.median(run[2] for run in runs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", default="predict", help="endpoint under /api/v1/cpu/")
+    parser.add_argument("--batch-sizes", default="10,50,200", help="comma separated functions per request")
+    parser.add_argument("--distribution", default="typical", help="name of synthetic.DISTRIBUTIONS or LOW-HIGH statements")
+    parser.add_argument("--bandwidths", default="1,10,100", help="comma separated link speeds in Mbit/s")
+    parser.add_argument("--rtt-ms", type=float, default=50, help="round trip time of the link")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--stub-dir", default=os.path.join(BENCHMARKS_DIR, "stubs"))
+    parser.add_argument("--real-models", action="store_true",
+                        help="use INFERENCE_COMMON_DIR and MODELS_DIR instead of the stub models")
+    args = parser.parse_args()
+    bandwidths = [float(bandwidth) for bandwidth in args.bandwidths.split(",")]
+
+    if not args.real_models:
+        use_stub_models(args.stub_dir)
+    # every request runs the models, and every response is large enough to be compressed
+    os.environ.update({"INFERENCE_CACHE_SIZE": "0", "INFERENCE_CACHE_PATH": "", "COMPRESSION_MIN_SIZE": "0"})
+    import deploy  # noqa: E402
+
+    print(f"{'batch':>6}{'encoding':>10}{'request (KB)':>14}{'response (KB)':>15}{'measured (ms)':>15}"
+          + "".join(f"{f'@{bandwidth:g} Mbit/s (ms)':>22}" for bandwidth in bandwidths))
+    for batch_size in [int(size) for size in args.batch_sizes.split(",")]:
+        functions = synthetic_functions(batch_size, args.distribution)
+        for encoding in ENCODINGS:
+            # the server logs every request, keep them out of the table
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                request_bytes, response_bytes, elapsed = asyncio.run(
+                    measure(deploy.app, f"/api/v1/cpu/{args.path}", functions, encoding, args.repeat))
+            latencies = [elapsed + args.rtt_ms + (request_bytes + response_bytes) * 8 / (bandwidth * 1000)
+                         for bandwidth in bandwidths]
+            print(f"{batch_size:>6}{encoding:>10}{request_bytes / 1024:>14.1f}{response_bytes / 1024:>15.1f}{elapsed:>15.1f}"
+                  + "".join(f"{latency:>22.1f}" for latency in latencies))
+    deploy.inference_executor.shutdown()
@@ -0,0 +1,90 @@
+"""Time the rule-based fallback repair on large and on pathological input.
+
+The large input is the C/C++ samples repeated up to ``--size`` characters. Every
+pathological input repeats a fragment that made one of the old unanchored or nested
+regexes backtrack (a strcat buffer followed by statements, calls without a closing
+parenthesis or comma, words without a semicolon, long identifiers, ...). Each is
+timed at doubling lengths and the growth exponent of the runtime is fitted; the
+script exits with status 1 if any input grows clearly faster than linearly.
+
+Usage::
+
+    python benchmarks/fallback_benchmark.py [--size 1000000] [--samples ../../SecureCodeAnalyzer/src/vulnerable_code]
+"""
+import argparse
+import glob
+import math
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fallback_repair import provide_fallback_repair  # noqa: E402
+
+DEFAULT_SAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..",
+                               "SecureCodeAnalyzer", "src", "vulnerable_code")
+
+# name -> (prefix, repeated fragment, suffix)
+PATHOLOGICAL = {
+    "strcat buffer then statements": ('strcat(x, y);\nchar b[4];', '  a;', ' strncat(c'),
+    "unclosed printf": ('', 'printf(', ''),
+    "printf arguments without )": ('printf(a, ', 'b"%', ''),
+    "strcpy without comma": ('', 'strcpy(', ''),
+    "gets without )": ('', 'gets(', ''),
+    "system without )": ('', 'system(', ''),
+    "reads without ;": ('strcpy(a, b);\n', 'read ', 'strncpy(a, b, sizeof(a)-1)'),
+    "stat without ;": ('', 'static ', ''),
+    "long identifier": ('+ ', 'a', ''),
+    "returns without ;": ('p = malloc(1);\n', 'return ', ''),
+    "SELECT without FROM": ('FROM\nsprintf(q, "', 'SELECT ', '"'),
+    "strncat buffers": ('', 'char b[4];\nstrncat(b, "xy", 1);\n', ''),
+}
+
+
+def best_time(code: str, repeat: int) -> float:
+    """ fastest of ``repeat`` runs of provide_fallback_repair, in seconds """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        provide_fallback_repair(code)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def growth(prefix: str, fragment: str, suffix: str, lengths: list, repeat: int) -> tuple:
+    """ (timings at each length, fitted exponent of runtime against input length) """
+    sizes, timings = [], []
+    for length in lengths:
+        code = prefix + fragment * (length // len(fragment)) + suffix
+        sizes.append(len(code))
+        timings.append(best_time(code, repeat))
+    exponent = math.log(timings[-1] / timings[0]) / math.log(sizes[-1] / sizes[0])
+    return timings, exponent
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", default=DEFAULT_SAMPLES)
+    parser.add_argument("--size", type=int, default=1000000, help="characters of the large input")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--max-exponent", type=float, default=1.3, help="largest runtime growth exponent accepted as linear")
+    args = parser.parse_args()
+
+    code = "\n".join(open(path).read() for path in sorted(glob.glob(os.path.join(args.samples, "*.c*"))))
+    if not code:
+        sys.exit(f"No C/C++ samples found in {args.samples}")
+    large = (code * (args.size // len(code) + 1))[:args.size]
+    print(f"large input ({len(large)} characters)  {best_time(large, args.repeat) * 1000:.1f} ms")
+
+    lengths = [args.size // 8, args.size // 4, args.size // 2, args.size]
+    print(f"\n{'pathological input':<32}" + "".join(f"{length:>10}" for length in lengths) + "  exponent")
+    superlinear = []
+    for name, (prefix, fragment, suffix) in PATHOLOGICAL.items():
+        timings, exponent = growth(prefix, fragment, suffix, lengths, args.repeat)
+        print(f"{name:<32}" + "".join(f"{timing * 1000:>8.1f}ms" for timing in timings) + f"  {exponent:8.2f}")
+        if exponent > args.max_exponent:
+            superlinear.append(name)
+    if superlinear:
+        sys.exit(f"\nRuntime grows faster than linearly for: {', '.join(superlinear)}")
+    print("\nRuntime grows linearly for every input")
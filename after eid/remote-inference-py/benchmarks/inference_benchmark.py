@@ -0,0 +1,222 @@
+"""Latency percentiles and throughput of every inference path, on stub models by default.
+
+Every path (``predict``, ``cwe``, ``sev``, ``statement``, ``analyze`` and ``repair``
+with the local repair model) is timed at each batch size, both as a direct call of
+``main``, ``main_cwe``, ``main_sev``, ``main_v2``, ``main_analyze`` and
+``main_repair`` and as an HTTP request to the ASGI app, in process through
+``httpx.ASGITransport``. Each iteration gets new synthetic functions from
+``synthetic.py`` and the inference and repair caches are disabled, so every request
+runs the models. Slow paths are timed for ``--max-seconds`` rather than all
+``--iterations``. Results hold p50/p95/p99/mean latency and functions per second and
+are written as JSON together with the commit, machine and settings; pass an earlier
+result as ``--baseline`` to compare, the script then exits with status 1 if any p50
+latency regressed by more than ``--tolerance``.
+
+Without ``--real-models`` the stubs of ``stub_models.py`` are written to
+``--stub-dir`` on the first run. Their timings compare code paths and commits, not
+the served models.
+
+Usage::
+
+    python benchmarks/inference_benchmark.py [--paths predict,cwe] [--modes direct,http] [--batch-sizes 1,8,64]
+        [--distributions typical,5-40] [--iterations 20] [--output results.json] [--baseline earlier.json]
+"""
+import argparse
+import asyncio
+import contextlib
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import httpx
+import numpy as np
+import onnxruntime
+import torch
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+from synthetic import synthetic_functions  # noqa: E402
+
+PATHS = ["predict", "cwe", "sev", "statement", "analyze", "repair"]
+MODES = ["direct", "http"]
+# settings recorded with the results, they change what is measured
+RECORDED_SETTINGS = ["DYNAMIC_PADDING", "PADDING_BUCKETS", "WINDOWED_INFERENCE", "BATCHING_ENABLED", "BATCH_MAX_SIZE",
+                     "BATCH_MAX_WAIT_MS", "INFERENCE_WORKERS", "STATEMENT_BACKEND", "MODEL_PRECISION",
+                     "LOCAL_REPAIR_RUNTIME", "LOCAL_REPAIR_BATCH_SIZE", "LOCAL_REPAIR_MAX_NEW_TOKENS", "LOCAL_REPAIR_NUM_BEAMS"]
+
+
+def git_commit() -> str:
+    """ short hash of HEAD, with "-dirty" if tracked files changed, or "" outside a git checkout """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=BENCHMARKS_DIR, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no", "."], capture_output=True,
+                               text=True, cwd=os.path.dirname(BENCHMARKS_DIR)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+    return f"{commit}-dirty" if dirty else commit
+
+
+def use_stub_models(stub_dir: str):
+    """ point the settings at the stub models, writing them first if needed; must run before deploy is imported """
+    if not os.path.exists(os.path.join(stub_dir, "models", "repair_decoder.onnx")):
+        # in a separate process, stub_models imports the settings before they point at the stubs
+        subprocess.run([sys.executable, os.path.join(BENCHMARKS_DIR, "stub_models.py"), stub_dir], check=True)
+    os.environ["INFERENCE_COMMON_DIR"] = os.path.join(stub_dir, "inference-common")
+    os.environ["MODELS_DIR"] = os.path.join(stub_dir, "models")
+
+
+def summarize(latencies: list, batch_size: int) -> dict:
+    latencies = np.array(latencies)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {"p50_ms": round(p50, 3), "p95_ms": round(p95, 3), "p99_ms": round(p99, 3),
+            "mean_ms": round(latencies.mean(), 3),
+            "functions_per_s": round(batch_size * len(latencies) / latencies.sum() * 1000, 2)}
+
+
+MIN_ITERATIONS = 3
+
+
+def time_direct(fn, batches: list, warmup: int, max_seconds: float) -> list:
+    """ latency in milliseconds of ``fn`` on the batches after ``warmup``, stopping after ``max_seconds`` timed """
+    latencies = []
+    for i, functions in enumerate(batches):
+        start = time.perf_counter()
+        fn(functions)
+        if i >= warmup:
+            latencies.append((time.perf_counter() - start) * 1000)
+            if len(latencies) >= MIN_ITERATIONS and sum(latencies) > max_seconds * 1000:
+                break
+    return latencies
+
+
+async def time_http(app, url: str, batches: list, warmup: int, max_seconds: float) -> list:
+    """ latency in milliseconds of a POST of each batch to ``url`` of the ASGI ``app``, like :func:`time_direct` """
+    latencies = []
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark") as client:
+        for i, functions in enumerate(batches):
+            start = time.perf_counter()
+            response = await client.post(url, json=functions)
+            response.raise_for_status()
+            if "error" in response.json():
+                raise RuntimeError(f"{url} failed: {response.json()}")
+            if i >= warmup:
+                latencies.append((time.perf_counter() - start) * 1000)
+                if len(latencies) >= MIN_ITERATIONS and sum(latencies) > max_seconds * 1000:
+                    break
+    return latencies
+
+
+def compare(results: list, baseline: dict, tolerance: float) -> list:
+    """ print the p50 and throughput change against ``baseline``, returns the keys whose p50 regressed beyond ``tolerance`` """
+    def key(result: dict) -> tuple:
+        return result["path"], result["mode"], result["distribution"], result["batch_size"]
+
+    earlier = {key(result): result for result in baseline["results"]}
+    print(f"\ncompared with {baseline.get('commit') or 'baseline'} from {baseline.get('created', '?')}")
+    print(f"{'path':<11}{'mode':<8}{'distribution':<14}{'batch':>6}{'p50 (ms)':>12}{'change':>9}{'functions/s':>14}{'change':>9}")
+    regressions = []
+    for result in results:
+        before = earlier.get(key(result))
+        if before is None:
+            continue
+        p50_change = result["p50_ms"] / before["p50_ms"] - 1
+        throughput_change = result["functions_per_s"] / before["functions_per_s"] - 1
+        print(f"{result['path']:<11}{result['mode']:<8}{result['distribution']:<14}{result['batch_size']:>6}"
+              f"{result['p50_ms']:>12.1f}{p50_change:>+9.1%}{result['functions_per_s']:>14.1f}{throughput_change:>+9.1%}")
+        if p50_change > tolerance:
+            regressions.append(key(result))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--paths", default=",".join(PATHS), help=f"comma separated, from {PATHS}")
+    parser.add_argument("--modes", default=",".join(MODES), help=f"comma separated, from {MODES}")
+    parser.add_argument("--batch-sizes", default="1,2,4,8,16,32,64")
+    parser.add_argument("--distributions", default="typical",
+                        help="comma separated names of synthetic.DISTRIBUTIONS or LOW-HIGH statements per function")
+    parser.add_argument("--iterations", type=int, default=20, help="timed requests per path, mode and batch size")
+    parser.add_argument("--max-seconds", type=float, default=20,
+                        help=f"stop timing a path, mode and batch size after this long, but not before {MIN_ITERATIONS} requests")
+    parser.add_argument("--warmup", type=int, default=2, help="untimed requests before each measurement")
+    parser.add_argument("--repair-max-new-tokens", type=int, default=32, help="LOCAL_REPAIR_MAX_NEW_TOKENS while benchmarking")
+    parser.add_argument("--stub-dir", default=os.path.join(BENCHMARKS_DIR, "stubs"))
+    parser.add_argument("--real-models", action="store_true",
+                        help="use INFERENCE_COMMON_DIR and MODELS_DIR instead of the stub models")
+    parser.add_argument("--output", help="result file, defaults to benchmarks/results/<commit>.json")
+    parser.add_argument("--baseline", help="earlier result file to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="largest accepted p50 slowdown against the baseline")
+    args = parser.parse_args()
+    paths = args.paths.split(",")
+    modes = args.modes.split(",")
+    batch_sizes = [int(size) for size in args.batch_sizes.split(",")]
+    distributions = args.distributions.split(",")
+    unknown = sorted(set(paths) - set(PATHS)) + sorted(set(modes) - set(MODES))
+    if unknown:
+        sys.exit(f"Unknown paths or modes {unknown}, expected paths from {PATHS} and modes from {MODES}")
+
+    if not args.real_models:
+        use_stub_models(args.stub_dir)
+    # measure the models, not the caches
+    os.environ.update({"INFERENCE_CACHE_SIZE": "0", "INFERENCE_CACHE_PATH": "", "REPAIR_CACHE_SIZE": "0",
+                       "REPAIR_CACHE_PATH": "", "LOCAL_REPAIR_MAX_NEW_TOKENS": str(args.repair_max_new_tokens)})
+    import deploy  # noqa: E402
+    import settings  # noqa: E402
+
+    direct = {"predict": deploy.main, "cwe": deploy.main_cwe, "sev": deploy.main_sev, "statement": deploy.main_v2,
+              "analyze": deploy.main_analyze, "repair": deploy.main_repair}
+    urls = {path: f"/api/v1/cpu/{path}" for path in PATHS}
+    urls["repair"] += "?backend=local"
+
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "machine": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count(),
+                    "onnxruntime": onnxruntime.__version__, "torch": torch.__version__},
+        "models": "real" if args.real_models else "stub",
+        "max_iterations": args.iterations,
+        "max_seconds": args.max_seconds,
+        "settings": {name: getattr(settings, name) for name in RECORDED_SETTINGS},
+        "results": [],
+    }
+    print(f"{'path':<11}{'mode':<8}{'distribution':<14}{'batch':>6}{'p50 (ms)':>12}{'p95 (ms)':>12}{'p99 (ms)':>12}"
+          f"{'functions/s':>14}")
+    for distribution in distributions:
+        for batch_size in batch_sizes:
+            # new functions for every request, so the statement token cache only hits like it would in service
+            batches = [synthetic_functions(batch_size, distribution, seed=seed)
+                       for seed in range(args.warmup + args.iterations)]
+            for path in paths:
+                for mode in modes:
+                    # the server logs every request, keep them out of the table
+                    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                        if mode == "direct":
+                            latencies = time_direct(direct[path], batches, args.warmup, args.max_seconds)
+                        else:
+                            latencies = asyncio.run(time_http(deploy.app, urls[path], batches, args.warmup,
+                                                              args.max_seconds))
+                    result = {"path": path, "mode": mode, "distribution": distribution, "batch_size": batch_size,
+                              "iterations": len(latencies), **summarize(latencies, batch_size)}
+                    report["results"].append(result)
+                    print(f"{path:<11}{mode:<8}{distribution:<14}{batch_size:>6}{result['p50_ms']:>12.1f}"
+                          f"{result['p95_ms']:>12.1f}{result['p99_ms']:>12.1f}{result['functions_per_s']:>14.1f}")
+    deploy.inference_executor.shutdown()
+
+    output = args.output or os.path.join(BENCHMARKS_DIR, "results", f"{commit or 'results'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report["results"], json.load(f), args.tolerance)
+        if regressions:
+            sys.exit(f"\np50 latency regressed by more than {args.tolerance:.0%} for: {regressions}")
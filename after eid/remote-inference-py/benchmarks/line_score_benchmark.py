@@ -0,0 +1,86 @@
+"""Check and time the vectorised attention-to-line scoring against the per-function Python loop.
+
+Every C/C++ file in the samples directory is split into lines of functions, run through
+the line model from ``MODELS_DIR`` (or, when ``--random-attentions`` is given, through
+random masked attention weights) and scored both by ``line_scores.attention_line_scores``
+and by the original per-function loop kept in ``tests/reference_line_scores.py``.
+
+Usage::
+
+    python benchmarks/line_score_benchmark.py [--samples ../../SecureCodeAnalyzer/src/vulnerable_code] [--random-attentions]
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests"))
+
+import deploy  # noqa: E402
+from line_scores import attention_line_scores  # noqa: E402
+from reference_line_scores import reference_line_scores  # noqa: E402
+
+DEFAULT_SAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..",
+                               "SecureCodeAnalyzer", "src", "vulnerable_code")
+
+
+def random_attentions(model_input: np.ndarray, heads: int = 12, seed: int = 0) -> np.ndarray:
+    """ softmax attention weights over the non-padding tokens """
+    rng = np.random.default_rng(seed)
+    logits = rng.normal(size=(model_input.shape[0], heads, model_input.shape[1], model_input.shape[1])).astype(np.float32)
+    logits[np.broadcast_to((model_input == 1)[:, None, None, :], logits.shape)] = -np.inf
+    weights = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return weights / weights.sum(axis=-1, keepdims=True)
+
+
+def attention_batches(input_ids: list, random: bool):
+    """ (indices, model input, attentions) per length bucket of the line model, or one random batch """
+    pad_token_id = deploy.registry.line_tokenizer().pad_token_id
+    if random:
+        model_input = deploy.pad_input_ids(input_ids, 512, pad_token_id)
+        yield list(range(len(input_ids))), model_input, random_attentions(model_input)
+        return
+    for indices, model_input, (_, attentions) in deploy.run_bucketed("line", input_ids, pad_token_id):
+        yield indices, model_input, attentions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", default=DEFAULT_SAMPLES)
+    parser.add_argument("--random-attentions", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=1e-4, help="maximum relative line score difference")
+    args = parser.parse_args()
+
+    code = [open(path).read() for path in sorted(glob.glob(os.path.join(args.samples, "*.c*")))]
+    if not code:
+        sys.exit(f"No C/C++ samples found in {args.samples}")
+    input_ids = deploy.tokenize_functions(code)
+    newline_mask = deploy.registry.newline_token_mask()
+    worst = 0.0
+    reference_seconds = vectorised_seconds = 0.0
+    for indices, model_input, attentions in attention_batches(input_ids, args.random_attentions):
+        missing_padding_rows = 512 - model_input.shape[1]
+        start = time.perf_counter()
+        expected = reference_line_scores(deploy.registry.line_tokenizer(), model_input, attentions.copy(),
+                                         missing_padding_rows)
+        reference_seconds += time.perf_counter() - start
+        start = time.perf_counter()
+        actual = attention_line_scores(model_input, attentions.copy(), newline_mask, missing_padding_rows)
+        vectorised_seconds += time.perf_counter() - start
+        for i, expected_lines, actual_lines in zip(indices, expected, actual):
+            if len(expected_lines) != len(actual_lines):
+                sys.exit(f"function {i}: {len(expected_lines)} lines expected, got {len(actual_lines)}")
+            if expected_lines:
+                expected_lines, actual_lines = np.array(expected_lines), np.array(actual_lines)
+                # the loop accumulates in float32, so compare relative to the score
+                difference = np.abs(expected_lines - actual_lines) / np.maximum(1.0, np.abs(expected_lines))
+                worst = max(worst, float(difference.max()))
+    print(f"{len(code)} functions, max relative line score difference {worst:.2e}")
+    print(f"python loop: {reference_seconds * 1000:.1f} ms, vectorised: {vectorised_seconds * 1000:.1f} ms, "
+          f"speedup {reference_seconds / vectorised_seconds:.1f}x")
+    if worst > args.tolerance:
+        sys.exit(f"line scores differ by more than {args.tolerance}")
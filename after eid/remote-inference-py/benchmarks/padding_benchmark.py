@@ -0,0 +1,53 @@
+"""Latency of main, main_cwe and main_sev with length-bucketed dynamic padding versus padding to 512.
+
+Runs every length distribution of ``synthetic.DISTRIBUTIONS`` through the models in
+``MODELS_DIR`` twice, once with ``DYNAMIC_PADDING`` enabled and once disabled.
+Dynamic padding only has an effect on models with a dynamic sequence axis, see
+``make_dynamic_onnx.py``.
+
+Usage::
+
+    python benchmarks/padding_benchmark.py [--batch-size 32] [--repeat 5]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import deploy  # noqa: E402
+import settings  # noqa: E402
+from synthetic import DISTRIBUTIONS, synthetic_functions  # noqa: E402
+
+
+def measure(fn, functions: list, repeat: int) -> float:
+    """ median latency in milliseconds """
+    fn(functions)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(functions)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for name in ["line", "cwe", "sev"]:
+        print(f"{name}_model dynamic sequence axis: {deploy.registry.dynamic_length(name)}")
+    print(f"{'model':<10}{'distribution':<14}{'mean tokens':>12}{'padded 512 (ms)':>18}{'bucketed (ms)':>16}{'speedup':>10}")
+    for distribution in DISTRIBUTIONS:
+        functions = synthetic_functions(args.batch_size, distribution)
+        mean_tokens = statistics.mean(len(ids) for ids in deploy.tokenize_functions(functions))
+        for name, fn in [("main", deploy.main), ("main_cwe", deploy.main_cwe), ("main_sev", deploy.main_sev)]:
+            settings.DYNAMIC_PADDING = False
+            fixed = measure(fn, functions, args.repeat)
+            settings.DYNAMIC_PADDING = True
+            bucketed = measure(fn, functions, args.repeat)
+            print(f"{name:<10}{distribution:<14}{mean_tokens:>12.0f}{fixed:>18.1f}{bucketed:>16.1f}{fixed / bucketed:>9.2f}x")
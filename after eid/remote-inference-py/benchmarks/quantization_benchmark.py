@@ -0,0 +1,93 @@
+"""Accuracy and speed of the INT8 or fp16 variants of the line, CWE and severity models against fp32.
+
+Every C/C++ file in the samples directory is run through ``main``, ``main_cwe`` and
+``main_sev`` once with the fp32 models and once with the variants written by
+``quantize_onnx.py``. For each model the harness reports how often both agree on
+the prediction, the drift of the probabilities, scores and line scores, the latency
+of both and the size and resident memory of both sessions.
+
+Usage::
+
+    python quantize_onnx.py ./models/line_model.onnx
+    python benchmarks/quantization_benchmark.py [--precision int8] [--samples ../../SecureCodeAnalyzer/src/vulnerable_code]
+"""
+import argparse
+import glob
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import deploy  # noqa: E402
+import settings  # noqa: E402
+from padding_benchmark import measure  # noqa: E402
+
+DEFAULT_SAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..",
+                               "SecureCodeAnalyzer", "src", "vulnerable_code")
+
+# model -> (function, prediction key, probability or score key)
+MODELS = {
+    "line": (deploy.main, "batch_vul_pred", "batch_vul_pred_prob"),
+    "cwe": (deploy.main_cwe, "cwe_id", "cwe_id_prob"),
+    "sev": (deploy.main_sev, "batch_sev_class", "batch_sev_score"),
+}
+
+
+def line_score_drift(expected: list, actual: list) -> tuple:
+    """ (functions whose number of scored lines changed, max absolute line score difference of the others) """
+    changed, worst = 0, 0.0
+    for expected_lines, actual_lines in zip(expected, actual):
+        if len(expected_lines) != len(actual_lines):
+            changed += 1
+        elif expected_lines:
+            worst = max(worst, float(np.abs(np.array(expected_lines) - np.array(actual_lines)).max()))
+    return changed, worst
+
+
+def session_memory(name: str) -> float:
+    """ RSS added by loading the session of the currently selected precision, in MB """
+    key = f"{name}_model[{settings.MODEL_PRECISION[name]},cpu]"
+    return sum(entry["rss_delta_mb"] for entry in deploy.registry.load_report if entry["name"] == key)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--precision", choices=["int8", "fp16"], default="int8")
+    parser.add_argument("--samples", default=DEFAULT_SAMPLES)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    code = [open(path).read() for path in sorted(glob.glob(os.path.join(args.samples, "*.c*")))]
+    if not code:
+        sys.exit(f"No C/C++ samples found in {args.samples}")
+    print(f"{len(code)} functions, fp32 against {args.precision}")
+    for name, (fn, prediction_key, probability_key) in MODELS.items():
+        results, timings, sizes, memory = {}, {}, {}, {}
+        for precision in ["fp32", args.precision]:
+            settings.MODEL_PRECISION[name] = precision
+            path = deploy.registry.onnx_model_path(name)
+            if not os.path.exists(path):
+                sys.exit(f"{path} not found, run `python quantize_onnx.py "
+                         f"{os.path.join(deploy.registry.models_dir, name + '_model.onnx')} --precision {args.precision}` first")
+            deploy.registry.onnx_session(name)
+            sizes[precision] = os.path.getsize(path) / 2 ** 20
+            memory[precision] = session_memory(name)
+            results[precision] = fn(code)
+            timings[precision] = measure(fn, code, args.repeat)
+        settings.MODEL_PRECISION[name] = "fp32"
+
+        expected, actual = results["fp32"], results[args.precision]
+        agreement = np.mean(np.array(expected[prediction_key]) == np.array(actual[prediction_key]))
+        drift = np.abs(np.array(expected[probability_key]) - np.array(actual[probability_key]))
+        print(f"\n{name}_model")
+        print(f"  prediction agreement   {agreement:.2%}")
+        print(f"  {probability_key + ' drift':<22} max {drift.max():.4f}, mean {drift.mean():.4f}")
+        if name == "line":
+            changed, worst = line_score_drift(expected["batch_line_scores"], actual["batch_line_scores"])
+            print(f"  line score drift       max {worst:.4f}, {changed} functions with a different number of lines")
+        print(f"  latency                {timings['fp32']:.1f} ms -> {timings[args.precision]:.1f} ms, "
+              f"speedup {timings['fp32'] / timings[args.precision]:.2f}x")
+        print(f"  model file             {sizes['fp32']:.1f} MB -> {sizes[args.precision]:.1f} MB")
+        print(f"  session RSS            {memory['fp32']:.1f} MB -> {memory[args.precision]:.1f} MB")
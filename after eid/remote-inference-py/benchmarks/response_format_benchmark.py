@@ -0,0 +1,90 @@
+"""Size and encoding time of the response formats of ``response_formats.py``.
+
+Builds ``predict``, ``statement`` and ``analyze`` results with random scores for
+documents of several sizes and encodes each of them as the endpoints used to (``json.dumps``
+of the result, encoded again as a JSON string by FastAPI), as JSON with orjson and as
+MessagePack with float32 and float16 score arrays. No models are needed.
+
+Usage::
+
+    python benchmarks/response_format_benchmark.py [--functions 10,100,1000] [--lines 40] [--repeat 20]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import response_formats  # noqa: E402
+
+
+def predict_result(count: int, lines: int, rng: np.random.Generator) -> dict:
+    prob = rng.random(count)
+    return {"batch_vul_pred": (prob > 0.5).astype(int).tolist(), "batch_vul_pred_prob": prob.tolist(),
+            "batch_line_scores": [rng.random(rng.integers(lines // 2, lines * 2)).tolist() for _ in range(count)]}
+
+
+def statement_result(count: int, rng: np.random.Generator) -> dict:
+    prob = rng.random(count)
+    return {"batch_func_pred": (prob > 0.5).astype(int).tolist(), "batch_func_pred_prob": prob.tolist(),
+            "batch_statement_pred": rng.integers(0, 2, (count, 155)).tolist(),
+            "batch_statement_pred_prob": rng.random((count, 155)).tolist()}
+
+
+def analyze_result(count: int, lines: int, rng: np.random.Generator) -> dict:
+    vulnerable = sorted(rng.choice(count, count // 4, replace=False).tolist())
+    return {"line": predict_result(count, lines, rng), "vulnerable": vulnerable,
+            "cwe": {"cwe_id": ["CWE-787"] * len(vulnerable), "cwe_id_prob": rng.random(len(vulnerable)).tolist(),
+                    "cwe_type": ["Base"] * len(vulnerable), "cwe_type_prob": rng.random(len(vulnerable)).tolist()},
+            "sev": {"batch_sev_score": (rng.random(len(vulnerable)) * 10).tolist(),
+                    "batch_sev_class": ["High"] * len(vulnerable)}}
+
+
+def legacy_json(result: dict) -> bytes:
+    """ the body the endpoints sent before, the JSON of the result encoded again as a string by FastAPI """
+    return json.dumps(json.dumps(result), ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+
+
+ENCODERS = {
+    "legacy json": legacy_json,
+    "json": response_formats.encode_json,
+    "msgpack float32": lambda result: response_formats.encode_msgpack(result, "float32"),
+    "msgpack float16": lambda result: response_formats.encode_msgpack(result, "float16"),
+}
+
+
+def measure(encode, result: dict, repeat: int) -> tuple:
+    """ (size in bytes, median encoding time in milliseconds) """
+    body = encode(result)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        encode(result)
+        timings.append((time.perf_counter() - start) * 1000)
+    return len(body), statistics.median(timings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--functions", default="10,100,1000", help="comma separated functions per document")
+    parser.add_argument("--lines", type=int, default=40, help="typical lines per function")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'result':<11}{'functions':>10}{'format':>18}{'size (KB)':>12}{'size':>8}{'encode (ms)':>13}{'time':>8}")
+    for count in [int(count) for count in args.functions.split(",")]:
+        results = {"predict": predict_result(count, args.lines, rng), "statement": statement_result(count, rng),
+                   "analyze": analyze_result(count, args.lines, rng)}
+        for name, result in results.items():
+            for encoder_name, encode in ENCODERS.items():
+                size, ms = measure(encode, result, args.repeat)
+                if encode is legacy_json:
+                    legacy_size, legacy_ms = size, ms
+                print(f"{name:<11}{count:>10}{encoder_name:>18}{size / 1024:>12.1f}{size / legacy_size:>8.0%}"
+                      f"{ms:>13.2f}{ms / legacy_ms:>8.0%}")
@@ -0,0 +1,146 @@
+"""Import time, model loading time and first request latency of a new server process.
+
+Every run starts a new Python process, like a worker spawned by gunicorn or a replica
+added by the autoscaler, and times three phases: importing ``deploy``, preloading the
+``--preload`` models, and the first call of each of ``--paths``. The heavy libraries
+(torch, transformers, onnxruntime, httpx) imported by the end of each phase are listed
+with the resident memory, so a change that imports one of them earlier shows up here.
+Each ``--backends`` entry sets both ``STATEMENT_BACKEND`` and ``LOCAL_REPAIR_RUNTIME``,
+so ``onnx`` measures a server that never needs torch. The medians of ``--repeat`` runs
+are printed, followed by the packages taking longest to import (``python -X importtime``).
+
+Runs on the stub models of ``stub_models.py`` unless ``--real-models`` is given, like
+``inference_benchmark.py``. Run it twice to keep the first run's disk reads out of the timings.
+
+Usage::
+
+    python benchmarks/startup_benchmark.py [--backends onnx,torch] [--preload line,cwe,sev,statement]
+        [--paths predict,cwe,sev,statement] [--repeat 5] [--output startup.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, SERVER_DIR)
+
+from inference_benchmark import use_stub_models  # noqa: E402
+
+BACKENDS = ["onnx", "torch"]
+PATHS = ["predict", "cwe", "sev", "statement", "repair"]
+HEAVY_MODULES = ["torch", "transformers", "onnxruntime", "httpx"]
+PHASES = ["import", "preload", "first_request"]
+
+# runs in the new process, prints one JSON line with the seconds, RSS and heavy modules after each phase
+PROBE = """
+import contextlib, json, os, sys, time
+start = time.perf_counter()
+with contextlib.redirect_stdout(sys.stderr):
+    import deploy
+    from model_registry import get_rss_bytes
+    phases = {}
+
+    def record(phase, since):
+        phases[phase] = {"seconds": time.perf_counter() - since, "rss_mb": get_rss_bytes() / 2 ** 20,
+                         "modules": [name for name in json.loads(os.environ["HEAVY_MODULES"]) if name in sys.modules]}
+        return time.perf_counter()
+
+    since = record("import", start)
+    deploy.registry.preload(os.environ["PRELOAD_MODELS"].split(","))
+    since = record("preload", since)
+    functions = json.loads(os.environ["FUNCTIONS"])
+    calls = {"predict": deploy.main, "cwe": deploy.main_cwe, "sev": deploy.main_sev, "statement": deploy.main_v2,
+             "repair": deploy.main_repair}
+    for path in os.environ["PATHS"].split(","):
+        calls[path](functions)
+    record("first_request", since)
+    deploy.inference_executor.shutdown()
+print(json.dumps(phases))
+"""
+
+
+def backend_environment(backend: str) -> dict:
+    return dict(os.environ, STATEMENT_BACKEND=backend, LOCAL_REPAIR_RUNTIME=backend)
+
+
+def run_probe(backend: str, preload: str, paths: str, functions: list) -> dict:
+    """ phases of one new process, see ``PROBE`` """
+    environment = backend_environment(backend)
+    environment.update({"PRELOAD_MODELS": preload, "PATHS": paths, "FUNCTIONS": json.dumps(functions),
+                        "HEAVY_MODULES": json.dumps(HEAVY_MODULES)})
+    result = subprocess.run([sys.executable, "-c", PROBE], env=environment, cwd=SERVER_DIR, capture_output=True,
+                            text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"startup probe failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(backend: str, top: int) -> list:
+    """ (package, cumulative milliseconds) of the ``top`` top-level packages slowest to import with ``deploy`` """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import deploy"],
+                            env=backend_environment(backend), cwd=SERVER_DIR, capture_output=True, text=True)
+    packages = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # each package is imported once, its cumulative time includes the packages it imports first
+        if cumulative.strip().isdigit() and "." not in name.strip() and name.strip() != "deploy":
+            packages.append((name.strip(), int(cumulative) / 1000))
+    return sorted(packages, key=lambda package: -package[1])[:top]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", default=",".join(BACKENDS), help=f"comma separated, from {BACKENDS}")
+    parser.add_argument("--preload", default="line,cwe,sev,statement", help="PRELOAD_MODELS of the new process")
+    parser.add_argument("--paths", default="predict,cwe,sev,statement", help=f"comma separated, from {PATHS}")
+    parser.add_argument("--functions", type=int, default=4, help="functions sent in each first request")
+    parser.add_argument("--repeat", type=int, default=5, help="new processes per backend")
+    parser.add_argument("--top", type=int, default=8, help="slowest imported packages listed")
+    parser.add_argument("--stub-dir", default=os.path.join(BENCHMARKS_DIR, "stubs"))
+    parser.add_argument("--real-models", action="store_true",
+                        help="use INFERENCE_COMMON_DIR and MODELS_DIR instead of the stub models")
+    parser.add_argument("--output", help="also write the results as JSON")
+    args = parser.parse_args()
+    backends = args.backends.split(",")
+    unknown = sorted(set(backends) - set(BACKENDS)) + sorted(set(args.paths.split(",")) - set(PATHS))
+    if unknown:
+        sys.exit(f"Unknown backends or paths {unknown}, expected backends from {BACKENDS} and paths from {PATHS}")
+
+    if not args.real_models:
+        use_stub_models(args.stub_dir)
+    # the first request runs the models, and a repair of a few tokens is enough to load the generation code
+    os.environ.update({"INFERENCE_CACHE_SIZE": "0", "INFERENCE_CACHE_PATH": "", "REPAIR_CACHE_SIZE": "0",
+                       "REPAIR_CACHE_PATH": "", "LOCAL_REPAIR_MAX_NEW_TOKENS": "8"})
+    from synthetic import synthetic_functions  # noqa: E402
+    functions = synthetic_functions(args.functions, "typical")
+
+    report = {"preload": args.preload, "paths": args.paths, "repeat": args.repeat, "results": []}
+    print(f"{'backend':<9}{'phase':<15}{'seconds':>9}{'total (s)':>11}{'RSS (MB)':>10}  imported")
+    for backend in backends:
+        runs = [run_probe(backend, args.preload, args.paths, functions) for _ in range(args.repeat)]
+        total = 0
+        for phase in PHASES:
+            seconds = statistics.median(run[phase]["seconds"] for run in runs)
+            rss_mb = statistics.median(run[phase]["rss_mb"] for run in runs)
+            total += seconds
+            modules = runs[-1][phase]["modules"]
+            report["results"].append({"backend": backend, "phase": phase, "seconds": round(seconds, 4),
+                                      "rss_mb": round(rss_mb, 1), "modules": modules})
+            print(f"{backend:<9}{phase:<15}{seconds:>9.3f}{total:>11.3f}{rss_mb:>10.1f}  {', '.join(modules) or '-'}")
+
+    for backend in backends:
+        packages = slowest_imports(backend, args.top)
+        report[f"slowest_imports_{backend}"] = packages
+        print(f"\nslowest packages imported by deploy ({backend}): "
+              + ", ".join(f"{name} {milliseconds:.0f} ms" for name, milliseconds in packages))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote {args.output}")
@@ -0,0 +1,147 @@
+"""Write small randomly initialised stand-ins of every served model, for benchmarking without the real weights.
+
+The stubs keep the input and output signatures of the real models, so every inference
+path of ``deploy.py`` runs on them unchanged:
+
+* ``line_model.onnx``, ``cwe_model.onnx`` and ``sev_model.onnx``: a one-layer RoBERTa
+  encoder over the line tokenizer vocabulary with a dynamic sequence axis, returning
+  the class probabilities and last layer attentions, the CWE-ID and CWE type
+  probabilities (sized by ``label_map.pkl``) and the CVSS score.
+* ``statement_t5_model.bin`` and its ONNX export: ``StatementT5`` over a one-layer T5
+  encoder. The model hard-codes a hidden size of 768, so only the depth is reduced.
+* ``repair_model.bin`` and its ONNX export: a two-layer T5 with a hidden size of 64.
+
+Tokenizers and the label map are copied from ``INFERENCE_COMMON_DIR`` next to
+shrunk T5 configs. Point the server or a benchmark at the stubs with
+``INFERENCE_COMMON_DIR=<output>/inference-common MODELS_DIR=<output>/models``.
+Timings on the stubs compare code paths and commits, not the real models.
+
+Usage::
+
+    python benchmarks/stub_models.py [output directory, defaults to ./benchmarks/stubs]
+
+Requires the ``onnx`` package.
+"""
+import json
+import os
+import pickle
+import shutil
+import sys
+
+import torch
+from transformers import RobertaConfig, RobertaModel, RobertaTokenizer, T5Config, T5EncoderModel, T5ForConditionalGeneration
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import export_repair_onnx  # noqa: E402
+import export_statement_onnx  # noqa: E402
+import settings  # noqa: E402
+from model_registry import ModelRegistry  # noqa: E402
+from statement_t5_model import StatementT5  # noqa: E402
+
+DEFAULT_OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stubs")
+COMMON_FILES = ["tokenizer", "statement_t5_tokenizer", "repair_tokenizer", "label_map.pkl"]
+# the real models are RoBERTa-base and CodeT5-base, the stubs keep the number of attention heads of the line model
+# so that its attention output has the real shape
+ENCODER_CONFIG = {"num_hidden_layers": 1, "hidden_size": 48, "num_attention_heads": 12, "intermediate_size": 96,
+                  "max_position_embeddings": 514, "type_vocab_size": 1, "pad_token_id": 1}
+STATEMENT_CONFIG = {"num_layers": 1, "d_ff": 256, "d_kv": 32, "num_heads": 4}
+REPAIR_CONFIG = {"num_layers": 2, "num_decoder_layers": 2, "d_model": 64, "d_ff": 128, "d_kv": 16, "num_heads": 4}
+
+
+class StubClassifier(torch.nn.Module):
+    """ RoBERTa encoder with one linear head per output, softmax, sigmoid scaled to [0, 10] or the last attentions """
+
+    def __init__(self, vocab_size: int, heads: list):
+        super().__init__()
+        config = RobertaConfig(vocab_size=vocab_size, **ENCODER_CONFIG)
+        # attention probabilities are only returned by the eager implementation
+        config._attn_implementation = "eager"
+        self.encoder = RobertaModel(config, add_pooling_layer=False)
+        self.heads = heads
+        self.linears = torch.nn.ModuleList(torch.nn.Linear(config.hidden_size, size) for _, size in heads)
+
+    def forward(self, input_ids):
+        attention_mask = input_ids.ne(self.encoder.config.pad_token_id)
+        outputs = self.encoder(input_ids=input_ids, attention_mask=attention_mask, output_attentions=True, return_dict=False)
+        hidden_states, attentions = outputs[0], outputs[-1]
+        cls = hidden_states[:, 0]
+        outputs = []
+        for (kind, _), linear in zip(self.heads, self.linears):
+            if kind == "attentions":
+                outputs.append(attentions[-1])
+            elif kind == "score":
+                outputs.append(torch.sigmoid(linear(cls)) * 10)
+            else:
+                outputs.append(torch.softmax(linear(cls), dim=-1))
+        return tuple(outputs)
+
+
+def export_classifier(model: StubClassifier, output_names: list, path: str):
+    input_ids = torch.randint(3, model.encoder.config.vocab_size, (2, 16))
+    dynamic_axes = {"input_ids": {0: "batch", 1: "sequence"},
+                    **{name: ({0: "batch", 2: "sequence", 3: "sequence"} if name == "attentions" else {0: "batch"})
+                       for name in output_names}}
+    with torch.no_grad():
+        torch.onnx.export(model, (input_ids,), path, input_names=["input_ids"], output_names=output_names,
+                          dynamic_axes=dynamic_axes, opset_version=14)
+
+
+def write_common(common_dir: str) -> str:
+    """ copy tokenizers and label map from INFERENCE_COMMON_DIR and write shrunk T5 configs, returns the directory """
+    os.makedirs(common_dir, exist_ok=True)
+    for name in COMMON_FILES:
+        source, target = os.path.join(settings.INFERENCE_COMMON_DIR, name), os.path.join(common_dir, name)
+        if os.path.isdir(source):
+            shutil.copytree(source, target, dirs_exist_ok=True)
+        else:
+            shutil.copyfile(source, target)
+    for name, overrides in [("t5_config.json", STATEMENT_CONFIG), ("repair_model_config.json", REPAIR_CONFIG)]:
+        with open(os.path.join(settings.INFERENCE_COMMON_DIR, name)) as f:
+            config = json.load(f)
+        with open(os.path.join(common_dir, name), "w") as f:
+            json.dump({**config, **overrides}, f, indent=2)
+    return common_dir
+
+
+def write_models(output_dir: str):
+    """ write every stub model to ``output_dir``/models, with tokenizers and configs in ``output_dir``/inference-common """
+    common_dir = write_common(os.path.join(output_dir, "inference-common"))
+    models_dir = os.path.join(output_dir, "models")
+    os.makedirs(models_dir, exist_ok=True)
+    torch.manual_seed(0)
+
+    with open(os.path.join(common_dir, "label_map.pkl"), "rb") as f:
+        cwe_id_map, cwe_type_map = pickle.load(f)
+    vocab_size = len(RobertaTokenizer.from_pretrained(os.path.join(common_dir, "tokenizer")))
+    classifiers = {
+        "line": ([("probs", 2), ("attentions", 0)], ["prob", "attentions"]),
+        # the CWE tokenizer adds the <cls_type> token
+        "cwe": ([("probs", len(cwe_id_map)), ("probs", len(cwe_type_map))], ["cwe_id_prob", "cwe_type_prob"]),
+        "sev": ([("score", 1)], ["cvss"]),
+    }
+    for name, (heads, output_names) in classifiers.items():
+        model = StubClassifier(vocab_size + (name == "cwe"), heads).eval()
+        export_classifier(model, output_names, os.path.join(models_dir, f"{name}_model.onnx"))
+        print(f"Wrote {name}_model.onnx")
+
+    # the exports load the stubs back through a model registry pointed at the stub directories
+    registry = ModelRegistry(common_dir, models_dir)
+    statement = StatementT5(T5EncoderModel(T5Config.from_pretrained(os.path.join(common_dir, "t5_config.json"))),
+                            registry.statement_tokenizer(), device="cpu")
+    torch.save(statement.state_dict(), os.path.join(models_dir, "statement_t5_model.bin"))
+    export_statement_onnx.export(registry.statement_model(gpu=False), os.path.join(models_dir, "statement_t5_model.onnx"))
+    print("Wrote statement_t5_model.bin and statement_t5_model.onnx")
+
+    repair = T5ForConditionalGeneration(registry.repair_config())
+    repair.resize_token_embeddings(len(registry.repair_tokenizer()))
+    torch.save(repair.state_dict(), os.path.join(models_dir, "repair_model.bin"))
+    export_repair_onnx.export(registry.repair_model(gpu=False), models_dir)
+    print("Wrote repair_model.bin and its ONNX export")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2:
+        print(__doc__)
+        sys.exit(1)
+    write_models(sys.argv[1] if len(sys.argv) == 2 else DEFAULT_OUTPUT_DIR)
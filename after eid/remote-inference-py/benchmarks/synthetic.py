@@ -0,0 +1,43 @@
+import random
+
+STATEMENTS = [
+    "int i = 0;",
+    "char buf[64];",
+    "size_t len = strlen(input);",
+    "if (len > sizeof(buf)) {",
+    "    return -1;",
+    "}",
+    "strcpy(buf, input);",
+    "for (i = 0; i < n; i++) {",
+    "    total += values[i] * scale;",
+    "}",
+    "ptr = malloc(len + 1);",
+    "memcpy(ptr, input, len);",
+    "printf(\"%s\\n\", buf);",
+    "free(ptr);",
+    "while (node != NULL) {",
+    "    node = node->next;",
+    "}",
+    "return total;",
+]
+
+# number of statements per function for each length distribution
+DISTRIBUTIONS = {
+    "short": (3, 10),
+    "typical": (10, 25),
+    "long": (40, 80),
+    "mixed": (3, 80),
+}
+
+
+def synthetic_function(num_statements: int, rng: random.Random) -> str:
+    """ a C function with ``num_statements`` statements drawn from a fixed pool """
+    body = "\n".join("    " + rng.choice(STATEMENTS) for _ in range(num_statements))
+    return f"int func_{rng.randrange(10 ** 6)}(char *input, int *values, int n, int scale)\n{{\n{body}\n}}"
+
+
+def synthetic_functions(count: int, distribution: str = "typical", seed: int = 0) -> list:
+    """ ``count`` synthetic functions whose length follows one of ``DISTRIBUTIONS`` or is uniform in "LOW-HIGH" statements """
+    rng = random.Random(seed)
+    low, high = DISTRIBUTIONS[distribution] if distribution in DISTRIBUTIONS else map(int, distribution.split("-"))
+    return [synthetic_function(rng.randint(low, high), rng) for _ in range(count)]
@@ -0,0 +1,75 @@
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class ExecutorBusyError(Exception):
+    """ raised by :meth:`BoundedExecutor.submit` when its queue is full """
+
+    def __init__(self, name: str, retry_after: int):
+        super().__init__(f"{name} is at capacity, retry in {retry_after} s")
+        self.retry_after = retry_after
+
+
+class BoundedExecutor:
+    """Thread pool for model inference with a bounded number of waiting calls.
+
+    At most ``max_workers`` calls run at once and at most ``max_queue_size`` more wait
+    for a worker. Further calls are rejected with :class:`ExecutorBusyError` right away
+    instead of queueing without limit, so latency stays bounded under load.
+
+    Parameters
+    ----------
+    max_workers : int
+        Number of worker threads.
+    max_queue_size : int
+        Number of calls allowed to wait for a worker.
+    retry_after : int
+        Seconds suggested to rejected callers before retrying.
+    """
+
+    def __init__(self, max_workers: int = 8, max_queue_size: int = 64, retry_after: int = 1, name: str = "inference"):
+        self.max_workers = max(1, max_workers)
+        self.max_queue_size = max(0, max_queue_size)
+        self.retry_after = retry_after
+        self.name = name
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=name)
+        self._slots = threading.BoundedSemaphore(self.max_workers + self.max_queue_size)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    @property
+    def in_flight(self) -> int:
+        """ calls running or waiting for a worker """
+        return self._in_flight
+
+    @property
+    def queued(self) -> int:
+        """ calls waiting for a worker """
+        return max(0, self._in_flight - self.max_workers)
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """ run ``fn(*args, **kwargs)`` on a worker, raises :class:`ExecutorBusyError` if the queue is full """
+        if not self._slots.acquire(blocking=False):
+            raise ExecutorBusyError(self.name, self.retry_after)
+        with self._lock:
+            self._in_flight += 1
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release())
+        return future
+
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    async def run(self, fn, *args, **kwargs):
+        """ awaitable :meth:`submit` for async endpoints """
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
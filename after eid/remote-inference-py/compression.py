@@ -0,0 +1,210 @@
+"""gzip and zstd ``Content-Encoding`` of request and response bodies.
+
+:class:`ContentEncoding` decompresses request bodies sent with ``Content-Encoding: gzip``
+or ``zstd`` before the endpoints read them, refusing bodies that decompress to more than
+``max_size`` bytes with 413 so that small compressed bodies cannot exhaust memory.
+Other encodings are refused with 415 and corrupt bodies with 400. Responses of at least
+``min_size`` bytes are compressed with the encoding the ``Accept-Encoding`` header
+prefers, zstd over gzip when both are equally acceptable. Streamed responses are sent
+as they are, so their events are not held back.
+"""
+import gzip
+import json
+import zlib
+
+import zstandard
+
+ENCODINGS = ["zstd", "gzip"]
+
+
+class DecompressedTooLarge(Exception):
+    pass
+
+
+def decompress(encoding: str, body: bytes, max_size: int) -> bytes:
+    """ ``body`` decompressed, raises :class:`DecompressedTooLarge` past ``max_size`` bytes and ValueError if corrupt """
+    if encoding == "gzip":
+        chunks, size = [], 0
+        # a gzip body may hold several members, each is decompressed in turn
+        while body:
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            try:
+                chunk = decompressor.decompress(body, max_size - size + 1)
+            except zlib.error as e:
+                raise ValueError(f"Invalid gzip body: {e}")
+            size += len(chunk)
+            if size > max_size:
+                raise DecompressedTooLarge()
+            if not decompressor.eof:
+                raise ValueError("Invalid gzip body: truncated")
+            chunks.append(chunk)
+            body = decompressor.unused_data
+        return b"".join(chunks)
+    try:
+        with zstandard.ZstdDecompressor().stream_reader(body, read_across_frames=True) as reader:
+            chunks, size = [], 0
+            while size <= max_size:
+                chunk = reader.read(max_size - size + 1)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                size += len(chunk)
+    except zstandard.ZstdError as e:
+        raise ValueError(f"Invalid zstd body: {e}")
+    if size > max_size:
+        raise DecompressedTooLarge()
+    return b"".join(chunks)
+
+
+def compress(encoding: str, body: bytes, gzip_level: int, zstd_level: int) -> bytes:
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=gzip_level, mtime=0)
+    return zstandard.ZstdCompressor(level=zstd_level).compress(body)
+
+
+def accepted_encoding(accept_encoding: str) -> str:
+    """ the encoding of :data:`ENCODINGS` the ``Accept-Encoding`` header prefers, "" for none """
+    qualities = {}
+    for coding in accept_encoding.split(","):
+        name, *params = [part.strip() for part in coding.split(";")]
+        quality = 1.0
+        for param in params:
+            if param.replace(" ", "").lower().startswith("q="):
+                try:
+                    quality = float(param.split("=", 1)[1])
+                except ValueError:
+                    quality = 0.0
+        qualities[name.lower()] = quality
+    best, best_quality = "", 0.0
+    for encoding in ENCODINGS:
+        quality = qualities.get(encoding, qualities.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def header(headers: list, name: bytes) -> str:
+    for key, value in headers:
+        if key.lower() == name:
+            return value.decode("latin-1")
+    return ""
+
+
+async def send_error(send, status: int, message: str, headers: list = ()):
+    body = json.dumps({"error": message}).encode()
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                            *headers]})
+    await send({"type": "http.response.body", "body": body})
+
+
+class ContentEncoding:
+    """ASGI middleware decompressing request bodies and compressing responses.
+
+    Parameters
+    ----------
+    app
+        The wrapped ASGI app.
+    max_size : int
+        Largest accepted request body in bytes, compressed or after decompression.
+    min_size : int
+        Smallest response body in bytes that is compressed.
+    compress_responses : bool
+        Compress responses at all, request bodies are decompressed either way.
+    gzip_level, zstd_level : int
+        Compression levels of the responses.
+    """
+
+    def __init__(self, app, max_size: int, min_size: int = 1024, compress_responses: bool = True,
+                 gzip_level: int = 6, zstd_level: int = 3):
+        self.app = app
+        self.max_size = max_size
+        self.min_size = min_size
+        self.compress_responses = compress_responses
+        self.gzip_level = gzip_level
+        self.zstd_level = zstd_level
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        encoding = header(scope["headers"], b"content-encoding").strip().lower()
+        if encoding not in ("", "identity"):
+            if encoding not in ENCODINGS:
+                return await send_error(send, 415, f"Unsupported Content-Encoding {encoding}, use gzip or zstd",
+                                        [(b"accept-encoding", ", ".join(ENCODINGS).encode())])
+            body = await self.read_body(receive)
+            try:
+                body = decompress(encoding, body, self.max_size) if body is not None else None
+            except ValueError as e:
+                return await send_error(send, 400, str(e))
+            except DecompressedTooLarge:
+                body = None
+            if body is None:
+                return await send_error(send, 413, f"Request body larger than {self.max_size} bytes")
+            headers = [(key, value) for key, value in scope["headers"]
+                       if key.lower() not in (b"content-encoding", b"content-length")]
+            scope = {**scope, "headers": headers + [(b"content-length", str(len(body)).encode())]}
+            receive = self.replay(body, receive)
+
+        response_encoding = accepted_encoding(header(scope["headers"], b"accept-encoding"))
+        if not self.compress_responses or not response_encoding:
+            return await self.app(scope, receive, send)
+        await self.app(scope, receive, self.compressing_send(send, response_encoding))
+
+    async def read_body(self, receive):
+        """ the whole request body, None once it grows past ``max_size`` """
+        chunks, size = [], 0
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                break
+            chunks.append(message.get("body", b""))
+            size += len(chunks[-1])
+            if size > self.max_size:
+                return None
+            if not message.get("more_body", False):
+                break
+        return b"".join(chunks)
+
+    @staticmethod
+    def replay(body: bytes, receive):
+        """ receive callable handing out ``body`` at once, then waiting for the disconnect """
+        sent = False
+
+        async def replayed():
+            nonlocal sent
+            if sent:
+                return await receive()
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return replayed
+
+    def compressing_send(self, send, encoding: str):
+        start = None
+        streaming = False
+
+        async def compressed_send(message):
+            nonlocal start, streaming
+            if message["type"] == "http.response.start":
+                # held back until the first body part shows whether the response is streamed
+                start = message
+                return
+            if message["type"] != "http.response.body" or streaming:
+                return await send(message)
+            if start is not None:
+                start, first = None, start
+                body = message.get("body", b"")
+                headers = list(first.get("headers", []))
+                if message.get("more_body", False):
+                    streaming = True
+                elif len(body) >= self.min_size and not header(headers, b"content-encoding"):
+                    body = compress(encoding, body, self.gzip_level, self.zstd_level)
+                    vary = header(headers, b"vary")
+                    headers = [(key, value) for key, value in headers if key.lower() not in (b"content-length", b"vary")]
+                    headers += [(b"content-encoding", encoding.encode()), (b"content-length", str(len(body)).encode()),
+                                (b"vary", (vary + ", Accept-Encoding" if vary else "Accept-Encoding").encode())]
+                    message = {**message, "body": body}
+                await send({**first, "headers": headers})
+            await send(message)
+        return compressed_send
@@ -1,17 +1,118 @@
 import asyncio
 import json
-from transformers import RobertaTokenizer, T5ForConditionalGeneration, T5Config, T5EncoderModel
-from statement_t5_model import StatementT5
-import torch
-import onnxruntime
 import numpy as np
-import pickle
 from fastapi import FastAPI, Request
-import httpx
-from typing import List, Dict, Any, Optional
-import re
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from typing import List, Dict, Any, Optional, TYPE_CHECKING
+import threading
+import tempfile
+import time
+import orjson
+import metrics
+import response_formats
+import settings
+from batching import MicroBatcher
+from bounded_executor import BoundedExecutor, ExecutorBusyError
+from compression import ContentEncoding
+from fallback_repair import provide_fallback_repair
+from function_extraction import decode_source, extract_functions, tar_sources
+from inference_cache import InferenceCache, SingleFlight, content_key
+from line_scores import attention_token_sums, token_line_scores
+from memory_report import process_memory
+from model_registry import registry
+import onnx_generation
+from token_cache import TokenCache
+from windowing import combine_windows, normalize_window_scores, split_windows, stitch_token_scores
+
+if TYPE_CHECKING:
+    import httpx
 
 app = FastAPI()
+# tokenisation and inference of the predict, cwe, sev, statement and analyze endpoints, off the event loop
+inference_executor = BoundedExecutor(max_workers=settings.INFERENCE_WORKERS,
+                                     max_queue_size=settings.INFERENCE_QUEUE_SIZE,
+                                     retry_after=settings.INFERENCE_RETRY_AFTER)
+# runs the CWE model next to the severity model in main_analyze, one worker per inference worker since every
+# main_analyze call holds one of those; a call finding it full runs its CWE stage itself
+analysis_executor = BoundedExecutor(max_workers=settings.INFERENCE_WORKERS, max_queue_size=0, name="analyze")
+# per-function results of every endpoint, keyed by function text, endpoint and model digest
+inference_cache = InferenceCache(settings.INFERENCE_CACHE_SIZE, settings.INFERENCE_CACHE_PATH)
+# token ids of the statements seen so far, repeated lines are tokenised once
+statement_token_cache = TokenCache(settings.STATEMENT_TOKEN_CACHE_SIZE)
+
+OLLAMA_URL = "http://localhost:11434/api/generate"
+OLLAMA_MODEL = "deepseek-coder:6.7b-instruct"
+OLLAMA_OPTIONS = {
+    "temperature": 0.1,  # Lower temperature for more deterministic outputs
+    "top_p": 0.9
+}
+REPAIR_BACKENDS = ["ollama", "local"]
+# part of the repair cache key, bump it whenever the prompts of ollama_request change
+REPAIR_PROMPT_VERSION = 1
+# Ollama repairs by normalised code, model, prompt version and options, expiring after REPAIR_CACHE_TTL seconds
+repair_cache = InferenceCache(settings.REPAIR_CACHE_SIZE, settings.REPAIR_CACHE_PATH, settings.REPAIR_CACHE_TTL)
+# identical repairs requested at the same time share one Ollama call
+repair_flights = SingleFlight()
+# content types of /scan uploads read as (possibly compressed) tar archives
+TAR_CONTENT_TYPES = {"application/x-tar", "application/tar", "application/gzip", "application/x-gzip", "application/x-gtar",
+                     "application/x-compressed-tar", "application/x-bzip2", "application/x-xz"}
+# /scan uploads are kept in memory up to this size and written to a temporary file beyond it
+SCAN_SPOOL_SIZE = 1024 * 1024
+# keep-alive connections to Ollama and the limit on concurrent generations, created on first use by ollama_client
+ollama_http_client = None
+repair_semaphore = None
+
+
+@app.on_event("startup")
+def load_models():
+    # load every model once per process instead of once per request
+    registry.preload(settings.PRELOAD_MODELS, settings.PRELOAD_GPU)
+    print(registry.report())
+    metrics.start_sampling(settings.METRICS_SAMPLE_INTERVAL)
+
+
+@app.on_event("shutdown")
+def stop_batchers():
+    inference_executor.shutdown()
+    analysis_executor.shutdown()
+    for batcher in batchers.values():
+        batcher.close()
+
+
+@app.on_event("shutdown")
+async def close_ollama_client():
+    if ollama_http_client is not None:
+        await ollama_http_client.aclose()
+
+
+def ollama_client() -> "httpx.AsyncClient":
+    """ HTTP client shared by every Ollama call, keeping its connections alive between repairs """
+    # imported on the first repair, the inference endpoints never need it
+    import httpx
+    global ollama_http_client
+    if ollama_http_client is None or ollama_http_client.is_closed:
+        # no read timeout, generations are bounded by REPAIR_TIMEOUT per function instead
+        ollama_http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(30.0, read=None),
+            limits=httpx.Limits(max_connections=settings.REPAIR_CONCURRENCY,
+                                max_keepalive_connections=settings.REPAIR_CONCURRENCY))
+    return ollama_http_client
+
+
+def repair_slots() -> asyncio.Semaphore:
+    """ limit of concurrent Ollama generations, created on first use so it belongs to the serving event loop """
+    global repair_semaphore
+    if repair_semaphore is None:
+        repair_semaphore = asyncio.Semaphore(settings.REPAIR_CONCURRENCY)
+    return repair_semaphore
+
+
+@app.exception_handler(ExecutorBusyError)
+async def executor_busy(request: Request, exc: ExecutorBusyError):
+    # shed load instead of queueing requests without limit
+    return JSONResponse(status_code=503, content={"error": str(exc)},
+                        headers={"Retry-After": str(exc.retry_after)})
+
 
 def main_v2(code: list, gpu: bool = False) -> dict:
     """Generate statement-level and function-level vulnerability prediction probabilities.
@@ -24,61 +125,67 @@ def main_v2(code: list, gpu: bool = False) -> dict:
     Returns
     -------
     :obj:`dict`
-        A dictionary with two keys, "batch_vul_pred", "batch_vul_pred_prob", and "batch_line_scores"
+        A dictionary with four keys, "batch_func_pred", "batch_func_pred_prob", "batch_statement_pred" and "batch_statement_pred_prob"
         "batch_func_pred" stores a list of function-level vulnerability prediction: [0, 1, ...] where 0 means non-vulnerable and 1 means vulnerable
         "batch_func_pred_prob" stores a list of function-level vulnerability prediction probabilities [0.89, 0.75, ...] corresponding to "batch_func_pred"
-        "batch_statement_pred" stores a list of statement-level vulnerability prediction: [0, 1, ...] where 0 means non-vulnerable and 1 means vulnerable
-        "batch_statement_pred_prob" stores a list of statement-level vulnerability prediction probabilities [0.89, 0.75, ...] corresponding to "batch_statement_pred"
+        "batch_statement_pred" stores a 2D list of statement-level vulnerability prediction: [[0, 1, ...], ...] with one entry per non-empty line
+        of each function (up to 155), where 0 means non-vulnerable and 1 means vulnerable
+        "batch_statement_pred_prob" stores a 2D list of statement-level vulnerability prediction probabilities [[0.89, 0.75, ...], ...]
+        corresponding to "batch_statement_pred"
     """
     MAX_STATEMENTS = 155
     MAX_STATEMENT_LENGTH = 20
-    DEVICE = 'cuda' if gpu else 'cpu'
-    # load tokenizer
-    tokenizer = RobertaTokenizer.from_pretrained("./inference-common/statement_t5_tokenizer")
-    # load model
-    config = T5Config.from_pretrained("./inference-common/t5_config.json")
-    model = T5EncoderModel(config=config)    
-    model = StatementT5(model, tokenizer, device=DEVICE)
-    output_dir = "./models/statement_t5_model.bin"
-    model.load_state_dict(torch.load(output_dir, map_location=DEVICE))
-    model.to(DEVICE)
-    model.eval()
-    input_ids, statement_mask = statement_tokenization(code, MAX_STATEMENTS, MAX_STATEMENT_LENGTH, tokenizer)
-    with torch.no_grad():
-        statement_probs, func_probs = model(input_ids=input_ids, statement_mask=statement_mask)
-    func_preds = torch.argmax(func_probs, dim=-1)
-    statement_preds = torch.where(statement_probs>0.5, 1, 0)
-    return {"batch_func_pred": func_preds, "batch_func_pred_prob": func_probs,
-            "batch_statement_pred": statement_preds, "batch_statement_pred_prob": statement_probs}
+    # borrow tokenizer from the registry
+    tokenizer = registry.statement_tokenizer()
+    with metrics.stage_seconds.labels("statement", "tokenize").time():
+        input_ids, statement_mask = statement_tokenization(code, MAX_STATEMENTS, MAX_STATEMENT_LENGTH, tokenizer)
+    statement_probs, func_probs = statement_inference(input_ids, statement_mask, gpu)
+    start = time.perf_counter()
+    func_preds = np.argmax(func_probs, axis=-1)
+    # drop the padding statements
+    num_statements = statement_mask.sum(axis=1).tolist()
+    statement_probs = [probs[:n] for probs, n in zip(statement_probs.tolist(), num_statements)]
+    statement_preds = [[1 if prob > 0.5 else 0 for prob in probs] for probs in statement_probs]
+    metrics.stage_seconds.labels("statement", "labels").observe(time.perf_counter() - start)
+    return {"batch_func_pred": func_preds.tolist(),
+            "batch_func_pred_prob": func_probs[np.arange(len(func_probs)), func_preds].tolist(),
+            "batch_statement_pred": statement_preds,
+            "batch_statement_pred_prob": statement_probs}
+
+
+def statement_inference(input_ids: np.ndarray, statement_mask: np.ndarray, gpu: bool = False) -> tuple:
+    """ (statement probabilities [batch, statements], function probabilities [batch, 2]) as numpy arrays,
+    from the torch model or its ONNX export depending on ``settings.STATEMENT_BACKEND`` """
+    metrics.batch_size.labels("statement").observe(len(input_ids))
+    for tokens in (input_ids != registry.statement_tokenizer().pad_token_id).sum(axis=(1, 2)).tolist():
+        metrics.input_tokens.labels("statement").observe(tokens)
+    with metrics.stage_seconds.labels("statement", "session_run").time():
+        if settings.STATEMENT_BACKEND == "onnx":
+            session = registry.onnx_session("statement", gpu)
+            statement_probs, func_probs = session.run(None, {"input_ids": input_ids, "statement_mask": statement_mask})
+            return statement_probs, func_probs
+        import torch
+        model = registry.statement_model(gpu)
+        device = model.device
+        with torch.no_grad():
+            statement_probs, func_probs = model(input_ids=torch.from_numpy(input_ids).to(device),
+                                                statement_mask=torch.from_numpy(statement_mask).to(device))
+        return to_numpy(statement_probs), to_numpy(func_probs)
 
 def statement_tokenization(code: list, max_statements: int, max_statement_length: int, tokenizer):
-    batch_input_ids = []
-    batch_statement_mask = []
-    for c in code:
-        source = c.split("\n")
-        source = [statement for statement in source if statement != ""]
-        source = source[:max_statements]
-        padding_statement = [tokenizer.pad_token_id for _ in range(20)]
-        input_ids = []
-        for stat in source:
-            ids_ = tokenizer.encode(str(stat),
-                                    truncation=True,
-                                    max_length=max_statement_length,
-                                    padding='max_length',
-                                    add_special_tokens=False)
-            input_ids.append(ids_)
-        if len(input_ids) < max_statements:
-            for _ in range(max_statements-len(input_ids)):
-                input_ids.append(padding_statement)
-        statement_mask = []
-        for statement in input_ids:
-            if statement == padding_statement:
-                statement_mask.append(0)
-            else:
-                statement_mask.append(1)
-        batch_input_ids.append(input_ids)
-        batch_statement_mask.append(statement_mask)
-    return torch.tensor(batch_input_ids), torch.tensor(batch_statement_mask)
+    """ input ids [batch, max_statements, max_statement_length] of the non-empty lines of each function and the
+    statement mask [batch, max_statements], 0 for padding statements """
+    statements = [[statement for statement in c.split("\n") if statement != ""][:max_statements] for c in code]
+    # one tokenizer call for all statements of the request not cached yet
+    statement_ids = statement_token_cache.encode(tokenizer, [s for source in statements for s in source],
+                                                 max_statement_length)
+    input_ids = np.full((len(code), max_statements, max_statement_length), tokenizer.pad_token_id, dtype=np.int64)
+    for i, source in enumerate(statements):
+        for j, statement in enumerate(source):
+            ids_ = statement_ids[statement]
+            input_ids[i, j, :len(ids_)] = ids_
+    statement_mask = (input_ids != tokenizer.pad_token_id).any(axis=2).astype(np.int64)
+    return input_ids, statement_mask
 
 def main(code: list, gpu: bool = False) -> dict:
     """Generate vulnerability predictions and line scores.
@@ -96,104 +203,127 @@ def main(code: list, gpu: bool = False) -> dict:
         "batch_vul_pred_prob" stores a list of vulnerability prediction probabilities [0.89, 0.75, ...] corresponding to "batch_vul_pred"
         "batch_line_scores" stores line scores as a 2D list [[att_score_0, att_score_1, ..., att_score_n], ...]
     """
-    provider = ["CUDAExecutionProvider", "CPUExecutionProvider"] if gpu else ["CPUExecutionProvider"]
-    # load tokenizer
-    tokenizer = RobertaTokenizer.from_pretrained("./inference-common/tokenizer")
-    model_input = tokenizer(code, truncation=True, max_length=512, padding='max_length',
-                            return_tensors="pt").input_ids
-    # onnx runtime session
-    ort_session = onnxruntime.InferenceSession("./models/line_model.onnx", providers=provider)
-    # compute ONNX Runtime output prediction
-    ort_inputs = {ort_session.get_inputs()[0].name: to_numpy(model_input)}
-    prob, attentions = ort_session.run(None, ort_inputs)
-    # prepare token for attention line score mapping
-    batch_tokens = []
-    for mini_batch in model_input.tolist():
-        tokens = tokenizer.convert_ids_to_tokens(mini_batch)
-        tokens = [token.replace("Ġ", "") for token in tokens]
-        tokens = [token.replace("ĉ", "Ċ") for token in tokens]
-        batch_tokens.append(tokens)
-    batch_att_weight_sum = []
-    # access each layer
-    for j in range(len(attentions)):
-        att_weight_sum = None
-        att_of_one_func = attentions[j]
-        for i in range(len(attentions[0])):
-            layer_attention = att_of_one_func[i]
-            # summerize the values of each token dot other tokens
-            layer_attention = sum(layer_attention)
-            if att_weight_sum is None:
-                att_weight_sum = layer_attention
-            else:
-                att_weight_sum += layer_attention
-        # normalize attention score
-        att_weight_sum -= att_weight_sum.min()
-        att_weight_sum /= att_weight_sum.max()
-        batch_att_weight_sum.append(att_weight_sum)
+    return line_inference(tokenize_functions(code), gpu)
+
+
+def tokenize_functions(code: list, model: str = "line") -> list:
+    """ unpadded input ids of the functions as consumed by the line and severity models, only truncated to 512 tokens
+    when windowed inference is disabled, timed as the tokenize stage of ``model`` """
+    tokenizer = registry.line_tokenizer()
+    with metrics.stage_seconds.labels(model, "tokenize").time():
+        if settings.WINDOWED_INFERENCE:
+            return tokenizer(code, verbose=False).input_ids
+        return tokenizer(code, truncation=True, max_length=512).input_ids
+
+
+def length_buckets(input_ids: list, dynamic: bool) -> list:
+    """Group unpadded input ids into (indices, padded length) buckets.
+
+    Models exported with a fixed sequence length get one bucket padded to 512. Otherwise
+    every function goes to the smallest of ``settings.PADDING_BUCKETS`` it fits in and each
+    bucket is padded to its own longest function plus one pad token, so that every function
+    keeps at least one padding position like it had when padded to 512.
+    """
+    if not dynamic:
+        return [(list(range(len(input_ids))), 512)]
+    buckets = {}
+    for i, ids in enumerate(input_ids):
+        length = min(len(ids) + 1, 512)
+        edge = next((edge for edge in settings.PADDING_BUCKETS if length <= edge), 512)
+        buckets.setdefault(edge, []).append(i)
+    return [(indices, min(max(len(input_ids[i]) for i in indices) + 1, 512))
+            for _, indices in sorted(buckets.items())]
+
+
+def pad_input_ids(input_ids: list, length: int, pad_token_id: int) -> np.ndarray:
+    model_input = np.full((len(input_ids), length), pad_token_id, dtype=np.int64)
+    for row, ids in zip(model_input, input_ids):
+        row[:len(ids)] = ids[:length]
+    return model_input
+
+
+def run_bucketed(name: str, input_ids: list, pad_token_id: int, gpu: bool = False):
+    """ run the "line", "cwe" or "sev" session per length bucket, yields (indices, model input, outputs) """
+    ort_session = registry.onnx_session(name, gpu)
+    input_name = ort_session.get_inputs()[0].name
+    dynamic = settings.DYNAMIC_PADDING and registry.dynamic_length(name, gpu)
+    for indices, length in length_buckets(input_ids, dynamic):
+        model_input = pad_input_ids([input_ids[i] for i in indices], length, pad_token_id)
+        metrics.batch_size.labels(name).observe(len(indices))
+        for i in indices:
+            metrics.input_tokens.labels(name).observe(len(input_ids[i]))
+        with metrics.stage_seconds.labels(name, "session_run").time():
+            outputs = ort_session.run(None, {input_name: model_input})
+        yield indices, model_input, outputs
+
+
+def run_onnx(name: str, input_ids: list, pad_token_id: int, gpu: bool = False) -> list:
+    """ run the "cwe" or "sev" session over all length buckets, returns the outputs in input order """
+    order, bucket_outputs = [], []
+    for indices, _, outputs in run_bucketed(name, input_ids, pad_token_id, gpu):
+        order.extend(indices)
+        bucket_outputs.append(outputs)
+    inverse = np.argsort(order)
+    return [np.concatenate(output)[inverse] for output in zip(*bucket_outputs)]
+
+
+def run_windowed(name: str, input_ids: list, suffix_length: int, pad_token_id: int, gpu: bool = False) -> list:
+    """ run the "cwe" or "sev" session on inputs of any length, see :func:`line_inference` for the windowing """
+    windows, owners = split_windows(input_ids, 1, suffix_length, settings.WINDOW_OVERLAP)
+    outputs = run_onnx(name, windows, pad_token_id, gpu)
+    # the "max" rule keeps the window with the most confident prediction or the highest score
+    return [combine_windows(output, owners, len(input_ids), settings.WINDOW_COMBINE,
+                            key=lambda rows: rows.reshape(len(rows), -1).max(axis=1))
+            for output in outputs]
+
+
+def line_inference(input_ids: list, gpu: bool = False) -> dict:
+    """Line model inference on input ids from :func:`tokenize_functions`, see :func:`main` for the output.
+
+    Functions longer than 512 tokens are split into overlapping windows, all windows of the
+    batch go through the same session runs. The attention sums of the windows of a function are
+    normalised on one scale and stitched back together before summing them per line, so line
+    scores cover the whole function, and the window probabilities are combined with
+    ``settings.WINDOW_COMBINE``.
+    """
+    # borrow tokenizer from the registry
+    tokenizer = registry.line_tokenizer()
+    windows, owners = split_windows(input_ids, 1, 1, settings.WINDOW_OVERLAP)
+    window_prob = [None] * len(windows)
+    window_scores = [None] * len(windows)
+    # the attention stage covers the score computation of every bucket and the line sums
+    attention_seconds = 0.0
+    for indices, model_input, (prob, attentions) in run_bucketed("line", windows, tokenizer.pad_token_id, gpu):
+        start = time.perf_counter()
+        # padding positions cut off by dynamic padding, all padding positions share the same
+        # attention rows so the last (padding) row stands in for them
+        token_sums = attention_token_sums(attentions, missing_padding_rows=512 - model_input.shape[1])
+        for j, i in enumerate(indices):
+            window_prob[i] = prob[j]
+            window_scores[i] = token_sums[j]
+        attention_seconds += time.perf_counter() - start
+    start = time.perf_counter()
+    # "max" keeps the window most likely to be vulnerable
+    prob = combine_windows(np.array(window_prob), owners, len(input_ids), settings.WINDOW_COMBINE,
+                           key=lambda rows: rows[:, 1])
     # batch_line_scores (2D list with shape of [batch size, seq length]): [[att_score_0, att_score_1, ..., att_score_n], ...]
-    batch_line_scores = []
-    for i in range(len(batch_att_weight_sum)):
-        # clean att score for <s> and </s>
-        att_weight_sum = clean_special_token_values(batch_att_weight_sum[i], padding=True)
-        # attention should be 1D tensor with seq length representing each token's attention value
-        word_att_scores = get_word_att_scores(tokens=batch_tokens[i], att_scores=att_weight_sum)
-        line_scores = get_all_lines_score(word_att_scores)
-        batch_line_scores.append(line_scores)
+    window_scores = normalize_window_scores(window_scores, owners, len(input_ids))
+    scores = stitch_token_scores(input_ids, windows, owners, window_scores, 1, 1)
+    length = max(len(ids) for ids in input_ids) + 1
+    padded_scores = np.zeros((len(input_ids), length))
+    for row, function_scores in zip(padded_scores, scores):
+        row[:len(function_scores)] = function_scores
+    batch_line_scores = token_line_scores(pad_input_ids(input_ids, length, tokenizer.pad_token_id), padded_scores,
+                                          registry.newline_token_mask())
+    metrics.stage_seconds.labels("line", "attention").observe(attention_seconds + time.perf_counter() - start)
     # batch_vul_pred (1D list with shape of [batch size]): [pred_1, pred_2, ..., pred_n]
-    batch_vul_pred = np.argmax(prob, axis=-1).tolist()
+    batch_vul_pred = np.argmax(prob, axis=-1)
     # batch_vul_pred_prob (1D list with shape of [batch_size]): [prob_1, prob_2, ..., prob_n]
-    batch_vul_pred_prob = []
-    for i in range(len(prob)):
-        batch_vul_pred_prob.append(prob[i][batch_vul_pred[i]].item())  # .item() added to prevent 'Object of type float32 is not JSON serializable' error
-
-    return {"batch_vul_pred": batch_vul_pred, "batch_vul_pred_prob": batch_vul_pred_prob,
+    batch_vul_pred_prob = prob[np.arange(len(prob)), batch_vul_pred].tolist()
+    return {"batch_vul_pred": batch_vul_pred.tolist(), "batch_vul_pred_prob": batch_vul_pred_prob,
             "batch_line_scores": batch_line_scores}
 
 
-def get_word_att_scores(tokens: list, att_scores: list) -> list:
-    word_att_scores = []
-    for i in range(len(tokens)):
-        token, att_score = tokens[i], att_scores[i]
-        word_att_scores.append([token, att_score])
-    return word_att_scores
-
-
-def get_all_lines_score(word_att_scores: list):
-    # word_att_scores -> [[token, att_value], [token, att_value], ...]
-    separator = "Ċ"
-    # to return
-    all_lines_score = []
-    score_sum = 0
-    line_idx = 0
-    line = ""
-    for i in range(len(word_att_scores)):
-        # summerize if meet line separator or the last token
-        if ((separator in word_att_scores[i][0]) or (i == (len(word_att_scores) - 1))) and score_sum != 0:
-            score_sum += word_att_scores[i][1]
-            # append line score as float instead of tensor
-            all_lines_score.append(score_sum.item())
-            score_sum = 0
-            line_idx += 1
-        # else accumulate score
-        elif separator not in word_att_scores[i][0]:
-            line += word_att_scores[i][0]
-            score_sum += word_att_scores[i][1]
-    return all_lines_score
-
-
-def clean_special_token_values(all_values, padding=False):
-    # special token in the beginning of the seq 
-    all_values[0] = 0
-    if padding:
-        # get the last non-zero value which represents the att score for </s> token
-        idx = [index for index, item in enumerate(all_values) if item != 0][-1]
-        all_values[idx] = 0
-    else:
-        # special token in the end of the seq 
-        all_values[-1] = 0
-    return all_values
-
-
 def main_cwe(code: list, gpu: bool = False) -> dict:
     """Generate CWE-IDs and CWE Abstract Types Predictions.
     Parameters
@@ -211,28 +341,42 @@ def main_cwe(code: list, gpu: bool = False) -> dict:
         "cwe_type" stores a list of CWE abstract types predictions: ["Base", "Class", ...]
         "cwe_type_prob" stores a list of confidence scores of CWE abstract types predictions [0.9, 0.7, ...]
     """
-    provider = ["CUDAExecutionProvider", "CPUExecutionProvider"] if gpu else ["CPUExecutionProvider"]
-    with open("./inference-common/label_map.pkl", "rb") as f:
-        cwe_id_map, cwe_type_map = pickle.load(f)
-    # load tokenizer
-    tokenizer = RobertaTokenizer.from_pretrained("./inference-common/tokenizer")
-    tokenizer.add_tokens(["<cls_type>"])
-    tokenizer.cls_type_token = "<cls_type>"
+    tokenizer = registry.cwe_tokenizer()
     model_input = []
-    for c in code:
-        code_tokens = tokenizer.tokenize(str(c))[:512 - 3]
-        source_tokens = [tokenizer.cls_token] + code_tokens + [tokenizer.cls_type_token] + [tokenizer.sep_token]
-        input_ids = tokenizer.convert_tokens_to_ids(source_tokens)
-        padding_length = 512 - len(input_ids)
-        input_ids += [tokenizer.pad_token_id] * padding_length
-        model_input.append(input_ids)
-    device = "cuda" if gpu else "cpu"
-    model_input = torch.tensor(model_input, device=device)
-    # onnx runtime session
-    ort_session = onnxruntime.InferenceSession("./models/cwe_model.onnx", providers=provider)
+    with metrics.stage_seconds.labels("cwe", "tokenize").time():
+        for c in code:
+            code_tokens = tokenizer.tokenize(str(c))
+            if not settings.WINDOWED_INFERENCE:
+                code_tokens = code_tokens[:512 - 3]
+            source_tokens = [tokenizer.cls_token] + code_tokens + [tokenizer.cls_type_token] + [tokenizer.sep_token]
+            model_input.append(tokenizer.convert_tokens_to_ids(source_tokens))
+    return cwe_inference(model_input, gpu)
+
+
+def cwe_input_from_line_input(input_ids: list) -> list:
+    """Build CWE model input ids from line model input ids of the same functions.
+
+    Both models use the same tokenizer, the CWE model only adds the <cls_type> token
+    before </s> and keeps one code token less, so the code does not need to be tokenised again.
+    """
+    tokenizer = registry.cwe_tokenizer()
+    cls_type_id = tokenizer.convert_tokens_to_ids(tokenizer.cls_type_token)
+    cwe_input = []
+    for ids in input_ids:
+        # strip <s> and </s> from the line model input
+        code_ids = ids[1:-1] if settings.WINDOWED_INFERENCE else ids[1:-1][:512 - 3]
+        cwe_input.append([tokenizer.cls_token_id] + code_ids + [cls_type_id, tokenizer.sep_token_id])
+    return cwe_input
+
+
+def cwe_inference(input_ids: list, gpu: bool = False) -> dict:
+    """ CWE model inference on unpadded input ids including the <cls_type> token, see :func:`main_cwe` for the output """
+    # borrow label maps and tokenizer from the registry
+    cwe_id_map, cwe_type_map = registry.label_maps()
+    tokenizer = registry.cwe_tokenizer()
     # compute ONNX Runtime output prediction
-    ort_inputs = {ort_session.get_inputs()[0].name: to_numpy(model_input)}
-    cwe_id_prob, cwe_type_prob = ort_session.run(None, ort_inputs)
+    cwe_id_prob, cwe_type_prob = run_windowed("cwe", input_ids, 2, tokenizer.pad_token_id, gpu)
+    start = time.perf_counter()
     # batch_cwe_id_pred (1D list with shape of [batch size]): [pred_1, pred_2, ..., pred_n]
     batch_cwe_id = np.argmax(cwe_id_prob, axis=-1).tolist()
     # map predicted idx back to CWE-ID
@@ -249,6 +393,7 @@ def main_cwe(code: list, gpu: bool = False) -> dict:
     batch_cwe_type_pred_prob = []
     for i in range(len(cwe_type_prob)):
         batch_cwe_type_pred_prob.append(cwe_type_prob[i][batch_cwe_type[i]].item())
+    metrics.stage_seconds.labels("cwe", "labels").observe(time.perf_counter() - start)
     return {"cwe_id": batch_cwe_id_pred,
             "cwe_id_prob": batch_cwe_id_pred_prob,
             "cwe_type": batch_cwe_type_pred,
@@ -270,16 +415,15 @@ def main_sev(code: list, gpu: bool = False) -> dict:
         "batch_sev_score" stores a list of severity score prediction: [1.0, 5.0, 9.0 ...]
         "batch_sev_class" stores a list of severity class based on predicted severity score ["Medium", "Critical"...]
     """
-    provider = ["CUDAExecutionProvider", "CPUExecutionProvider"] if gpu else ["CPUExecutionProvider"]
-    # load tokenizer
-    tokenizer = RobertaTokenizer.from_pretrained("./inference-common/tokenizer")
-    model_input = tokenizer(code, truncation=True, max_length=512, padding='max_length',
-                            return_tensors="pt").input_ids
-    # onnx runtime session
-    ort_session = onnxruntime.InferenceSession("./models/sev_model.onnx", providers=provider)
+    return sev_inference(tokenize_functions(code, "sev"), gpu)
+
+
+def sev_inference(input_ids: list, gpu: bool = False) -> dict:
+    """ severity model inference on input ids from :func:`tokenize_functions`, see :func:`main_sev` for the output """
+    tokenizer = registry.line_tokenizer()
     # compute ONNX Runtime output prediction
-    ort_inputs = {ort_session.get_inputs()[0].name: to_numpy(model_input)}
-    cvss_score = ort_session.run(None, ort_inputs)
+    cvss_score = run_windowed("sev", input_ids, 1, tokenizer.pad_token_id, gpu)
+    start = time.perf_counter()
     batch_sev_score = list(cvss_score[0].flatten().tolist())
     batch_sev_class = []
     for i in range(len(batch_sev_score)):
@@ -293,16 +437,86 @@ def main_sev(code: list, gpu: bool = False) -> dict:
             batch_sev_class.append("High")
         else:
             batch_sev_class.append("Critical")
+    metrics.stage_seconds.labels("sev", "labels").observe(time.perf_counter() - start)
     return {"batch_sev_score": batch_sev_score, "batch_sev_class": batch_sev_class}
 
 
-def main_repair(code: list, max_repair_length: int = 256, gpu: bool = False) -> dict:
+def main_analyze(code: list, gpu: bool = False, cache: Optional[InferenceCache] = None) -> dict:
+    """Generate vulnerability predictions and line scores, then CWE and severity predictions for the vulnerable functions.
+    The code is tokenised once, the CWE and severity models run concurrently on the vulnerable functions only.
+    Parameters
+    ----------
+    code : :obj:`list`
+        A list of String functions.
+    gpu : bool
+        Defines if CUDA inference is enabled
+    cache : :obj:`InferenceCache`
+        Optional cache, the models then only run on functions without a cached result
+    Returns
+    -------
+    :obj:`dict`
+        A dictionary with four keys, "line", "vulnerable", "cwe" and "sev"
+        "line" stores the output of :func:`main` for all functions
+        "vulnerable" stores the indices of the functions predicted vulnerable: [0, 3, ...]
+        "cwe" stores the output of :func:`main_cwe` for the vulnerable functions, in the order of "vulnerable"
+        "sev" stores the output of :func:`main_sev` for the vulnerable functions, in the order of "vulnerable"
+    """
+    input_ids = {}
+    input_ids_lock = threading.Lock()
+
+    def encode(functions: list):
+        # tokenise each function once and share its input ids between the stages
+        with input_ids_lock:
+            new = [c for c in dict.fromkeys(functions) if c not in input_ids]
+            if new:
+                input_ids.update(zip(new, tokenize_functions(new)))
+            return [input_ids[c] for c in functions]
+
+    def run_line(functions: list) -> dict:
+        return line_inference(encode(functions), gpu)
+
+    def run_cwe(functions: list) -> dict:
+        if any("<cls_type>" in c for c in functions):
+            # the literal token would be split differently by the CWE tokenizer
+            return main_cwe(functions, gpu)
+        return cwe_inference(cwe_input_from_line_input(encode(functions)), gpu)
+
+    def run_sev(functions: list) -> dict:
+        return sev_inference(encode(functions), gpu)
+
+    def run_stage(name: str, run_batch, functions: list) -> dict:
+        if cache is None:
+            return run_batch(functions)
+        return cache.run(cache_namespace(name), functions, run_batch)
+
+    line = run_stage("predict", run_line, code)
+    vulnerable = [i for i, pred in enumerate(line["batch_vul_pred"]) if pred == 1]
+    if not vulnerable:
+        return {"line": line, "vulnerable": [],
+                "cwe": {"cwe_id": [], "cwe_id_prob": [], "cwe_type": [], "cwe_type_prob": []},
+                "sev": {"batch_sev_score": [], "batch_sev_class": []}}
+    vulnerable_code = [code[i] for i in vulnerable]
+    try:
+        cwe_future = analysis_executor.submit(run_stage, "cwe", run_cwe, vulnerable_code)
+    except ExecutorBusyError:
+        # main_analyze called outside the inference executor, e.g. by the benchmarks
+        cwe_future = None
+    sev = run_stage("sev", run_sev, vulnerable_code)
+    cwe = cwe_future.result() if cwe_future is not None else run_stage("cwe", run_cwe, vulnerable_code)
+    return {"line": line, "vulnerable": vulnerable, "cwe": cwe, "sev": sev}
+
+
+def main_repair(code: list, max_repair_length: int = settings.LOCAL_REPAIR_MAX_NEW_TOKENS, gpu: bool = False) -> dict:
     """Generate vulnerability repair candidates.
+
+    Functions are sorted by length and generated ``LOCAL_REPAIR_BATCH_SIZE`` at a time,
+    each batch padded to its longest function, greedily or with beam search depending
+    on ``LOCAL_REPAIR_NUM_BEAMS``.
     Parameters
     ----------
     code : :obj:`list`
         A list of String functions.
-    code : :obj:`int`
+    max_repair_length : :obj:`int`
         max number of tokens for each repair.
     gpu : bool
         Defines if CUDA inference is enabled
@@ -312,26 +526,46 @@ def main_repair(code: list, max_repair_length: int = 256, gpu: bool = False) ->
         A dictionary with one key, "batch_repair"
         "batch_repair" is a list of String, where each String is the repair for one code snippet.
     """
-    device = "cuda" if gpu else "cpu"
-    # load tokenizer
-    tokenizer = RobertaTokenizer.from_pretrained("./inference-common/repair_tokenizer")
-    tokenizer.add_tokens(["<S2SV_StartBug>", "<S2SV_EndBug>", "<S2SV_blank>", "<S2SV_ModStart>", "<S2SV_ModEnd>"])    
-    config = T5Config.from_pretrained("./inference-common/repair_model_config.json")
-    model = T5ForConditionalGeneration(config=config)
-    model.resize_token_embeddings(len(tokenizer))
-    model.load_state_dict(torch.load("./models/repair_model.bin", map_location=device))
-    model.eval()
-    input_ids = tokenizer(code, truncation=True, max_length=512, padding='max_length', return_tensors="pt").input_ids
-    input_ids = input_ids.to(device)
-    attention_mask = input_ids.ne(tokenizer.pad_token_id)
-    attention_mask = attention_mask.to(device)
-    gen_tokens = model.generate(input_ids=input_ids, attention_mask=attention_mask, max_new_tokens=max_repair_length)
-    batch_repair = tokenizer.batch_decode(gen_tokens)
-    for i in range(len(batch_repair)):
-        batch_repair[i] = clean_tokens(batch_repair[i])
+    # borrow tokenizer from the registry
+    tokenizer = registry.repair_tokenizer()
+    with metrics.stage_seconds.labels("repair", "tokenize").time():
+        input_ids = tokenizer(code, truncation=True, max_length=512).input_ids
+    order = sorted(range(len(code)), key=lambda i: len(input_ids[i]))
+    batch_repair = [None] * len(code)
+    for start in range(0, len(order), max(1, settings.LOCAL_REPAIR_BATCH_SIZE)):
+        indices = order[start:start + max(1, settings.LOCAL_REPAIR_BATCH_SIZE)]
+        model_input = pad_input_ids([input_ids[i] for i in indices], max(len(input_ids[i]) for i in indices),
+                                    tokenizer.pad_token_id)
+        metrics.batch_size.labels("repair").observe(len(indices))
+        for i in indices:
+            metrics.input_tokens.labels("repair").observe(len(input_ids[i]))
+        with metrics.stage_seconds.labels("repair", "generate").time():
+            gen_tokens = generate_repair_tokens(model_input, model_input != tokenizer.pad_token_id, max_repair_length, gpu)
+        with metrics.stage_seconds.labels("repair", "decode").time():
+            for i, repair in zip(indices, tokenizer.batch_decode(gen_tokens)):
+                batch_repair[i] = clean_tokens(repair)
     return {"batch_repair": batch_repair}
 
 
+def generate_repair_tokens(input_ids: np.ndarray, attention_mask: np.ndarray, max_new_tokens: int, gpu: bool = False) -> np.ndarray:
+    """ output ids of the repair model for one padded batch, from torch or the ONNX export per ``LOCAL_REPAIR_RUNTIME`` """
+    config = registry.repair_config()
+    if settings.LOCAL_REPAIR_RUNTIME == "onnx":
+        return onnx_generation.generate(*registry.repair_sessions(gpu), input_ids, attention_mask, max_new_tokens,
+                                        config.decoder_start_token_id, config.eos_token_id, config.pad_token_id,
+                                        num_beams=settings.LOCAL_REPAIR_NUM_BEAMS,
+                                        length_penalty=settings.LOCAL_REPAIR_LENGTH_PENALTY)
+    import torch
+    device = "cuda" if gpu else "cpu"
+    model = registry.repair_model(gpu)
+    with torch.no_grad():
+        gen_tokens = model.generate(input_ids=torch.from_numpy(input_ids).to(device),
+                                    attention_mask=torch.from_numpy(attention_mask).to(device),
+                                    max_new_tokens=max_new_tokens, num_beams=settings.LOCAL_REPAIR_NUM_BEAMS,
+                                    length_penalty=settings.LOCAL_REPAIR_LENGTH_PENALTY, do_sample=False, use_cache=True)
+    return gen_tokens.cpu().numpy()
+
+
 def clean_tokens(tokens):
     tokens = tokens.replace("<pad>", "")
     tokens = tokens.replace("<s>", "")
@@ -346,209 +580,714 @@ def to_numpy(tensor):
     return tensor.detach().cpu().numpy() if tensor.requires_grad else tensor.cpu().numpy()
 
 
+# one micro-batcher per model and device, merging the functions of concurrent requests into one session run
+batchers = {(name, gpu): MicroBatcher(lambda functions, fn=fn, gpu=gpu: fn(functions, gpu),
+                                      max_batch_size=settings.BATCH_MAX_SIZE,
+                                      max_wait_ms=settings.BATCH_MAX_WAIT_MS,
+                                      name=f"{name}-batcher-{'gpu' if gpu else 'cpu'}")
+            for name, fn in [("predict", main), ("cwe", main_cwe), ("sev", main_sev), ("statement", main_v2),
+                             ("repair", lambda code, gpu: main_repair(code, gpu=gpu))]
+            for gpu in (False, True)}
+metrics.gauge_function(metrics.queue_depth.labels("inference"), lambda: inference_executor.queued)
+for batcher in batchers.values():
+    metrics.gauge_function(metrics.queue_depth.labels(batcher.name), lambda batcher=batcher: batcher.pending)
+for kind in ("rss", "pss", "shared", "private"):
+    metrics.gauge_function(metrics.process_memory.labels(kind), lambda kind=kind: process_memory().get(kind, 0))
+
+
+def cache_namespace(name: str) -> str:
+    """ cache namespace of the "predict", "cwe", "sev" or "statement" endpoint, changes whenever the model weights change """
+    model = "line" if name == "predict" else name
+    namespace = f"{name}:{registry.model_digest(model)}"
+    if settings.WINDOWED_INFERENCE and name != "statement":
+        namespace += f":windowed-{settings.WINDOW_OVERLAP}-{settings.WINDOW_COMBINE}"
+    return namespace
+
+
+def run_batched(name: str, functions: list, gpu: bool) -> dict:
+    """ run "predict", "cwe", "sev" or "statement" inference for the functions of one request through the cache and its micro-batcher """
+    def run_misses(misses: list) -> dict:
+        if not settings.BATCHING_ENABLED:
+            return batchers[name, gpu].run_batch(misses)
+        return batchers[name, gpu].submit(misses).result()
+    return inference_cache.run(cache_namespace(name), functions, run_misses)
+
+
+def is_function_list(functions) -> bool:
+    """ whether a request body is a list of source strings, checked before anything is queued """
+    return isinstance(functions, list) and all(isinstance(function, str) for function in functions)
+
+
+def invalid_functions_response() -> JSONResponse:
+    return JSONResponse(status_code=400, content={"error": "Expected a JSON list of function source strings"})
+
+
+# returned by request_json for bodies that are not valid JSON, fails is_function_list
+INVALID_BODY = object()
+
+
+async def request_json(request: Request):
+    """ the JSON body of ``request``, or ``INVALID_BODY`` if it is not valid JSON (or not UTF-8) """
+    try:
+        return await request.json()
+    except ValueError:
+        return INVALID_BODY
+
+
+def serialize(name: str, result, request: Request) -> Response:
+    """ response of the ``name`` endpoint in the format the request accepts, timed as its serialize stage """
+    with metrics.stage_seconds.labels(name, "serialize").time():
+        return response_formats.render(result, request.headers.get("accept"), settings.JSON_STRING_RESPONSES)
+
+
+app.add_middleware(metrics.RequestTimer)
+app.add_middleware(ContentEncoding, max_size=settings.MAX_DECOMPRESSED_SIZE, min_size=settings.COMPRESSION_MIN_SIZE,
+                   compress_responses=settings.COMPRESSION_ENABLED, gzip_level=settings.GZIP_LEVEL,
+                   zstd_level=settings.ZSTD_LEVEL)
+
+
+@app.get('/metrics')
+def prometheus_metrics():
+    """ every metric in the Prometheus text exposition format, of all workers with PROMETHEUS_MULTIPROC_DIR """
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
 @app.post('/api/v1/gpu/predict')
-def predict_gpu(request: Request):
-    functions = asyncio.run(request.json())
+async def predict_gpu(request: Request):
+    functions = await request_json(request)
 
     if not functions:
         return {'error': 'No functions to process'}
+    elif not is_function_list(functions):
+        return invalid_functions_response()
     else:
-        result = json.dumps(main(functions, True))
-        return result
+        return serialize("predict", await inference_executor.run(run_batched, "predict", functions, True), request)
 
 
 @app.post('/api/v1/cpu/predict')
-def predict_cpu(request: Request):
-    functions = asyncio.run(request.json())
+async def predict_cpu(request: Request):
+    functions = await request_json(request)
 
     if not functions:
         return {'error': 'No functions to process'}
+    elif not is_function_list(functions):
+        return invalid_functions_response()
     else:
-        result = json.dumps(main(functions, False))
-        return result
+        return serialize("predict", await inference_executor.run(run_batched, "predict", functions, False), request)
 
 
 @app.post('/api/v1/gpu/cwe')
-def cwe_gpu(request: Request):
-    functions = asyncio.run(request.json())
+async def cwe_gpu(request: Request):
+    functions = await request_json(request)
 
     if not functions:
         return {'error': 'No code to process'}
+    elif not is_function_list(functions):
+        return invalid_functions_response()
     else:
-        result = json.dumps(main_cwe(functions, True))
-        return result
+        return serialize("cwe", await inference_executor.run(run_batched, "cwe", functions, True), request)
 
 
 @app.post('/api/v1/cpu/cwe')
-def cwe_cpu(request: Request):
-    functions = asyncio.run(request.json())
+async def cwe_cpu(request: Request):
+    functions = await request_json(request)
 
     if not functions:
         return {'error': 'No code to process'}
+    elif not is_function_list(functions):
+        return invalid_functions_response()
     else:
-        result = json.dumps(main_cwe(functions, False))
-        return result
+        return serialize("cwe", await inference_executor.run(run_batched, "cwe", functions, False), request)
 
 
 @app.post('/api/v1/gpu/sev')
-def sev_gpu(request: Request):
-    functions = asyncio.run(request.json())
+async def sev_gpu(request: Request):
+    functions = await request_json(request)
 
     if not functions:
         return {'error': 'No code to process'}
+    elif not is_function_list(functions):
+        return invalid_functions_response()
     else:
-        result = json.dumps(main_sev(functions, True))
-        return result
+        return serialize("sev", await inference_executor.run(run_batched, "sev", functions, True), request)
 
 
 @app.post('/api/v1/cpu/sev')
-def sev_cpu(request: Request):
-    functions = asyncio.run(request.json())
+async def sev_cpu(request: Request):
+    functions = await request_json(request)
 
     if not functions:
         return {'error': 'No code to process'}
+    elif not is_function_list(functions):
+        return invalid_functions_response()
+    else:
+        return serialize("sev", await inference_executor.run(run_batched, "sev", functions, False), request)
+
+
+@app.post('/api/v1/gpu/statement')
+async def statement_gpu(request: Request):
+    functions = await request_json(request)
+
+    if not functions:
+        return {'error': 'No functions to process'}
+    elif not is_function_list(functions):
+        return invalid_functions_response()
     else:
-        result = json.dumps(main_sev(functions, False))
-        return result
+        return serialize("statement", await inference_executor.run(run_batched, "statement", functions, True), request)
+
+
+@app.post('/api/v1/cpu/statement')
+async def statement_cpu(request: Request):
+    functions = await request_json(request)
+
+    if not functions:
+        return {'error': 'No functions to process'}
+    elif not is_function_list(functions):
+        return invalid_functions_response()
+    else:
+        return serialize("statement", await inference_executor.run(run_batched, "statement", functions, False), request)
+
+
+@app.post('/api/v1/gpu/analyze')
+async def analyze_gpu(request: Request):
+    functions = await request_json(request)
+
+    if not functions:
+        return {'error': 'No functions to process'}
+    elif not is_function_list(functions):
+        return invalid_functions_response()
+    else:
+        return serialize("analyze", await inference_executor.run(main_analyze, functions, True, inference_cache), request)
+
+
+@app.post('/api/v1/cpu/analyze')
+async def analyze_cpu(request: Request):
+    functions = await request_json(request)
+
+    if not functions:
+        return {'error': 'No functions to process'}
+    elif not is_function_list(functions):
+        return invalid_functions_response()
+    else:
+        return serialize("analyze", await inference_executor.run(main_analyze, functions, False, inference_cache), request)
+
+
+@app.post('/api/v1/gpu/scan')
+async def scan_gpu(request: Request):
+    return await scan_request(request, gpu=True)
+
+
+@app.post('/api/v1/cpu/scan')
+async def scan_cpu(request: Request):
+    return await scan_request(request, gpu=False)
+
+
+async def scan_request(request: Request, gpu: bool):
+    """ analyse a C/C++ file, or a tar archive of them, streaming NDJSON records as they are analysed """
+    params = request.query_params
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    archive = params.get("format", "tar" if content_type in TAR_CONTENT_TYPES else "source").lower() == "tar"
+    max_size = settings.SCAN_MAX_UPLOAD_SIZE if archive else settings.SCAN_MAX_FILE_SIZE
+    # spooled to disk so that the upload is never held in memory as a whole
+    upload = tempfile.SpooledTemporaryFile(max_size=SCAN_SPOOL_SIZE)
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > max_size:
+            upload.close()
+            return JSONResponse(status_code=413, content={"error": f"Upload larger than {max_size} bytes"})
+        upload.write(chunk)
+    upload.seek(0)
+    if archive:
+        files = tar_sources(upload, settings.SCAN_MAX_FILE_SIZE)
+    else:
+        text = decode_source(upload.read())
+        files = iter([(params.get("filename", "input"), text, None if text is not None else "Binary file, skipped")])
+    print(f"Received {size} bytes to scan as {'a tar archive' if archive else 'a source file'}")
+    return StreamingResponse(scan_records(files, upload, gpu), media_type="application/x-ndjson")
+
+
+def scan_chunks(files, chunk_size: int):
+    """ lists of ("function", path, ExtractedFunction) and ("error", path, message) items with ``chunk_size`` functions each """
+    items, functions = [], 0
+    for path, text, error in files:
+        if text is None:
+            items.append(("error", path, error))
+            continue
+        items.append(("file", path, None))
+        for function in extract_functions(text):
+            items.append(("function", path, function))
+            functions += 1
+            if functions == chunk_size:
+                yield items
+                items, functions = [], 0
+    if items:
+        yield items
+
+
+async def scan_records(files, upload, gpu: bool):
+    """Analyse the functions of ``files`` chunk by chunk and yield their NDJSON records.
+
+    Functions are extracted in a worker thread and analysed by :func:`main_analyze`,
+    ``SCAN_CHUNK_SIZE`` at a time, so memory holds one file and one chunk at most.
+    Every function gets a "function" record with its file, name, first and last line,
+    vulnerability prediction, the file lines of its scored lines with their "line_scores"
+    (float32, like the other endpoints), and the CWE and severity predictions if it is
+    vulnerable. Files that cannot be read get an "error" record,
+    and the stream ends with a "done" record counting files, functions, vulnerable
+    functions and errors.
+    """
+    loop = asyncio.get_running_loop()
+    chunks = scan_chunks(files, settings.SCAN_CHUNK_SIZE)
+    counts = {"files": 0, "functions": 0, "vulnerable": 0, "errors": 0}
+    try:
+        while True:
+            try:
+                items = await loop.run_in_executor(None, next, chunks, None)
+            except Exception as e:
+                # an archive that cannot be read any further
+                counts["errors"] += 1
+                yield orjson.dumps({"event": "error", "file": None, "error": f"Could not read the upload: {e}"}) + b"\n"
+                break
+            if items is None:
+                break
+            functions = [function for kind, _, function in items if kind == "function"]
+            result = None
+            while functions:
+                try:
+                    result = await inference_executor.run(main_analyze, [function.code for function in functions], gpu,
+                                                          inference_cache)
+                    break
+                except ExecutorBusyError as e:
+                    # a stream waits for a free worker instead of failing halfway
+                    await asyncio.sleep(e.retry_after)
+            with metrics.stage_seconds.labels("scan", "serialize").time():
+                records = b"".join(scan_chunk_records(items, result, counts))
+            yield records
+        yield orjson.dumps({"event": "done", **counts}) + b"\n"
+    finally:
+        upload.close()
+
+
+def scan_chunk_records(items: list, result: Optional[dict], counts: dict) -> list:
+    """ NDJSON lines of the "function" and "error" items of a chunk of :func:`scan_chunks`, given the :func:`main_analyze` result of its functions """
+    records = []
+    line = result["line"] if result else None
+    vulnerable = {index: position for position, index in enumerate(result["vulnerable"])} if result else {}
+    index = 0
+    for kind, path, function in items:
+        if kind == "file":
+            counts["files"] += 1
+            continue
+        if kind == "error":
+            counts["files"] += 1
+            counts["errors"] += 1
+            records.append({"event": "error", "file": path, "error": function})
+            continue
+        scores = line["batch_line_scores"][index]
+        record = {"event": "function", "file": path, "name": function.name, "start_line": function.start_line,
+                  "end_line": function.end_line, "vulnerable": line["batch_vul_pred"][index] == 1,
+                  "vul_pred_prob": line["batch_vul_pred_prob"][index],
+                  "lines": function.lines[:len(scores)], "line_scores": np.asarray(scores[:len(function.lines)], dtype=np.float32),
+                  "cwe": None, "sev": None}
+        if index in vulnerable:
+            position = vulnerable[index]
+            cwe, sev = result["cwe"], result["sev"]
+            record["cwe"] = {"cwe_id": cwe["cwe_id"][position], "cwe_id_prob": cwe["cwe_id_prob"][position],
+                             "cwe_type": cwe["cwe_type"][position], "cwe_type_prob": cwe["cwe_type_prob"][position]}
+            record["sev"] = {"sev_score": sev["batch_sev_score"][position], "sev_class": sev["batch_sev_class"][position]}
+            counts["vulnerable"] += 1
+        counts["functions"] += 1
+        records.append(record)
+        index += 1
+    return [orjson.dumps(record, option=orjson.OPT_SERIALIZE_NUMPY) + b"\n" for record in records]
+
+
+@app.get('/api/v1/cache/stats')
+def cache_stats():
+    return {**inference_cache.stats(), "statement_tokens": statement_token_cache.stats(),
+            "repair": {**repair_cache.stats(), "in_flight": repair_flights.in_flight}}
+
+
+def repair_functions(request_data) -> list:
+    """ functions to repair from the body of a repair request """
+    functions = []
+    if isinstance(request_data, dict) and "code" in request_data:
+        # Handle {"code": "..."} format
+        if isinstance(request_data["code"], str):
+            functions = [request_data["code"]]
+        elif isinstance(request_data["code"], list):
+            functions = request_data["code"]
+    elif isinstance(request_data, list):
+        # Handle direct list format
+        functions = request_data
+    else:
+        # Try to extract code from the request if it's a string
+        try:
+            if isinstance(request_data, str):
+                # Try to parse as JSON if it's a string
+                parsed = json.loads(request_data)
+                if isinstance(parsed, dict) and "code" in parsed:
+                    if isinstance(parsed["code"], str):
+                        functions = [parsed["code"]]
+                    elif isinstance(parsed["code"], list):
+                        functions = parsed["code"]
+                elif isinstance(parsed, list):
+                    functions = parsed
+        except json.JSONDecodeError:
+            # If it's a raw string that's not JSON, treat it as code
+            if isinstance(request_data, str) and len(request_data) > 10:  # Minimum code length check
+                functions = [request_data]
+    return functions
 
 
 @app.post('/api/v1/gpu/repair')
 async def repair_gpu(request: Request):
+    return await repair_request(request, gpu=True)
+
+
+@app.post('/api/v1/cpu/repair')
+async def repair_cpu(request: Request):
+    # Ollama handles its own compute resources, the flag only picks the device of the local model
+    return await repair_request(request, gpu=False)
+
+
+async def repair_request(request: Request, gpu: bool):
     try:
         # Check if raw mode is requested (directly return code without JSON wrapper)
         params = request.query_params
         raw_mode = params.get("raw", "").lower() in ["true", "1", "yes", "y"]
+        # Check if streaming is requested, as server-sent events or as newline-delimited JSON
+        stream_mode = params.get("stream", "").lower()
+        # Ollama, or the fine-tuned repair model running in this process
+        backend = params.get("backend", settings.REPAIR_BACKEND).lower()
+        if backend not in REPAIR_BACKENDS:
+            error_msg = f"Unknown repair backend '{backend}', expected one of {REPAIR_BACKENDS}"
+            return error_msg if raw_mode else {"error": error_msg}
         
         # Parse the request body
-        request_data = await request.json()
+        request_data = await request_json(request)
+        if request_data is INVALID_BODY:
+            return invalid_functions_response()
         
         # Handle different input formats
-        functions = []
-        if isinstance(request_data, dict) and "code" in request_data:
-            # Handle {"code": "..."} format
-            if isinstance(request_data["code"], str):
-                functions = [request_data["code"]]
-            elif isinstance(request_data["code"], list):
-                functions = request_data["code"]
-        elif isinstance(request_data, list):
-            # Handle direct list format
-            functions = request_data
-        else:
-            # Try to extract code from the request if it's a string
-            try:
-                if isinstance(request_data, str):
-                    # Try to parse as JSON if it's a string
-                    parsed = json.loads(request_data)
-                    if isinstance(parsed, dict) and "code" in parsed:
-                        if isinstance(parsed["code"], str):
-                            functions = [parsed["code"]]
-                        elif isinstance(parsed["code"], list):
-                            functions = parsed["code"]
-                    elif isinstance(parsed, list):
-                        functions = parsed
-            except json.JSONDecodeError:
-                # If it's a raw string that's not JSON, treat it as code
-                if isinstance(request_data, str) and len(request_data) > 10:  # Minimum code length check
-                    functions = [request_data]
+        functions = repair_functions(request_data)
 
         if not functions:
             error_msg = 'No code to process. Please provide code in the request body.'
-            return error_msg if raw_mode else json.dumps({'error': error_msg})
+            return error_msg if raw_mode else {'error': error_msg}
         
         # Log the received code for debugging
         print(f"Received code for repair: {functions[:1]} (total: {len(functions)} functions)")
-        
-        repairs = []
-        for code in functions:
-            if not isinstance(code, str):
-                # Skip non-string inputs
-                repairs.append("Error: Invalid input type. Expected string.")
-                continue
-                
-            if not code or code.strip() == "":
-                # Skip empty code
-                repairs.append("Error: Empty code provided.")
-                continue
-                
-            try:
-                repaired_code = await call_ollama(code)
-
-                # Enhanced error check: Check for explicit "Error:" prefix OR if the response doesn't look like code
-                is_error_response = repaired_code.startswith("Error:")
-                # Heuristic check: does it contain common C/C++ keywords or structures, or is it reasonably long?
-                looks_like_code = any(keyword in repaired_code for keyword in ["int ", "void ", "#include", "char ", "float ", "return ", "{", "}"]) or len(repaired_code) >= 50
-                
-                if is_error_response or not looks_like_code:
-                    print(f"Ollama response indicated an error or did not look like code: {repaired_code[:100]}...") # Log the problematic response
-                    # Provide a basic repair suggestion
-                    repaired_code = provide_fallback_repair(code)
-                    repairs.append(repaired_code) # Append fallback code directly
-                else:
-                    # Response seems valid, proceed with cleanup
-                    # Remove any leading comments with "FIXED:" or similar
-                    lines = repaired_code.split('\n')
-                    removed_comments = False 
-                    while lines and ("/* FIXED:" in lines[0] or "/*FIXED" in lines[0] or "/* SECURITY" in lines[0]):
-                        lines.pop(0)
-                        removed_comments = True
-                    
-                    repaired_code = '\n'.join(lines).strip()
-
-                    # Final check: if after stripping comments, the code is empty, use fallback
-                    if not repaired_code and removed_comments:
-                         print("Repaired code became empty after removing comments, using fallback.")
-                         repaired_code = provide_fallback_repair(code)
-                    
-                    repairs.append(repaired_code) # Append processed or fallback code
 
-            except Exception as e:
-                error_msg = f"Error processing code segment: {str(e)}"
-                print(error_msg)
-                # If individual repair fails during processing (e.g., within this try block but after call_ollama), provide fallback
-                repaired_code = provide_fallback_repair(code)
-                repairs.append(repaired_code)
+        if stream_mode == "sse":
+            return StreamingResponse(stream_repairs(functions, sse=True, backend=backend, gpu=gpu),
+                                     media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+        if stream_mode in ["ndjson", "true", "1", "yes", "y"]:
+            return StreamingResponse(stream_repairs(functions, sse=False, backend=backend, gpu=gpu),
+                                     media_type="application/x-ndjson")
+        
+        start = time.perf_counter()
+        if backend == "local":
+            # one batched generation for all functions not cached yet
+            repairs, timings = await inference_executor.run(local_repairs, functions, gpu)
+        else:
+            # repair all functions concurrently, at most REPAIR_CONCURRENCY at a time, in input order
+            repairs, timings = zip(*await asyncio.gather(*[repair_function(code) for code in functions]))
+        print(f"Repaired {len(functions)} functions in {time.perf_counter() - start:.2f} s with {backend}, "
+              f"time per function: {[timing['repair_ms'] for timing in timings]} ms")
         
         # If raw mode and single repair, return just the code
         if raw_mode and len(repairs) == 1:
             return repairs[0]
             
         # Otherwise return the standard JSON format
-        result = {"batch_repair": repairs}
-        return json.dumps(result)
+        result = {"batch_repair": list(repairs), "batch_timings": list(timings)}
+        return serialize("repair", result, request)
     except Exception as e:
         error_msg = f"Error processing request: {str(e)}"
         print(error_msg)
-        return error_msg if raw_mode else json.dumps({"error": error_msg})
+        return error_msg if raw_mode else {"error": error_msg}
 
 
-@app.post('/api/v1/cpu/repair')
-async def repair_cpu(request: Request):
-    # For simplicity, we'll use the same implementation as GPU
-    # since Ollama handles the compute resources
-    return await repair_gpu(request)
+def invalid_repair_input(code) -> Optional[str]:
+    """ error message for inputs that are not repaired at all, None for valid code """
+    if not isinstance(code, str):
+        # Skip non-string inputs
+        return "Error: Invalid input type. Expected string."
+    if not code or code.strip() == "":
+        # Skip empty code
+        return "Error: Empty code provided."
+    return None
 
 
-async def call_ollama(code: str, system_prompt: str = "") -> str:
-    """Call Ollama API to generate code repairs.
+def normalize_code(code: str) -> str:
+    """ code with unified line endings and without trailing whitespace or surrounding blank lines """
+    lines = code.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip("\n")
+
+
+def repair_cache_key(code: str) -> str:
+    namespace = f"repair:{OLLAMA_MODEL}:{REPAIR_PROMPT_VERSION}:{json.dumps(OLLAMA_OPTIONS, sort_keys=True)}"
+    return content_key(namespace, normalize_code(code))
+
+
+def looks_like_code(text: str) -> bool:
+    """ heuristic check of an Ollama response: does it contain common C/C++ keywords or structures, or is it reasonably long? """
+    return any(keyword in text for keyword in ["int ", "void ", "#include", "char ", "float ", "return ", "{", "}"]) or len(text) >= 50
+
+
+def finalize_repair(code: str, repaired_code: str) -> str:
+    """Turn the completed output of :func:`call_ollama` into the repair returned to the client.
+
+    Error responses and responses that do not look like code are replaced by
+    :func:`provide_fallback_repair`, other responses are cleaned up and cached.
+    This is the only place deciding on the fallback, which is never cached.
+    """
+    # Enhanced error check: Check for explicit "Error:" prefix OR if the response doesn't look like code
+    is_error_response = repaired_code.startswith("Error:")
     
-    Parameters
-    ----------
-    code : str
-        The code to repair
-    system_prompt : str
-        Optional system prompt to guide the model
-        
+    if is_error_response or not looks_like_code(repaired_code):
+        print(f"Ollama response indicated an error or did not look like code: {repaired_code[:100]}...") # Log the problematic response
+        # Provide a basic repair suggestion
+        metrics.repairs.labels("ollama", "fallback").inc()
+        return provide_fallback_repair(code)
+
+    # Response seems valid, proceed with cleanup
+    # Remove any leading comments with "FIXED:" or similar
+    lines = repaired_code.split('\n')
+    removed_comments = False 
+    while lines and ("/* FIXED:" in lines[0] or "/*FIXED" in lines[0] or "/* SECURITY" in lines[0]):
+        lines.pop(0)
+        removed_comments = True
+    
+    repaired_code = '\n'.join(lines).strip()
+
+    # Final check: if after stripping comments, the code is empty, use fallback
+    if not repaired_code and removed_comments:
+         print("Repaired code became empty after removing comments, using fallback.")
+         metrics.repairs.labels("ollama", "fallback").inc()
+         return provide_fallback_repair(code)
+    # only cache model repairs, fallbacks are retried once Ollama is reachable again
+    repair_cache.put(repair_cache_key(code), {"repair": repaired_code})
+    metrics.repairs.labels("ollama", "model").inc()
+    return repaired_code
+
+
+async def repair_function(code, on_token=None) -> tuple:
+    """Repair one function of a repair request, from the cache or from Ollama.
+
+    Waits for one of the ``REPAIR_CONCURRENCY`` slots first, the Ollama call then has
+    ``REPAIR_TIMEOUT`` seconds before the fallback repair is used instead. When
+    ``on_token`` is given the repair is streamed and ``on_token`` is awaited with
+    every chunk generated by Ollama.
+
     Returns
     -------
-    str
-        The repaired code
+    :obj:`tuple`
+        (repair, timing), where timing holds the milliseconds spent waiting for a slot ("wait_ms"),
+        repairing ("repair_ms"), whether the repair came from the cache ("cached") and whether it
+        was generated for a concurrent identical request ("shared")
     """
-    OLLAMA_URL = "http://localhost:11434/api/generate"
-    
-    # Check if code is empty or None
-    if not code or code.strip() == "":
-        return "Error: No code provided for repair"
-        
+    timing = {"wait_ms": 0.0, "repair_ms": 0.0, "cached": False, "shared": False}
+    invalid = invalid_repair_input(code)
+    if invalid is not None:
+        metrics.repairs.labels("ollama", "invalid").inc()
+        return invalid, timing
+    key = repair_cache_key(code)
+    cached = repair_cache.get(key)
+    if cached is not None:
+        metrics.repairs.labels("ollama", "cache").inc()
+        timing["cached"] = True
+        return cached["repair"], timing
+    (repair, timing), shared = await repair_flights.run(key, lambda: generate_repair(code, timing, on_token))
+    if shared:
+        metrics.repairs.labels("ollama", "shared").inc()
+    return repair, {**timing, "shared": shared}
+
+
+def local_repair_namespace() -> str:
+    """ repair cache namespace of the local model, changes with its weights and generation settings """
+    generation = {"max_new_tokens": settings.LOCAL_REPAIR_MAX_NEW_TOKENS, "num_beams": settings.LOCAL_REPAIR_NUM_BEAMS,
+                  "length_penalty": settings.LOCAL_REPAIR_LENGTH_PENALTY}
+    return f"repair:local:{registry.model_digest('repair')}:{json.dumps(generation, sort_keys=True)}"
+
+
+def local_repairs(functions: list, gpu: bool = False) -> tuple:
+    """Repair the functions of one request with the local model, the counterpart of :func:`repair_function`.
+
+    Repairs are cached in the repair cache like Ollama repairs. The functions not cached
+    yet go to the "repair" micro-batcher together, so concurrent requests share batches.
+    Empty generations are replaced by :func:`provide_fallback_repair` and not cached.
+
+    Returns
+    -------
+    :obj:`tuple`
+        (repairs, timings) with one entry per function, timings as returned by :func:`repair_function`
+    """
+    repairs = [invalid_repair_input(code) for code in functions]
+    timings = [{"wait_ms": 0.0, "repair_ms": 0.0, "cached": False, "shared": False} for _ in functions]
+    namespace = local_repair_namespace()
+    misses = {}
+    for i, code in enumerate(functions):
+        if repairs[i] is not None:
+            metrics.repairs.labels("local", "invalid").inc()
+            continue
+        key = content_key(namespace, normalize_code(code))
+        cached = repair_cache.get(key)
+        if cached is not None:
+            metrics.repairs.labels("local", "cache").inc()
+            repairs[i] = cached["repair"]
+            timings[i]["cached"] = True
+        else:
+            # identical functions within the request are generated once
+            timings[i]["shared"] = key in misses
+            misses.setdefault(key, []).append(i)
+    if misses:
+        start = time.perf_counter()
+        code = [normalize_code(functions[indices[0]]) for indices in misses.values()]
+        if settings.BATCHING_ENABLED:
+            generated = batchers["repair", gpu].submit(code).result()["batch_repair"]
+        else:
+            generated = batchers["repair", gpu].run_batch(code)["batch_repair"]
+        repair_ms = round((time.perf_counter() - start) * 1000, 1)
+        repair_cache.put_many({key: {"repair": repair} for key, repair in zip(misses, generated) if repair})
+        for (key, indices), repair in zip(misses.items(), generated):
+            if repair:
+                metrics.repairs.labels("local", "model").inc()
+            else:
+                print("The local repair model generated an empty repair, using fallback.")
+                metrics.repairs.labels("local", "fallback").inc()
+                repair = provide_fallback_repair(functions[indices[0]])
+            metrics.repairs.labels("local", "shared").inc(len(indices) - 1)
+            for i in indices:
+                repairs[i] = repair
+                timings[i]["repair_ms"] = repair_ms
+    return repairs, timings
+
+
+async def generate_repair(code: str, timing: dict, on_token=None) -> tuple:
+    """ Ollama part of :func:`repair_function` """
+    start = time.perf_counter()
+    waiting = metrics.queue_depth.labels("ollama")
+    waiting.inc()
+    try:
+        await repair_slots().acquire()
+    finally:
+        waiting.dec()
+    try:
+        timing["wait_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        start = time.perf_counter()
+        outcome = "ok"
+        try:
+            if on_token is None:
+                repaired_code = await asyncio.wait_for(call_ollama(code), settings.REPAIR_TIMEOUT)
+            else:
+                repaired_code = await asyncio.wait_for(stream_ollama_repair(code, on_token), settings.REPAIR_TIMEOUT)
+            if repaired_code.startswith("Error"):
+                outcome = "error"
+            repair = finalize_repair(code, repaired_code)
+        except asyncio.TimeoutError:
+            print(f"Repair timed out after {settings.REPAIR_TIMEOUT} s, using fallback.")
+            outcome = "timeout"
+            metrics.repairs.labels("ollama", "fallback").inc()
+            repair = provide_fallback_repair(code)
+        except Exception as e:
+            error_msg = f"Error processing code segment: {str(e)}"
+            print(error_msg)
+            outcome = "error"
+            # If individual repair fails during processing (e.g., within this try block but after call_ollama), provide fallback
+            metrics.repairs.labels("ollama", "fallback").inc()
+            repair = provide_fallback_repair(code)
+        metrics.ollama_seconds.labels(outcome).observe(time.perf_counter() - start)
+        timing["repair_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    finally:
+        repair_slots().release()
+    return repair, timing
+
+
+async def stream_ollama_repair(code: str, on_token) -> str:
+    """ stream the Ollama repair of ``code`` through ``on_token`` and return the completed, cleaned text """
+    import httpx
+    chunks = []
+    try:
+        async for token in stream_ollama(code):
+            chunks.append(token)
+            await on_token(token)
+    except httpx.HTTPError as e:
+        print(f"Error streaming code segment: {type(e).__name__} - {str(e)}")
+        return f"Error: {type(e).__name__} - {str(e)}"
+    # markdown fences and the code heuristics need the completed text
+    return clean_ollama_response(code, "".join(chunks).strip())
+
+
+async def stream_repairs(functions: list, sse: bool = False, backend: str = "ollama", gpu: bool = False):
+    """Stream the repairs of a repair request as Ollama generates them.
+
+    Functions are repaired concurrently like in the non-streaming endpoint. Every
+    function gets one "token" event per generated chunk, then one "repair" event with
+    the final cleaned-up code (the same text the non-streaming endpoint returns) and
+    its timing, events of different functions are told apart by their "index". The
+    stream ends with a "done" event holding the whole "batch_repair". Events are
+    newline-delimited JSON objects with an "event" key, or server-sent events when
+    ``sse`` is set. The "local" backend generates all functions in one batch and
+    sends no "token" events; if that batch fails, an "error" event is followed by the
+    fallback repair of every function.
+    """
+    def event(name: str, data: dict) -> str:
+        if sse:
+            return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+        return json.dumps({"event": name, **data}) + "\n"
+
+    if backend == "local":
+        try:
+            repairs, timings = await inference_executor.run(local_repairs, functions, gpu)
+        except Exception as e:
+            # the headers are sent already, report the failure in the stream and fall back for every function
+            error_msg = f"Error processing request: {str(e)}"
+            print(error_msg)
+            yield event("error", {"error": error_msg})
+            repairs = [invalid_repair_input(code) or provide_fallback_repair(code) for code in functions]
+            timings = [{"wait_ms": 0.0, "repair_ms": 0.0, "cached": False, "shared": False} for _ in functions]
+            metrics.repairs.labels("local", "fallback").inc(sum(invalid_repair_input(code) is None for code in functions))
+        for index, (repaired, timing) in enumerate(zip(repairs, timings)):
+            yield event("repair", {"index": index, "repair": repaired, "timing": timing})
+        yield event("done", {"batch_repair": repairs})
+        return
+
+    events = asyncio.Queue()
+
+    async def repair(index: int, code):
+        async def on_token(token: str):
+            await events.put(("token", {"index": index, "token": token}))
+        try:
+            repaired, timing = await repair_function(code, on_token)
+            await events.put(("repair", {"index": index, "repair": repaired, "timing": timing}))
+        finally:
+            await events.put(None)
+
+    tasks = [asyncio.ensure_future(repair(index, code)) for index, code in enumerate(functions)]
+    repairs = [None] * len(functions)
+    running = len(tasks)
+    try:
+        while running:
+            item = await events.get()
+            if item is None:
+                running -= 1
+                continue
+            name, data = item
+            if name == "repair":
+                repairs[data["index"]] = data["repair"]
+            yield event(name, data)
+    finally:
+        # the client went away, stop generating
+        for task in tasks:
+            task.cancel()
+    yield event("done", {"batch_repair": repairs})
+
+
+def ollama_request(code: str, system_prompt: str = "", stream: bool = False) -> dict:
+    """ body of the Ollama generate request repairing ``code`` """
     # Create a more structured prompt that clearly delineates the code
     prompt = (
         "You are a security expert tasked with fixing vulnerable code. "
@@ -597,311 +1336,94 @@ async def call_ollama(code: str, system_prompt: str = "") -> str:
             "10. Return ONLY the fixed code without any explanations or commentary"
         )
     
-    try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            try:
-                response = await client.post(
-                    OLLAMA_URL,
-                    json={
-                        "model": "deepseek-coder:6.7b-instruct",
-                        "prompt": prompt,
-                        "system": system_prompt,
-                        "stream": False,
-                        "options": {
-                            "temperature": 0.1,  # Lower temperature for more deterministic outputs
-                            "top_p": 0.9
-                        }
-                    }
-                )
-                
-                if response.status_code != 200:
-                    return f"Error calling Ollama API: Status code {response.status_code} - {response.text}"
-                
-                result = response.json()
-                if "response" not in result:
-                    return "Ollama API returned unexpected response format"
-                
-                repaired_code = result["response"].strip()
-                
-                # If the response doesn't look like code, use fallback
-                if "```" in repaired_code:
-                    # Extract code from markdown code blocks
-                    code_blocks = repaired_code.split("```")
-                    if len(code_blocks) >= 3:  # Proper markdown code block
-                        # The code is in the second element (between first and second ```)
-                        repaired_code = code_blocks[1]
-                        # Remove language identifier if present
-                        if repaired_code.startswith("c") or repaired_code.startswith("cpp"):
-                            repaired_code = repaired_code[repaired_code.find("\n")+1:]
-                        repaired_code = repaired_code.strip()
-                
-                # If the response still doesn't look like code (e.g., it's just text), use fallback
-                if not any(keyword in repaired_code for keyword in ["int ", "void ", "#include", "char ", "float ", "return"]) and len(repaired_code) < 50:
-                    return provide_fallback_repair(code)
-                    
-                return repaired_code
-            except httpx.ConnectError:
-                return "Error: Could not connect to Ollama API. Please ensure Ollama is running on localhost:11434."
-            except httpx.ReadTimeout:
-                return "Error: Connection to Ollama API timed out."
-    except httpx.RequestError as e:
-        error_type = type(e).__name__
-        return f"Error connecting to Ollama API: {error_type} - {str(e)}"
-    except Exception as e:
-        error_type = type(e).__name__
-        return f"Unexpected error: {error_type} - {str(e)}"
+    return {
+        "model": OLLAMA_MODEL,
+        "prompt": prompt,
+        "system": system_prompt,
+        "stream": stream,
+        "options": OLLAMA_OPTIONS
+    }
+
+
+def clean_ollama_response(code: str, repaired_code: str) -> str:
+    """ extract the code from a completed Ollama response, prose is returned as is for :func:`finalize_repair` to replace """
+    if "```" in repaired_code:
+        # Extract code from markdown code blocks
+        code_blocks = repaired_code.split("```")
+        if len(code_blocks) >= 3:  # Proper markdown code block
+            # The code is in the second element (between first and second ```)
+            repaired_code = code_blocks[1]
+            # Remove language identifier if present
+            if repaired_code.startswith("c") or repaired_code.startswith("cpp"):
+                repaired_code = repaired_code[repaired_code.find("\n")+1:]
+            repaired_code = repaired_code.strip()
+    return repaired_code
 
 
-def provide_fallback_repair(code: str) -> str:
-    """Provide a fallback repair if the Ollama API fails.
+async def call_ollama(code: str, system_prompt: str = "") -> str:
+    """Call Ollama API to generate code repairs.
     
     Parameters
     ----------
     code : str
         The code to repair
+    system_prompt : str
+        Optional system prompt to guide the model
         
     Returns
     -------
     str
-        The repaired code with basic heuristics applied
+        The repaired code
     """
-    # First, analyze code structure to understand logical flow
-    lines = code.split("\n")
-    functions = []
-    current_func = []
-    in_function = False
-    
-    # Basic code structure analysis to identify functions and blocks
-    for line in lines:
-        stripped = line.strip()
-        if re.match(r'^[a-zA-Z_][a-zA-Z0-9_]*\s+[a-zA-Z_][a-zA-Z0-9_]*\s*\(', stripped) and '{' in stripped:
-            in_function = True
-            current_func = [line]
-        elif in_function:
-            current_func.append(line)
-            if stripped == '}':
-                # Check if this is actually the end of the function
-                brace_count = ''.join(current_func).count('{') - ''.join(current_func).count('}')
-                if brace_count == 0:
-                    functions.append(current_func)
-                    current_func = []
-                    in_function = False
-        else:
-            # Global scope code
-            pass
-    
-    # Add remaining function if any
-    if current_func:
-        functions.append(current_func)
-    
-    # Add necessary includes based on code content
-    includes_needed = []
-    
-    # Check for necessary includes
-    if "strn" in code or "str" in code:
-        includes_needed.append("string.h")
-    
-    if "malloc" in code or "free" in code or "calloc" in code or "realloc" in code:
-        includes_needed.append("stdlib.h")
+    # Check if code is empty or None
+    if not code or code.strip() == "":
+        return "Error: No code provided for repair"
     
-    if "INT_MAX" in code or "overflow" in code or "UINT_MAX" in code:
-        includes_needed.append("limits.h")
+    import httpx
+    try:
+        client = ollama_client()
+        try:
+            response = await client.post(OLLAMA_URL, json=ollama_request(code, system_prompt))
+            
+            if response.status_code != 200:
+                return f"Error calling Ollama API: Status code {response.status_code} - {response.text}"
+            
+            result = response.json()
+            if "response" not in result:
+                return "Ollama API returned unexpected response format"
+            
+            return clean_ollama_response(code, result["response"].strip())
+        except httpx.ConnectError:
+            return "Error: Could not connect to Ollama API. Please ensure Ollama is running on localhost:11434."
+        except httpx.ReadTimeout:
+            return "Error: Connection to Ollama API timed out."
+    except httpx.RequestError as e:
+        error_type = type(e).__name__
+        return f"Error connecting to Ollama API: {error_type} - {str(e)}"
+    except Exception as e:
+        error_type = type(e).__name__
+        return f"Unexpected error: {error_type} - {str(e)}"
 
-    if "printf" in code or "scanf" in code or "fgets" in code or "FILE" in code:
-        includes_needed.append("stdio.h")
-    
-    if "isalpha" in code or "isdigit" in code or "toupper" in code:
-        includes_needed.append("ctype.h")
-        
-    if "errno" in code:
-        includes_needed.append("errno.h")
-        
-    if "memcpy" in code or "memmove" in code:
-        includes_needed.append("string.h")
-        
-    if "socket" in code or "connect" in code:
-        includes_needed.append("sys/socket.h")
-        includes_needed.append("netinet/in.h")
-
-    # Add includes if not already in the code
-    repaired_code = code
-    for include in includes_needed:
-        include_statement = f"#include <{include}>"
-        if include_statement not in repaired_code:
-            if "#include" in repaired_code:
-                # Add after the last include
-                includes = [line for line in repaired_code.split("\n") if line.strip().startswith("#include")]
-                last_include = includes[-1]
-                repaired_code = repaired_code.replace(last_include, last_include + f"\n{include_statement}")
-            else:
-                # Add at the beginning
-                repaired_code = include_statement + "\n" + repaired_code
-    
-    # Track variable declarations to understand data flow
-    var_declarations = re.findall(r'(char|int|float|double|long|unsigned|size_t)\s+([a-zA-Z_][a-zA-Z0-9_]*)\s*(\[\s*[0-9]+\s*\])?', repaired_code)
-    buffer_vars = [name for type, name, array in var_declarations if array]  # Identify buffer variables
-    
-    # Replace potentially dangerous functions with safer alternatives
-    # Buffer overflow fixes - PRESERVE FUNCTIONALITY
-    if "gets(" in repaired_code:
-        # Replace gets with fgets and appropriate buffer size
-        repaired_code = re.sub(
-            r'gets\s*\(\s*([^,\)]+)\s*\)',
-            lambda m: f'fgets({m.group(1)}, sizeof({m.group(1)}), stdin)',
-            repaired_code
-        )
-    
-    if "strcpy" in repaired_code:
-        # Replace strcpy with strncpy + null termination (preserving functionality)
-        repaired_code = re.sub(
-            r'strcpy\s*\(\s*([^,]+)\s*,\s*([^,\)]+)\s*\)',
-            lambda m: f'strncpy({m.group(1)}, {m.group(2)}, sizeof({m.group(1)})-1); {m.group(1)}[sizeof({m.group(1)})-1] = \'\\0\'',
-            repaired_code
-        )
-        
-        # Also detect if we're overwriting buffer contents immediately after reading input
-        repaired_code = re.sub(
-            r'(fgets|gets|scanf|read|recv)([^;]+);[\s\n]*strncpy\s*\(\s*([^,]+)\s*,\s*([^,]+)\s*,\s*sizeof\([^)]+\)-1\)',
-            # Preserve both operations but add a comment explaining the logical issue
-            lambda m: f'{m.group(1)}{m.group(2)}; // Read input into buffer\n    // Warning: Input above may be ignored by the following operation\n    strncpy({m.group(3)}, {m.group(4)}, sizeof({m.group(3)})-1)',
-            repaired_code
-        )
-        
-        # Also check if buffer size is too small for the string literal being copied
-        repaired_code = re.sub(
-            r'char\s+([a-zA-Z_][a-zA-Z0-9_]*)\s*\[\s*(\d+)\s*\][^;]*;[\s\n]*strncpy\s*\(\s*\1\s*,\s*"([^"]+)"\s*,',
-            lambda m: (f'char {m.group(1)}[{max(int(m.group(2)), len(m.group(3))+1)}] /* Increased buffer size */;' if len(m.group(3)) >= int(m.group(2)) else f'char {m.group(1)}[{m.group(2)}];') + f'\n    strncpy({m.group(1)}, "{m.group(3)}",',
-            repaired_code
-        )
-    
-    if "strcat" in repaired_code:
-        # Replace strcat with strncat (preserving functionality)
-        repaired_code = re.sub(
-            r'strcat\s*\(\s*([^,]+)\s*,\s*([^,\)]+)\s*\)',
-            lambda m: f'strncat({m.group(1)}, {m.group(2)}, sizeof({m.group(1)}) - strlen({m.group(1)}) - 1)',
-            repaired_code
-        )
-        
-        # Check for buffer size when concatenating fixed strings
-        repaired_code = re.sub(
-            r'char\s+([a-zA-Z_][a-zA-Z0-9_]*)\s*\[\s*(\d+)\s*\][^;]*;(?:[\s\n]*[^;]+;)*[\s\n]*strncat\s*\(\s*\1\s*,\s*"([^"]+)"\s*,',
-            lambda m: f'char {m.group(1)}[{max(int(m.group(2)), len(m.group(3))*2)}] /* Increased buffer size */;\n    {m.group(1)}[0] = \'\\0\'; /* Initialize for strncat */\n    strncat({m.group(1)}, "{m.group(3)}",',
-            repaired_code
-        )
-    
-    # Format string vulnerability fixes - PRESERVE FUNCTIONALITY
-    if "printf" in repaired_code or "fprintf" in repaired_code:
-        # Fix printf with user-controlled format strings by adding explicit %s format
-        repaired_code = re.sub(
-            r'(f?printf\s*\(\s*[^,]*,\s*)([^"].*?[^"%,\)]+)(\s*\))',
-            lambda m: f'{m.group(1)}"%s", {m.group(2)}{m.group(3)}' if not (m.group(2).strip().startswith('"') and m.group(2).strip().endswith('"')) else f'{m.group(1)}{m.group(2)}{m.group(3)}',
-            repaired_code
-        )
-    
-    # Integer overflow/underflow checks - ADD CHECKS BUT PRESERVE OPERATIONS
-    if re.search(r'[a-zA-Z_][a-zA-Z0-9_]*\s*[+\-*/]\s*[a-zA-Z_0-9]+', repaired_code):
-        # Add basic integer overflow checks for arithmetic operations
-        for op in ['+', '-', '*']:
-            # Find patterns like "a + b" or "a * b" where a and b could be variables or constants
-            pattern = r'(\b[a-zA-Z_][a-zA-Z0-9_]*\s*=\s*[a-zA-Z_0-9]+\s*)' + op + r'(\s*[a-zA-Z_0-9]+\b)'
-            if re.search(pattern, repaired_code):
-                # We don't replace the actual operation, but add a check beforehand
-                includes_needed.append("limits.h")
-                
-                # For integer overflow, add a comment about the potential issue
-                # In a real implementation we'd add actual checks based on types
-                if op == '+':
-                    repaired_code = re.sub(
-                        pattern,
-                        lambda m: f'/* Check for potential overflow before: */ {m.group(1)}{op}{m.group(2)}',
-                        repaired_code
-                    )
-    
-    # Command injection vulnerability checks - SANITIZE BUT PRESERVE FUNCTIONALITY
-    if "system(" in repaired_code or "exec" in repaired_code or "popen" in repaired_code:
-        # Add a warning comment for potential command injection vulnerabilities
-        # In a proper implementation, this would add input validation while preserving the command's functionality
-        validate_function = """
-// Function to validate command input - prevents command injection
-int validate_command_input(const char *str) {
-    if (!str) return 0;
-    
-    // Check for potentially dangerous shell characters
-    while (*str) {
-        if (*str == '|' || *str == ';' || *str == '&' || 
-            *str == '`' || *str == '\\'' || *str == '\\\"' || 
-            *str == '>' || *str == '<' || *str == '$' ||
-            *str == '(' || *str == ')') {
-            return 0;
-        }
-        str++;
-    }
-    return 1;
-}
-"""
-        
-        # Add the validation function if it's not already there
-        if "validate_command_input" not in repaired_code:
-            # Find the position to insert the function (before the first function definition)
-            func_match = re.search(r'^[a-zA-Z_][a-zA-Z0-9_]*\s+[a-zA-Z_][a-zA-Z0-9_]*\s*\(', repaired_code, re.MULTILINE)
-            if func_match:
-                # Insert before the first function
-                pos = func_match.start()
-                repaired_code = repaired_code[:pos] + validate_function + repaired_code[pos:]
-            else:
-                # Append to the end if no function definitions found
-                repaired_code += validate_function
-        
-        # Add checks to system calls without removing the calls themselves
-        repaired_code = re.sub(
-            r'(system\s*\(\s*)([^)]+)(\s*\))',
-            lambda m: f'(validate_command_input({m.group(2)}) ? {m.group(1)}{m.group(2)}{m.group(3)} : -1)',
-            repaired_code
-        )
-    
-    # Memory leak fixes - ADD MISSING FREE BUT PRESERVE ALLOCATIONS
-    # Analyze function returns to avoid adding free() that could lead to double-free
-    malloc_vars = re.findall(r'([a-zA-Z_][a-zA-Z0-9_]*)\s*=\s*(malloc|calloc|realloc)\(', repaired_code)
-    for var, alloc_func in malloc_vars:
-        # Check if there's a free for this variable
-        if f"free({var})" not in repaired_code:
-            # Add a comment suggesting where a free should be added
-            pattern = r'(return[^;]*;)'
-            if re.search(pattern, repaired_code):
-                repaired_code = re.sub(
-                    pattern,
-                    lambda m: f'/* Consider adding: free({var}); */ {m.group(1)}',
-                    repaired_code,
-                    count=1  # Only add one suggestion per function
-                )
-    
-    # SQL Injection check - Add comments about parameterization
-    if "SELECT" in repaired_code and "FROM" in repaired_code and ("sprintf" in repaired_code or "strcat" in repaired_code):
-        repaired_code = re.sub(
-            r'(sprintf\s*\(\s*[^,]+,\s*"[^"]*SELECT[^"]*FROM[^"]*")',
-            lambda m: f'/* SQL Injection risk: Use parameterized queries instead */ {m.group(1)}',
-            repaired_code
-        )
-    
-    # Race condition warnings for file operations
-    if re.search(r'(fopen|open|access|stat)[^;]+;[\s\n]+(fopen|open|write|chmod)', repaired_code):
-        repaired_code = re.sub(
-            r'((fopen|open|access|stat)[^;]+;)',
-            lambda m: f'/* Potential TOCTOU race condition: */ {m.group(1)}',
-            repaired_code
-        )
-    
-    # Add random data initialization for security-sensitive variables
-    if "password" in repaired_code.lower() or "key" in repaired_code.lower() or "secret" in repaired_code.lower():
-        includes_needed.append("stdlib.h")
-        includes_needed.append("time.h")
-        if "srand(time(NULL));" not in repaired_code and "srand(" not in repaired_code:
-            # Add initialization of random number generator if dealing with security-sensitive data
-            func_match = re.search(r'(int\s+main\s*\([^)]*\)\s*{)', repaired_code)
-            if func_match:
-                repaired_code = repaired_code.replace(
-                    func_match.group(1),
-                    func_match.group(1) + "\n    /* Initialize random number generator for security operations */\n    srand(time(NULL));"
-                )
-    
-    return repaired_code
+
+async def stream_ollama(code: str, system_prompt: str = ""):
+    """ yield the chunks of the Ollama repair of ``code`` as they are generated, raises on connection or API errors """
+    async with ollama_client().stream("POST", OLLAMA_URL, json=ollama_request(code, system_prompt, stream=True)) as response:
+        if response.status_code != 200:
+            body = (await response.aread()).decode(errors="replace")
+            raise RuntimeError(f"Ollama API returned status code {response.status_code} - {body}")
+        async for line in response.aiter_lines():
+            if not line:
+                continue
+            chunk = json.loads(line)
+            if "error" in chunk:
+                raise RuntimeError(f"Ollama API error: {chunk['error']}")
+            if chunk.get("response"):
+                yield chunk["response"]
+            if chunk.get("done"):
+                return
+
+
+if __name__ == "__main__":
+    import sys
+    import scanner
+    sys.exit(scanner.main(sys.argv[1:]))
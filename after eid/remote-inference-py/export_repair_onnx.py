@@ -0,0 +1,152 @@
+"""Export the local repair model (repair_model.bin) to ONNX for CPU serving.
+
+Three graphs are written next to each other: ``repair_encoder.onnx`` (``input_ids`` and
+``attention_mask`` to ``encoder_hidden_states``), ``repair_decoder_init.onnx`` for the
+first decoding step and ``repair_decoder.onnx`` for every later one, which takes the
+attention keys/values cached by the previous steps instead of re-reading the whole
+output so far. ``onnx_generation.generate`` decodes with them. Greedy generation and
+beam search with ``LOCAL_REPAIR_NUM_BEAMS`` beams (4 when it is 1) and
+``LOCAL_REPAIR_LENGTH_PENALTY`` through the export are checked against
+``model.generate`` before it is kept. Serve it with ``LOCAL_REPAIR_RUNTIME=onnx``.
+
+Usage::
+
+    python export_repair_onnx.py [output directory, defaults to ./models]
+
+Requires the ``onnx`` package.
+"""
+import os
+import sys
+
+import numpy as np
+import onnxruntime
+import torch
+
+import onnx_generation
+import settings
+from model_registry import ONNX_MODELS, registry
+
+PARTS = ["repair_encoder", "repair_decoder_init", "repair_decoder"]
+KV_NAMES = ["self_key", "self_value", "cross_key", "cross_value"]
+
+
+class RepairEncoder(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.encoder = model.get_encoder()
+
+    def forward(self, input_ids, attention_mask):
+        return self.encoder(input_ids=input_ids, attention_mask=attention_mask, return_dict=False)[0]
+
+
+class RepairDecoder(torch.nn.Module):
+    """ one decoding step, continuing from the keys/values in ``past`` (self and cross for every layer) if given """
+
+    def __init__(self, model):
+        super().__init__()
+        self.decoder = model.get_decoder()
+        self.lm_head = model.lm_head
+        # T5 rescales the decoder output when the output projection shares the input embeddings
+        self.scale = model.model_dim ** -0.5 if model.config.tie_word_embeddings else 1.0
+
+    def forward(self, decoder_input_ids, encoder_attention_mask, encoder_hidden_states, *past):
+        past_key_values = tuple(tuple(past[i:i + 4]) for i in range(0, len(past), 4)) if past else None
+        hidden_states, present = self.decoder(input_ids=decoder_input_ids, encoder_hidden_states=encoder_hidden_states,
+                                              encoder_attention_mask=encoder_attention_mask,
+                                              past_key_values=past_key_values, use_cache=True, return_dict=False)[:2]
+        logits = self.lm_head(hidden_states * self.scale)
+        # the cross attention keys/values do not change after the first step
+        kept = 2 if past else 4
+        return (logits, *[tensor for layer in present for tensor in layer[:kept]])
+
+
+def kv_names(prefix: str, num_layers: int, kinds: list) -> list:
+    return [f"{prefix}_{layer}_{kind}" for layer in range(num_layers) for kind in kinds]
+
+
+def export(model, output_dir: str):
+    num_layers = model.config.num_decoder_layers
+    input_ids = torch.randint(3, model.config.vocab_size, (2, 16))
+    attention_mask = torch.ones_like(input_ids)
+    decoder_input_ids = torch.full((2, 1), model.config.decoder_start_token_id, dtype=torch.long)
+    # export restores the mode of the wrappers afterwards, which would otherwise switch the shared layers to training
+    encoder = RepairEncoder(model).eval()
+    decoder = RepairDecoder(model).eval()
+    batch = {0: "batch"}
+    with torch.no_grad():
+        torch.onnx.export(encoder, (input_ids, attention_mask), os.path.join(output_dir, ONNX_MODELS["repair_encoder"]),
+                          input_names=["input_ids", "attention_mask"], output_names=["encoder_hidden_states"],
+                          dynamic_axes={"input_ids": {0: "batch", 1: "input_length"},
+                                        "attention_mask": {0: "batch", 1: "input_length"},
+                                        "encoder_hidden_states": {0: "batch", 1: "input_length"}},
+                          opset_version=14)
+        encoder_hidden_states = encoder(input_ids, attention_mask)
+
+        present_names = kv_names("present", num_layers, KV_NAMES)
+        torch.onnx.export(decoder, (decoder_input_ids, attention_mask, encoder_hidden_states),
+                          os.path.join(output_dir, ONNX_MODELS["repair_decoder_init"]),
+                          input_names=["decoder_input_ids", "encoder_attention_mask", "encoder_hidden_states"],
+                          output_names=["logits"] + present_names,
+                          dynamic_axes={"decoder_input_ids": batch,
+                                        "encoder_attention_mask": {0: "batch", 1: "input_length"},
+                                        "encoder_hidden_states": {0: "batch", 1: "input_length"},
+                                        "logits": batch,
+                                        **{name: ({0: "batch", 2: "input_length"} if "cross" in name else batch)
+                                           for name in present_names}},
+                          opset_version=14)
+        past = decoder(decoder_input_ids, attention_mask, encoder_hidden_states)[1:]
+
+        past_names = kv_names("past", num_layers, KV_NAMES)
+        self_names = kv_names("present", num_layers, KV_NAMES[:2])
+        torch.onnx.export(decoder, (decoder_input_ids, attention_mask, encoder_hidden_states, *past),
+                          os.path.join(output_dir, ONNX_MODELS["repair_decoder"]),
+                          input_names=["decoder_input_ids", "encoder_attention_mask", "encoder_hidden_states"] + past_names,
+                          output_names=["logits"] + self_names,
+                          dynamic_axes={"decoder_input_ids": batch,
+                                        "encoder_attention_mask": {0: "batch", 1: "input_length"},
+                                        "encoder_hidden_states": {0: "batch", 1: "input_length"},
+                                        "logits": batch,
+                                        **{name: {0: "batch", 2: "input_length" if "cross" in name else "past_length"}
+                                           for name in past_names},
+                                        **{name: {0: "batch", 2: "output_length"} for name in self_names}},
+                          opset_version=14)
+
+
+def check_outputs(model, output_dir: str) -> bool:
+    """ whether greedy generation and beam search through the export give the same tokens as the torch model """
+    sessions = [onnxruntime.InferenceSession(os.path.join(output_dir, ONNX_MODELS[part]), providers=["CPUExecutionProvider"])
+                for part in PARTS]
+    beams = settings.LOCAL_REPAIR_NUM_BEAMS if settings.LOCAL_REPAIR_NUM_BEAMS > 1 else 4
+    rng = np.random.default_rng(0)
+    for num_beams in [1, beams]:
+        for length in [8, 64]:
+            input_ids = rng.integers(3, model.config.vocab_size, (3, length))
+            attention_mask = np.ones_like(input_ids)
+            attention_mask[1, length // 2:] = 0
+            with torch.no_grad():
+                expected = model.generate(input_ids=torch.from_numpy(input_ids),
+                                          attention_mask=torch.from_numpy(attention_mask), max_new_tokens=20,
+                                          num_beams=num_beams, length_penalty=settings.LOCAL_REPAIR_LENGTH_PENALTY,
+                                          do_sample=False).numpy()
+            actual = onnx_generation.generate(*sessions, input_ids, attention_mask, 20, model.config.decoder_start_token_id,
+                                              model.config.eos_token_id, model.config.pad_token_id, num_beams,
+                                              settings.LOCAL_REPAIR_LENGTH_PENALTY)
+            if expected.shape != actual.shape or (expected != actual).any():
+                print(f"Generated tokens differ with {num_beams} beams on inputs of length {length}:\n{expected}\n{actual}")
+                return False
+    return True
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2:
+        print(__doc__)
+        sys.exit(1)
+    output_dir = sys.argv[1] if len(sys.argv) == 2 else registry.models_dir
+    model = registry.repair_model(gpu=False)
+    export(model, output_dir)
+    if not check_outputs(model, output_dir):
+        for part in PARTS:
+            os.remove(os.path.join(output_dir, ONNX_MODELS[part]))
+        print("The ONNX export does not match the torch model, nothing written")
+        sys.exit(1)
+    print(f"Wrote {', '.join(ONNX_MODELS[part] for part in PARTS)} to {output_dir}")
@@ -0,0 +1,68 @@
+"""Export the statement-level model (statement_t5_model.bin) to ONNX.
+
+The exported graph takes the ``input_ids`` [batch, 155, 20] and ``statement_mask``
+[batch, 155] built by ``deploy.statement_tokenization`` and returns the statement
+probabilities [batch, 155] and the function probabilities [batch, 2], with the
+statement GRU run over all statements of the batch at once. The export is checked
+against the torch model before it is written. Serve it with ``STATEMENT_BACKEND=onnx``.
+
+Usage::
+
+    python export_statement_onnx.py [output path, defaults to ./models/statement_t5_model.onnx]
+
+Requires the ``onnx`` package.
+"""
+import os
+import sys
+
+import numpy as np
+import onnxruntime
+import torch
+
+from model_registry import ONNX_MODELS, registry
+
+MAX_STATEMENTS = 155
+MAX_STATEMENT_LENGTH = 20
+
+
+def export(model, output_path: str):
+    input_ids = torch.full((2, MAX_STATEMENTS, MAX_STATEMENT_LENGTH), model.tokenizer.pad_token_id, dtype=torch.long)
+    statement_mask = torch.zeros((2, MAX_STATEMENTS), dtype=torch.long)
+    torch.onnx.export(model, (input_ids, statement_mask), output_path,
+                      input_names=["input_ids", "statement_mask"],
+                      output_names=["statement_probs", "func_probs"],
+                      dynamic_axes={"input_ids": {0: "batch"}, "statement_mask": {0: "batch"},
+                                    "statement_probs": {0: "batch"}, "func_probs": {0: "batch"}},
+                      opset_version=14)
+
+
+def check_outputs(model, output_path: str) -> bool:
+    session = onnxruntime.InferenceSession(output_path, providers=["CPUExecutionProvider"])
+    rng = np.random.default_rng(0)
+    for num_statements in [1, 40, MAX_STATEMENTS]:
+        input_ids = np.full((3, MAX_STATEMENTS, MAX_STATEMENT_LENGTH), model.tokenizer.pad_token_id, dtype=np.int64)
+        input_ids[:, :num_statements] = rng.integers(3, len(model.tokenizer), (3, num_statements, MAX_STATEMENT_LENGTH))
+        statement_mask = np.zeros((3, MAX_STATEMENTS), dtype=np.int64)
+        statement_mask[:, :num_statements] = 1
+        with torch.no_grad():
+            expected = model(torch.from_numpy(input_ids), torch.from_numpy(statement_mask))
+        actual = session.run(None, {"input_ids": input_ids, "statement_mask": statement_mask})
+        for name, e, a in zip(["statement_probs", "func_probs"], expected, actual):
+            if not np.allclose(e.numpy(), a, atol=1e-4):
+                print(f"{name} differs on {num_statements} statements, max difference {np.abs(e.numpy() - a).max()}")
+                return False
+    return True
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2:
+        print(__doc__)
+        sys.exit(1)
+    output_path = sys.argv[1] if len(sys.argv) == 2 else os.path.join(registry.models_dir, ONNX_MODELS["statement"])
+    model = registry.statement_model(gpu=False)
+    export(model, output_path)
+    if not check_outputs(model, output_path):
+        os.remove(output_path)
+        print("The ONNX export does not match the torch model, nothing written")
+        sys.exit(1)
+    print(f"Wrote {output_path}")
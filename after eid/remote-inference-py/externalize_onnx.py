@@ -0,0 +1,70 @@
+"""Move the weights of an ONNX model into a page-aligned external data file.
+
+ONNX Runtime memory-maps external initializers whose offset is a multiple of the page size
+(64 KiB covers every platform) instead of copying them into the process. The pages then
+belong to the page cache and every worker serving the model shares them, so N gunicorn
+workers hold the weights once instead of N times, as long as ``ONNX_SHARED_WEIGHTS`` is set
+(weights pre-packed by ONNX Runtime are private copies again). The model is rewritten in
+place: ``<name>.onnx`` keeps the graph and ``<name>.onnx.data`` the tensors of at least
+``--min-size`` bytes, each starting at a multiple of ``--alignment``.
+
+Usage::
+
+    python externalize_onnx.py ./models/line_model.onnx [./models/cwe_model.onnx ...] [--min-size 1024]
+
+Requires the ``onnx`` package.
+"""
+import argparse
+import os
+
+import onnx
+from onnx.external_data_helper import set_external_data
+
+ALIGNMENT = 64 * 1024
+
+
+def graph_tensors(graph: onnx.GraphProto) -> list:
+    """ initializers of a graph and of the subgraphs of its If and Loop nodes, Constant nodes keep their values """
+    tensors = list(graph.initializer)
+    for node in graph.node:
+        for attribute in node.attribute:
+            if attribute.HasField("g"):
+                tensors.extend(graph_tensors(attribute.g))
+            for subgraph in attribute.graphs:
+                tensors.extend(graph_tensors(subgraph))
+    return tensors
+
+
+def externalize(path: str, min_size: int = 1024, alignment: int = ALIGNMENT) -> int:
+    """ move the tensors of at least ``min_size`` bytes of the model at ``path`` to ``<path>.data``, returns their bytes """
+    model = onnx.load(path)
+    location = os.path.basename(path) + ".data"
+    tensors = [tensor for tensor in graph_tensors(model.graph)
+               if tensor.HasField("raw_data") and len(tensor.raw_data) >= min_size]
+    temporary = f"{path}.data.{os.getpid()}.tmp"
+    with open(temporary, "wb") as f:
+        for tensor in tensors:
+            f.write(b"\0" * (-f.tell() % alignment))
+            offset = f.tell()
+            f.write(tensor.raw_data)
+            set_external_data(tensor, location, offset, len(tensor.raw_data))
+            tensor.ClearField("raw_data")
+            tensor.data_location = onnx.TensorProto.EXTERNAL
+        size = f.tell()
+    # the data file first, so the graph never points at data that is not there yet
+    os.replace(temporary, path + ".data")
+    onnx.save(model, path + ".tmp")
+    os.replace(path + ".tmp", path)
+    return size
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("models", nargs="+")
+    parser.add_argument("--min-size", type=int, default=1024, help="smallest tensor in bytes moved to the data file")
+    parser.add_argument("--alignment", type=int, default=ALIGNMENT, help="offset alignment of the tensors in bytes")
+    args = parser.parse_args()
+
+    for model_path in args.models:
+        moved = externalize(model_path, args.min_size, args.alignment)
+        print(f"{model_path}: {moved / 2 ** 20:.1f} MB of weights in {model_path}.data")
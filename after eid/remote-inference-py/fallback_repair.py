@@ -0,0 +1,276 @@
+"""Heuristic repair of C/C++ code, used when Ollama is unavailable or fails.
+
+The repair is a table of rules applied in order. Every rule has a cheap literal
+pre-check, so code it cannot apply to is never run through its regexes, and every
+regex is compiled once at import. None of the patterns nests quantifiers, and the
+spans they may cover (an argument, a statement, a string literal) are capped, so
+the runtime grows linearly with the length of the code even for adversarial input.
+
+The caps change what is repaired: a call whose argument is longer than ``MAX_ARGUMENT``
+characters (``strcpy``, ``strcat``, ``gets``, ``system``, ``printf``), a statement longer
+than ``MAX_STATEMENT`` (the input before a ``strncpy``, a ``return`` given a ``free``
+suggestion, a file check) or a string literal longer than ``MAX_LITERAL`` is left as it
+is instead of being rewritten. Such code is rare in a single function and was where the
+old regexes backtracked. Otherwise the output is that of the old implementation, which
+``tests/test_fallback_repair.py`` checks, except for two fixed bugs: additions are flagged
+(the old pattern left the ``+`` unescaped and mangled assignments instead), and the strcat
+buffer rule keeps the statements between the declaration and the ``strncat`` call.
+"""
+import bisect
+import re
+
+# longest argument, statement and string literal a rule looks at, longer ones are left alone
+MAX_ARGUMENT = 256
+MAX_STATEMENT = 1024
+MAX_LITERAL = 1024
+MAX_SPACES = 64
+
+# header -> literals that make the code need it
+INCLUDES = [
+    ("string.h", ("str", "memcpy", "memmove")),
+    ("stdlib.h", ("malloc", "free", "calloc", "realloc")),
+    ("limits.h", ("INT_MAX", "overflow", "UINT_MAX")),
+    ("stdio.h", ("printf", "scanf", "fgets", "FILE")),
+    ("ctype.h", ("isalpha", "isdigit", "toupper")),
+    ("errno.h", ("errno",)),
+    ("sys/socket.h", ("socket", "connect")),
+    ("netinet/in.h", ("socket", "connect")),
+]
+
+VALIDATE_FUNCTION = """
+// Function to validate command input - prevents command injection
+int validate_command_input(const char *str) {
+    if (!str) return 0;
+    
+    // Check for potentially dangerous shell characters
+    while (*str) {
+        if (*str == '|' || *str == ';' || *str == '&' || 
+            *str == '`' || *str == '\\'' || *str == '\\\"' || 
+            *str == '>' || *str == '<' || *str == '$' ||
+            *str == '(' || *str == ')') {
+            return 0;
+        }
+        str++;
+    }
+    return 1;
+}
+"""
+
+
+def _compile(pattern: str, flags: int = 0) -> re.Pattern:
+    """ compile ``pattern`` with {arg}, {stmt}, {lit} and {ws} replaced by the span limits """
+    return re.compile(pattern.replace("{arg}", str(MAX_ARGUMENT)).replace("{stmt}", str(MAX_STATEMENT))
+                      .replace("{lit}", str(MAX_LITERAL)).replace("{ws}", str(MAX_SPACES)), flags)
+
+
+GETS = _compile(r'gets\s*\(\s*([^,\)]{1,{arg}})\s*\)')
+STRCPY = _compile(r'strcpy\s*\(\s*([^,]{1,{arg}})\s*,\s*([^,\)]{1,{arg}})\s*\)')
+INPUT_THEN_STRNCPY = _compile(r'(fgets|gets|scanf|read|recv)([^;]{1,{stmt}});[\s\n]{0,{ws}}strncpy\s*\(\s*([^,]{1,{arg}})\s*,'
+                              r'\s*([^,]{1,{arg}})\s*,\s*sizeof\([^)]{1,{arg}}\)-1\)')
+BUFFER_THEN_STRNCPY = _compile(r'char\s+([a-zA-Z_][a-zA-Z0-9_]*)\s*\[\s*(\d+)\s*\][^;]{0,{stmt}};[\s\n]{0,{ws}}'
+                               r'strncpy\s*\(\s*\1\s*,\s*"([^"]{1,{lit}})"\s*,')
+STRCAT = _compile(r'strcat\s*\(\s*([^,]{1,{arg}})\s*,\s*([^,\)]{1,{arg}})\s*\)')
+CHAR_BUFFER = _compile(r'char\s+([a-zA-Z_][a-zA-Z0-9_]*)\s*\[\s*(\d+)\s*\]([^;]{0,{stmt}});')
+STRNCAT_LITERAL = _compile(r'strncat\s*\(\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*,\s*"([^"]{1,{lit}})"\s*,')
+# the arguments after the format run up to the first ")" on the line that follows a character other than "%,)
+# the optional prefix ends on one of those characters so no two quantifiers compete for the same text
+PRINTF = _compile(r'(f?printf\s*\([^,]{0,{arg}},\s{0,{ws}})([^"](?:[^\n]{0,{lit}}?["%,)])??[^"%,)]{1,{lit}})(\))')
+# an identifier (possibly after digits, as in 0xff) followed by an arithmetic operator, starting at a word start
+ARITHMETIC = _compile(r'(?<![a-zA-Z0-9_])[0-9]*[a-zA-Z_][a-zA-Z0-9_]*\s*[+\-*/]\s*[a-zA-Z_0-9]')
+ADDITION = _compile(r'(\b[a-zA-Z_][a-zA-Z0-9_]*\s*=\s*[a-zA-Z_0-9]+\s*)\+(\s*[a-zA-Z_0-9]+\b)')
+FUNCTION_DEFINITION = _compile(r'^[a-zA-Z_][a-zA-Z0-9_]*\s+[a-zA-Z_][a-zA-Z0-9_]*\s*\(', re.MULTILINE)
+SYSTEM = _compile(r'(system\s*\(\s*)([^)]{1,{arg}})(\s*\))')
+ALLOCATION = _compile(r'(?<![a-zA-Z0-9_])[0-9]*([a-zA-Z_][a-zA-Z0-9_]*)\s*=\s*(malloc|calloc|realloc)\(')
+RETURN = _compile(r'(return[^;]{0,{stmt}};)')
+# lookaheads do not backtrack, so only the first SELECT and the first FROM after it are tried
+SQL_SPRINTF = _compile(r'(sprintf\s*\([^,]{1,{arg}},\s*"(?=([^"]{0,{lit}}?SELECT))\2(?=([^"]{0,{lit}}?FROM))\3[^"]{0,{lit}}")')
+FILE_CHECK_THEN_USE = _compile(r'(fopen|open|access|stat)[^;]{1,{stmt}};[\s\n]+(fopen|open|write|chmod)')
+FILE_CHECK = _compile(r'((fopen|open|access|stat)[^;]{1,{stmt}};)')
+SECRET = re.compile(r'password|key|secret', re.IGNORECASE)
+MAIN = _compile(r'(int\s+main\s*\([^)]{0,{arg}}\)\s*{)')
+
+
+def add_includes(code: str) -> str:
+    """ add the headers the code needs after its last #include, or at the top if it has none """
+    missing = [f"#include <{header}>" for header, literals in INCLUDES
+               if any(literal in code for literal in literals) and f"#include <{header}>" not in code]
+    if not missing:
+        return code
+    includes = [line for line in code.split("\n") if line.strip().startswith("#include")]
+    if not includes:
+        return "\n".join(missing) + "\n" + code
+    last_include = includes[-1]
+    return code.replace(last_include, last_include + "".join(f"\n{include}" for include in missing))
+
+
+def resize_strncat_buffers(code: str) -> str:
+    """ grow char buffers that fixed strings are concatenated to and initialise them for strncat """
+    calls = {}
+    for match in STRNCAT_LITERAL.finditer(code):
+        calls.setdefault(match.group(1), ([], []))
+        calls[match.group(1)][0].append(match.start())
+        calls[match.group(1)][1].append(len(match.group(2)))
+    if not calls:
+        return code
+    declarations = [match for match in CHAR_BUFFER.finditer(code) if match.group(1) in calls]
+    # a declaration covers the calls up to the next declaration of the same name
+    ends, next_start = [len(code)] * len(declarations), {}
+    for i in range(len(declarations) - 1, -1, -1):
+        ends[i] = next_start.get(declarations[i].group(1), len(code))
+        next_start[declarations[i].group(1)] = declarations[i].start()
+    pieces, position = [], 0
+    for declaration, end in zip(declarations, ends):
+        name, size, rest = declaration.groups()
+        starts, lengths = calls[name]
+        lengths = lengths[bisect.bisect_left(starts, declaration.end()):bisect.bisect_left(starts, end)]
+        if not lengths:
+            continue
+        pieces.append(code[position:declaration.start()])
+        pieces.append(f'char {name}[{max(int(size), max(lengths) * 2)}] /* Increased buffer size */{rest};')
+        if not rest.strip():
+            pieces.append(f'\n    {name}[0] = \'\\0\'; /* Initialize for strncat */')
+        position = declaration.end()
+    return "".join(pieces) + code[position:]
+
+
+def flag_addition(code: str) -> str:
+    """ comment on additions that may overflow, the operations themselves are kept """
+    if not ARITHMETIC.search(code):
+        return code
+    return ADDITION.sub(lambda m: f'/* Check for potential overflow before: */ {m.group(1)}+{m.group(2)}', code)
+
+
+def add_validate_function(code: str) -> str:
+    """ insert validate_command_input before the first function definition, or append it """
+    if "validate_command_input" in code:
+        return code
+    function = FUNCTION_DEFINITION.search(code)
+    if function:
+        return code[:function.start()] + VALIDATE_FUNCTION + code[function.start():]
+    return code + VALIDATE_FUNCTION
+
+
+def suggest_free(code: str) -> str:
+    """ suggest freeing every allocated variable that is never freed before the first return """
+    unfreed = [var for var in dict.fromkeys(match.group(1) for match in ALLOCATION.finditer(code))
+               if f"free({var})" not in code]
+    if not unfreed:
+        return code
+    suggestions = "".join(f'/* Consider adding: free({var}); */ ' for var in unfreed)
+    return RETURN.sub(lambda m: f'{suggestions}{m.group(1)}', code, count=1)
+
+
+def flag_file_races(code: str) -> str:
+    """ comment on file checks followed by a file operation """
+    if not FILE_CHECK_THEN_USE.search(code):
+        return code
+    return FILE_CHECK.sub(lambda m: f'/* Potential TOCTOU race condition: */ {m.group(1)}', code)
+
+
+def seed_random(code: str) -> str:
+    """ seed the random number generator at the start of main """
+    if "srand(" in code:
+        return code
+    main = MAIN.search(code)
+    if not main:
+        return code
+    return code.replace(main.group(1), main.group(1) + "\n    /* Initialize random number generator for security operations */\n    srand(time(NULL));")
+
+
+def _sub(pattern: re.Pattern, replacement):
+    """ rule step running ``pattern.sub(replacement, code)`` """
+    return lambda code: pattern.sub(replacement, code)
+
+
+def _printf_replacement(m: re.Match) -> str:
+    argument = m.group(2).strip()
+    if argument.startswith('"') and argument.endswith('"'):
+        return f'{m.group(1)}{m.group(2)}{m.group(3)}'
+    return f'{m.group(1)}"%s", {m.group(2)}{m.group(3)}'
+
+
+def _buffer_then_strncpy_replacement(m: re.Match) -> str:
+    if len(m.group(3)) >= int(m.group(2)):
+        declaration = f'char {m.group(1)}[{max(int(m.group(2)), len(m.group(3)) + 1)}] /* Increased buffer size */;'
+    else:
+        declaration = f'char {m.group(1)}[{m.group(2)}];'
+    return declaration + f'\n    strncpy({m.group(1)}, "{m.group(3)}",'
+
+
+# (pre-check on the code so far, steps applied in order when it passes)
+RULES = [
+    # Buffer overflow fixes - PRESERVE FUNCTIONALITY
+    # Replace gets with fgets and appropriate buffer size
+    (lambda code: "gets(" in code, [
+        _sub(GETS, lambda m: f'fgets({m.group(1)}, sizeof({m.group(1)}), stdin)'),
+    ]),
+    (lambda code: "strcpy" in code, [
+        # Replace strcpy with strncpy + null termination (preserving functionality)
+        _sub(STRCPY, lambda m: f'strncpy({m.group(1)}, {m.group(2)}, sizeof({m.group(1)})-1); '
+                               f'{m.group(1)}[sizeof({m.group(1)})-1] = \'\\0\''),
+        # Also detect if we're overwriting buffer contents immediately after reading input,
+        # preserve both operations but add a comment explaining the logical issue
+        _sub(INPUT_THEN_STRNCPY, lambda m: f'{m.group(1)}{m.group(2)}; // Read input into buffer\n'
+                                           f'    // Warning: Input above may be ignored by the following operation\n'
+                                           f'    strncpy({m.group(3)}, {m.group(4)}, sizeof({m.group(3)})-1)'),
+        # Also check if buffer size is too small for the string literal being copied
+        _sub(BUFFER_THEN_STRNCPY, _buffer_then_strncpy_replacement),
+    ]),
+    (lambda code: "strcat" in code, [
+        # Replace strcat with strncat (preserving functionality)
+        _sub(STRCAT, lambda m: f'strncat({m.group(1)}, {m.group(2)}, sizeof({m.group(1)}) - strlen({m.group(1)}) - 1)'),
+        # Check for buffer size when concatenating fixed strings
+        resize_strncat_buffers,
+    ]),
+    # Format string vulnerability fixes - PRESERVE FUNCTIONALITY
+    (lambda code: "printf" in code, [
+        _sub(PRINTF, _printf_replacement),
+    ]),
+    # Integer overflow checks - ADD CHECKS BUT PRESERVE OPERATIONS
+    (lambda code: "+" in code, [
+        flag_addition,
+    ]),
+    # Command injection vulnerability checks - SANITIZE BUT PRESERVE FUNCTIONALITY
+    (lambda code: "system(" in code or "exec" in code or "popen" in code, [
+        add_validate_function,
+        # Add checks to system calls without removing the calls themselves
+        _sub(SYSTEM, lambda m: f'(validate_command_input({m.group(2)}) ? {m.group(1)}{m.group(2)}{m.group(3)} : -1)'),
+    ]),
+    # Memory leak fixes - ADD MISSING FREE BUT PRESERVE ALLOCATIONS
+    (lambda code: "alloc(" in code, [
+        suggest_free,
+    ]),
+    # SQL Injection check - Add comments about parameterization
+    (lambda code: "SELECT" in code and "FROM" in code and ("sprintf" in code or "strcat" in code), [
+        _sub(SQL_SPRINTF, lambda m: f'/* SQL Injection risk: Use parameterized queries instead */ {m.group(1)}'),
+    ]),
+    # Race condition warnings for file operations
+    (lambda code: "open" in code or "access" in code or "stat" in code, [
+        flag_file_races,
+    ]),
+    # Add random data initialization for security-sensitive variables
+    (lambda code: SECRET.search(code) is not None, [
+        seed_random,
+    ]),
+]
+
+
+def provide_fallback_repair(code: str) -> str:
+    """Provide a fallback repair if the Ollama API fails.
+
+    Parameters
+    ----------
+    code : str
+        The code to repair
+
+    Returns
+    -------
+    str
+        The repaired code with basic heuristics applied
+    """
+    repaired_code = add_includes(code)
+    for applies, steps in RULES:
+        if applies(repaired_code):
+            for step in steps:
+                repaired_code = step(repaired_code)
+    return repaired_code
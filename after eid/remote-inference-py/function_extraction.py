@@ -0,0 +1,178 @@
+"""Function definitions of C/C++ translation units, for analysing whole files on the server.
+
+One pass over the source blanks out comments, string and character literals and
+preprocessor lines, then follows the braces. A ``{`` opens a function body when the text
+before it, since the last ``;``, ``{`` or ``}``, ends like a function declarator: a parameter
+list followed only by qualifiers, a trailing return type or a constructor initializer list.
+Namespaces, ``extern "C"`` blocks and class bodies are searched for further definitions,
+other braces (initializers, enums, lambdas) are skipped whole. This is a heuristic, not a
+parser: definitions whose braces differ between preprocessor branches or that are produced
+by macros are not found.
+
+Every function is normalised like the extension does before inference: comments are
+removed, leading whitespace is stripped and blank lines are dropped, and the file line of
+every remaining line is kept so that line scores can be mapped back to the file.
+"""
+import bisect
+import io
+import re
+import tarfile
+from typing import Iterator, NamedTuple, Optional
+
+C_EXTENSIONS = {".c", ".cc", ".cpp", ".cxx", ".c++", ".h", ".hh", ".hpp", ".hxx", ".inl"}
+# headers longer than this are only searched from their end, so a long run of code without ";" stays linear
+MAX_HEADER_LENGTH = 2000
+
+COMMENTS = re.compile(r"//(?:[^\n\\]|\\.)*|/\*.*?(?:\*/|\Z)", re.S)
+LITERALS = re.compile(r"""(?<![\w])(?:u8|u|U|L)?R"(?P<delimiter>[^()\\\s"]{0,16})\(.*?\)(?P=delimiter)"
+                          |"(?:[^"\\\n]|\\.)*"
+                          |'(?:[^'\\\n]|\\.)*'
+                          |^[ \t]*\#(?:[^\n\\]|\\.)*""", re.S | re.M | re.X)
+NOT_NEWLINE = re.compile(r"[^\n]")
+MEMBER_INITIALIZER = re.compile(r"\)\s*:(?!:).*[\w>]$", re.S)
+ACCESS_SPECIFIERS = re.compile(r"\s*(?:(?:public|protected|private|signals|slots|Q_SLOTS)\s*:(?!:)\s*)*")
+SCOPE_HEADER = re.compile(r"(?:template\s*<.*>\s*)?(?:typedef\s+)?(?:inline\s+)?(?:namespace|class|struct|union)\b|extern$", re.S)
+# what may follow the parameter list: qualifiers, a trailing return type and a constructor initializer list
+DECLARATOR_TAIL = re.compile(r"(?:[\s\w*&<>,\[\]]|->|::)*(?::(?!:).*)?", re.S)
+FUNCTION_NAME = re.compile(r"(operator\s*(?:\(\s*\)|[^\s(]+)|~?[A-Za-z_]\w*(?:\s*::\s*~?[A-Za-z_]\w*)*)\s*(?:<[^()]*>)?\s*$")
+TEMPLATE_ARGUMENTS = re.compile(r"<[^<>]*>")
+OPERATOR_NAME = re.compile(r"\boperator\s*(?:\(\s*\)|[^\s\w(]+|\w+(?:\s*\[\s*\])?)")
+NOT_FUNCTIONS = {"if", "for", "while", "switch", "catch", "return", "sizeof", "alignof", "alignas", "decltype",
+                 "typeof", "__attribute__", "__declspec", "defined"}
+
+
+class ExtractedFunction(NamedTuple):
+    name: str
+    # 1-based lines of the file
+    start_line: int
+    end_line: int
+    # normalised text sent to the models
+    code: str
+    # file line of every line of ``code``
+    lines: list
+
+
+def blank(match: re.Match, fill: str = " ") -> str:
+    return NOT_NEWLINE.sub(fill, match.group())
+
+
+def function_name(header: str) -> Optional[str]:
+    """ name of the function whose definition ``header`` starts, None if it starts none """
+    # "operator()" and "operator==" would otherwise be taken for a parameter list or an initialisation
+    renamed = OPERATOR_NAME.sub(lambda match: "operator" + "_" * (len(match.group()) - 8), header)
+    # an initialisation such as "auto f = [](int x) {", but not a default template argument
+    equals = TEMPLATE_ARGUMENTS.sub(lambda match: " " * len(match.group()), renamed).find("=")
+    depth, open_index = 0, None
+    for index, char in enumerate(renamed):
+        if char == "(":
+            if depth == 0:
+                open_index = index
+            depth += 1
+        elif char == ")" and depth:
+            depth -= 1
+            if depth:
+                continue
+            if 0 <= equals < open_index:
+                return None
+            before = renamed[:open_index]
+            if DECLARATOR_TAIL.fullmatch(renamed, index + 1):
+                name = FUNCTION_NAME.search(before)
+                if name is not None and name.group(1) not in NOT_FUNCTIONS:
+                    return re.sub(r"\s+", "", header[name.start(1):open_index])
+    return None
+
+
+def normalise(lines: list, first_line: int) -> tuple:
+    """ (code, file lines) of the lines of a function, as the extension sends functions to the models """
+    code, kept = [], []
+    for offset, line in enumerate(lines):
+        line = line.replace("\0", "").lstrip()
+        if line.strip():
+            code.append(line)
+            kept.append(first_line + offset)
+    return "\n".join(code), kept
+
+
+def extract_functions(source: str) -> Iterator[ExtractedFunction]:
+    """Function definitions of one C/C++ translation unit, in the order they appear.
+
+    Parameters
+    ----------
+    source : str
+        Text of the translation unit.
+    Returns
+    -------
+    Iterator of :obj:`ExtractedFunction`
+        Name, first and last line (1-based) and normalised code of every definition found.
+    """
+    # comments become "\0", removed from the function text later, literals and directives become spaces for the scan
+    uncommented = COMMENTS.sub(lambda match: blank(match, "\0"), source.replace("\0", " "))
+    masked = LITERALS.sub(blank, uncommented).replace("\0", " ")
+    line_starts = [0] + [match.end() for match in re.finditer("\n", source)]
+
+    def line_of(position: int) -> int:
+        return bisect.bisect_right(line_starts, position)
+
+    header_start, skip_depth, function_start, name = 0, 0, None, ""
+    for match in re.finditer(r"[{};]", masked):
+        char, position = match.group(), match.start()
+        if skip_depth:
+            skip_depth += 1 if char == "{" else -1 if char == "}" else 0
+            if skip_depth == 0:
+                if function_start is None:
+                    header_start = position + 1
+                elif function_start >= 0:
+                    start_line, end_line = line_of(function_start), line_of(position)
+                    text = uncommented[function_start:position + 1].split("\n")
+                    code, lines = normalise(text, start_line)
+                    yield ExtractedFunction(name, start_line, end_line, code, lines)
+                    function_start, header_start = None, position + 1
+                else:
+                    # brace of a constructor initializer list, the header goes on
+                    function_start = None
+            continue
+        if char != "{":
+            # the end of a declaration or of a namespace or class body
+            header_start = position + 1
+            continue
+        offset = max(header_start, position - MAX_HEADER_LENGTH)
+        start = ACCESS_SPECIFIERS.match(masked, offset, position).end()
+        header = masked[start:position].rstrip()
+        if MEMBER_INITIALIZER.search(header):
+            # the brace of "a{x}" in "A::A(int x) : a{x}", the header goes on after it
+            skip_depth, function_start = 1, -1
+        elif function_name(header) is not None:
+            skip_depth, function_start, name = 1, start, function_name(header)
+        elif SCOPE_HEADER.match(header) and "(" not in header:
+            # namespaces, extern "C" and class bodies are searched for definitions
+            header_start = position + 1
+        else:
+            skip_depth = 1
+
+
+def is_c_source(path: str) -> bool:
+    return any(path.lower().endswith(extension) for extension in C_EXTENSIONS)
+
+
+def decode_source(data: bytes) -> Optional[str]:
+    """ text of a source file, None for binary files """
+    if b"\0" in data[:8192]:
+        return None
+    return data.decode("utf-8", errors="replace")
+
+
+def tar_sources(fileobj: io.IOBase, max_file_size: int) -> Iterator[tuple]:
+    """(path, text, error) of every C/C++ file in a tar archive, read as a stream one file at a time.
+
+    The archive may be compressed with gzip, bzip2 or xz. ``text`` is None and ``error`` says why
+    for files larger than ``max_file_size`` bytes and binary files.
+    """
+    with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+        for member in archive:
+            if not member.isfile() or not is_c_source(member.name):
+                continue
+            if member.size > max_file_size:
+                yield member.name, None, f"File larger than {max_file_size} bytes, skipped"
+                continue
+            text = decode_source(archive.extractfile(member).read())
+            yield member.name, text, None if text is not None else "Binary file, skipped"
@@ -0,0 +1,46 @@
+"""Gunicorn settings loading the models once in the master process, before the workers are forked.
+
+The app is imported by the master (``preload_app``), which then loads the tokenizers,
+label maps and memory-mapped torch models of ``PRELOAD_MODELS`` so that every worker
+inherits them instead of loading its own copy; each worker still creates its ONNX Runtime
+sessions in the startup hook. Convert the ONNX models with ``externalize_onnx.py`` and set
+``ONNX_SHARED_WEIGHTS=true`` so that their weights are shared as well, see the README.
+
+With ``PROMETHEUS_MULTIPROC_DIR`` set, the metric files of an earlier run are removed at
+startup and those of exited workers are marked dead, so ``/metrics`` reports the live workers.
+
+Usage::
+
+    gunicorn -c gunicorn_preload.py deploy:app --workers 8 --bind 0.0.0.0:8000
+"""
+import gc
+import glob
+import os
+
+import settings
+
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+
+
+def on_starting(server):
+    # the values of the previous run would otherwise be added to this one
+    directory = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if directory:
+        for path in glob.glob(os.path.join(directory, "*.db")):
+            os.remove(path)
+
+
+def child_exit(server, worker):
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+
+
+def when_ready(server):
+    # runs in the master once the app is imported and before any worker is forked
+    from deploy import registry
+    registry.preload_before_fork(settings.PRELOAD_MODELS, settings.PRELOAD_GPU)
+    # the collector would otherwise write to the objects inherited by every worker, unsharing their pages
+    gc.freeze()
+    server.log.info("Loaded before fork:\n%s", registry.report())
@@ -0,0 +1,191 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def content_key(namespace: str, code: str) -> str:
+    """ content address of one function for one endpoint/model, see :meth:`InferenceCache.run` """
+    return hashlib.sha256(f"{namespace}\0{code}".encode("utf-8", "surrogatepass")).hexdigest()
+
+
+class InferenceCache:
+    """Content-addressed cache of per-function inference results.
+
+    Results are kept in memory with LRU eviction once ``max_entries`` is reached. When
+    ``sqlite_path`` is given every result is also written to a SQLite database, so the
+    cache survives restarts; entries evicted from memory are then read back from disk.
+    With ``ttl_seconds`` set, results also expire that long after they were stored.
+
+    Parameters
+    ----------
+    max_entries : int
+        Maximum number of results kept in memory, 0 disables the in-memory cache.
+    sqlite_path : str
+        Optional path of the SQLite database used as persistent store.
+    ttl_seconds : float
+        Lifetime of a result, 0 keeps results until they are evicted.
+    """
+
+    def __init__(self, max_entries: int = 100000, sqlite_path: str = "", ttl_seconds: float = 0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if sqlite_path:
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            # read cached results through a memory map instead of read() calls
+            self._db.execute("PRAGMA mmap_size=268435456")
+            self._db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL)")
+            if "expires" not in [column[1] for column in self._db.execute("PRAGMA table_info(results)")]:
+                # databases written before results could expire
+                self._db.execute("ALTER TABLE results ADD COLUMN expires REAL")
+            self._db.commit()
+
+    def get(self, key: str):
+        with self._lock:
+            now = time.time()
+            if key in self._entries:
+                value, expires = self._entries[key]
+                if expires is None or expires > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            if self._db is not None:
+                row = self._db.execute("SELECT value, expires FROM results WHERE key = ? AND (expires IS NULL OR expires > ?)",
+                                       (key, now)).fetchone()
+                if row is not None:
+                    value = json.loads(row[0])
+                    self._remember(key, value, row[1])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value):
+        self.put_many({key: value})
+
+    def put_many(self, values: dict):
+        """ store every (key, value) of ``values``, written to SQLite in one transaction """
+        with self._lock:
+            expires = time.time() + self.ttl_seconds if self.ttl_seconds > 0 else None
+            for key, value in values.items():
+                self._remember(key, value, expires)
+            if self._db is not None and values:
+                with self._db:
+                    self._db.executemany("INSERT OR REPLACE INTO results (key, value, expires) VALUES (?, ?, ?)",
+                                         [(key, json.dumps(value), expires) for key, value in values.items()])
+
+    def _remember(self, key: str, value, expires=None):
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = (value, expires)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def run(self, namespace: str, code: list, run_batch) -> dict:
+        """Return the result of ``run_batch(code)``, running the model only for functions not cached yet.
+
+        Parameters
+        ----------
+        namespace : str
+            Identifies the endpoint and model weights, e.g. "predict:<model file digest>".
+        code : :obj:`list`
+            A list of String functions, anything else raises a ``TypeError`` instead of sharing the
+            key of its string form.
+        run_batch : callable
+            Takes a list of String functions and returns a dict whose values are lists with one entry per function.
+            It is called once with the distinct cache misses, or not at all when every function is cached.
+        Returns
+        -------
+        :obj:`dict`
+            The same dict ``run_batch(code)`` would return.
+        """
+        if not all(isinstance(c, str) for c in code):
+            raise TypeError("InferenceCache.run takes a list of str functions")
+        keys = [content_key(namespace, c) for c in code]
+        results = {}
+        misses = {}
+        for key, c in zip(keys, code):
+            if key in results or key in misses:
+                # duplicate function within the request
+                continue
+            value = self.get(key)
+            if value is None:
+                misses[key] = c
+            else:
+                results[key] = value
+        if misses:
+            output = run_batch(list(misses.values()))
+            computed = {key: {name: values[i] for name, values in output.items()} for i, key in enumerate(misses)}
+            self.put_many(computed)
+            results.update(computed)
+        if not keys:
+            return {}
+        names = results[keys[0]].keys()
+        return {name: [results[key][name] for key in keys] for name in names}
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                    "hit_rate": self.hits / lookups if lookups else 0.0,
+                    "entries": len(self._entries), "max_entries": self.max_entries,
+                    "ttl_seconds": self.ttl_seconds, "persistent": self._db is not None}
+
+
+class SingleFlight:
+    """Share one execution between concurrent async calls with the same key.
+
+    The first caller of :meth:`run` for a key runs the coroutine, callers arriving
+    while it is still running wait for its result instead of starting their own.
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    async def run(self, key: str, make_coroutine) -> tuple:
+        """ (result, shared) of ``await make_coroutine()``, shared is True if another caller ran it """
+        while True:
+            future = self._calls.get(key)
+            if future is None:
+                break
+            try:
+                return await asyncio.shield(future), True
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    # this caller was cancelled, not the one running the call
+                    raise
+                # the running call was cancelled (its client went away), run it again
+        future = asyncio.get_running_loop().create_future()
+        # nobody may be waiting for the outcome
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._calls[key] = future
+        try:
+            result = await make_coroutine()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            del self._calls[key]
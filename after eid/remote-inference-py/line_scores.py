@@ -0,0 +1,97 @@
+import numpy as np
+
+# "Ċ" is how the byte-level BPE vocabulary spells "\n", "ĉ" is "\t" which the line mapping also treats as a break
+LINE_SEPARATORS = ("Ċ", "ĉ")
+
+
+def newline_token_mask(tokenizer) -> np.ndarray:
+    """ boolean array over the vocabulary, True for tokens that end a line in the line score mapping """
+    tokens = tokenizer.convert_ids_to_tokens(list(range(len(tokenizer))))
+    return np.array([any(separator in token for separator in LINE_SEPARATORS) for token in tokens], dtype=bool)
+
+
+def attention_line_scores(model_input: np.ndarray, attentions: np.ndarray, newline_mask: np.ndarray,
+                          missing_padding_rows: int = 0) -> list:
+    """Map the attentions of one line model run to one score per line for every function.
+
+    Batched equivalent of summing the attention of every head with Python ``sum()``,
+    ``clean_special_token_values``, ``get_word_att_scores`` and ``get_all_lines_score``,
+    kept in ``tests/reference_line_scores.py``.
+
+    Parameters
+    ----------
+    model_input : :obj:`np.ndarray`
+        Padded input ids with shape [batch size, seq length].
+    attentions : :obj:`np.ndarray`
+        Attention weights with shape [batch size, heads, seq length, seq length].
+    newline_mask : :obj:`np.ndarray`
+        Output of :func:`newline_token_mask` for the tokenizer of ``model_input``.
+    missing_padding_rows : int
+        Padding positions cut off by dynamic padding, the last (padding) attention row is counted once for each.
+    Returns
+    -------
+    :obj:`list`
+        Line scores as a 2D list [[att_score_0, att_score_1, ..., att_score_n], ...]
+    """
+    return token_line_scores(model_input, attention_token_scores(attentions, missing_padding_rows), newline_mask)
+
+
+def attention_token_scores(attentions: np.ndarray, missing_padding_rows: int = 0) -> np.ndarray:
+    """ normalised attention score of every token with <s> and </s> cleaned, shape [batch size, seq length] """
+    return normalize_token_scores(attention_token_sums(attentions, missing_padding_rows))
+
+
+def attention_token_sums(attentions: np.ndarray, missing_padding_rows: int = 0) -> np.ndarray:
+    """ attention each token receives, summed over heads and querying tokens, shape [batch size, seq length] """
+    batch_size, seq_length = attentions.shape[0], attentions.shape[-1]
+    if batch_size == 0:
+        return np.zeros((0, seq_length), dtype=attentions.dtype)
+    # as one BLAS call
+    rows = attentions.reshape(batch_size, -1, seq_length)
+    scores = np.ones(rows.shape[1], dtype=rows.dtype) @ rows
+    if missing_padding_rows:
+        scores += missing_padding_rows * attentions[:, :, -1, :].sum(axis=1)
+    return scores
+
+
+def normalize_token_scores(scores: np.ndarray, low: np.ndarray = None, high: np.ndarray = None) -> np.ndarray:
+    """Min-max normalise attention sums in place and clean the scores of <s> and </s>.
+
+    Each row is scaled to [0, 1] by its own minimum and maximum, or by ``low`` and ``high``
+    (shape [batch size, 1]) when the rows are windows of a longer input sharing one scale.
+    """
+    batch_size, seq_length = scores.shape
+    if batch_size == 0:
+        return scores
+    # normalize attention score
+    if low is None:
+        scores -= scores.min(axis=1, keepdims=True)
+        scores /= scores.max(axis=1, keepdims=True)
+    else:
+        scores -= low
+        scores /= high - low
+    # clean att score for <s> and for </s>, the last non-zero value
+    scores[:, 0] = 0
+    non_zero = scores != 0
+    last_non_zero = seq_length - 1 - np.argmax(non_zero[:, ::-1], axis=1)
+    cleaned = np.flatnonzero(non_zero.any(axis=1))
+    scores[cleaned, last_non_zero[cleaned]] = 0
+    return scores
+
+
+def token_line_scores(model_input: np.ndarray, scores: np.ndarray, newline_mask: np.ndarray) -> list:
+    """ sum token scores per line, lines end at newline tokens and at the last token of each row """
+    if model_input.shape[0] == 0:
+        return []
+    line_end = newline_mask[model_input]
+    line_end[:, -1] = True
+    flat_end = line_end.ravel()
+    flat_scores = scores.ravel().astype(np.float64)
+    line_ids = np.cumsum(flat_end) - flat_end
+    line_sums = np.bincount(line_ids, weights=flat_scores)
+    # a line is only reported if a token before its end scored, otherwise its end token score is dropped
+    before_end = np.bincount(line_ids, weights=np.where(flat_end, 0.0, flat_scores))
+    kept = before_end != 0
+    lines = line_end.sum(axis=1)
+    kept_lines = np.add.reduceat(kept.astype(np.int64), np.cumsum(lines) - lines)
+    return [line_scores.tolist() for line_scores in np.split(line_sums[kept], np.cumsum(kept_lines)[:-1])]
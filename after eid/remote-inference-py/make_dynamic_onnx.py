@@ -0,0 +1,95 @@
+"""Give line_model.onnx, cwe_model.onnx or sev_model.onnx a dynamic sequence axis.
+
+Models exported with a fixed [batch, 512] input force every function to be padded to
+512 tokens. This script renames the fixed sequence dimension of the inputs and outputs
+to a symbolic "sequence" axis, then checks that every output of the patched model on
+shorter inputs, including the attentions the line scores come from, matches the
+original on inputs padded to 512. The patched model is only written when the check
+passes; if the graph has the sequence length baked into its operators the model has to
+be re-exported from PyTorch with ``dynamic_axes={"input_ids": {0: "batch", 1: "sequence"}}`` instead.
+
+Usage::
+
+    python make_dynamic_onnx.py ./models/line_model.onnx [output path, defaults to the input path]
+
+Requires the ``onnx`` package.
+"""
+import sys
+
+import numpy as np
+import onnx
+import onnxruntime
+
+from line_scores import attention_token_sums
+
+MAX_LENGTH = 512
+PAD_TOKEN_ID = 1
+
+
+def make_dynamic(model: onnx.ModelProto) -> onnx.ModelProto:
+    for value in list(model.graph.input) + list(model.graph.output):
+        dims = value.type.tensor_type.shape.dim
+        if len(dims) > 0:
+            dims[0].dim_param = "batch"
+        for dim in list(dims)[1:]:
+            if dim.HasField("dim_value") and dim.dim_value == MAX_LENGTH:
+                dim.dim_param = "sequence"
+    # intermediate shapes were inferred for 512 tokens, let onnxruntime infer them again
+    del model.graph.value_info[:]
+    return model
+
+
+def check_outputs(original_path: str, model: onnx.ModelProto) -> bool:
+    """Whether every output of the patched model on short inputs matches the original on inputs padded to 512.
+
+    Outputs with a sequence axis are compared over the tokens of the short input. The
+    attentions of the line model are also compared as the line scores use them:
+    summed per token with the padding rows cut off by the short input added back, see
+    :func:`line_scores.attention_token_sums`.
+    """
+    original = onnxruntime.InferenceSession(original_path, providers=["CPUExecutionProvider"])
+    patched = onnxruntime.InferenceSession(model.SerializeToString(), providers=["CPUExecutionProvider"])
+    names = [output.name for output in original.get_outputs()]
+    rng = np.random.default_rng(0)
+    for length in [17, 130, 300]:
+        # <s> code tokens </s>, then at least one padding token as served by deploy.py
+        ids = np.concatenate([[0], rng.integers(3, 30000, length - 2), [2]])
+        fixed = np.full((2, MAX_LENGTH), PAD_TOKEN_ID, dtype=np.int64)
+        fixed[:, :length] = ids
+        short = fixed[:, :length + 1]
+        expected_outputs = original.run(None, {original.get_inputs()[0].name: fixed})
+        try:
+            actual_outputs = patched.run(None, {patched.get_inputs()[0].name: short})
+        except Exception as e:
+            print(f"Patched model fails on {length} tokens: {type(e).__name__} - {str(e)}")
+            return False
+        for name, expected, actual in zip(names, expected_outputs, actual_outputs):
+            compared = [(expected, actual)]
+            if expected.shape != actual.shape:
+                if expected.ndim != actual.ndim:
+                    print(f"Patched model output {name} has shape {actual.shape} instead of {expected.shape}")
+                    return False
+                # the sequence axes are cut to the short input
+                compared = [(expected[tuple(slice(0, size) for size in actual.shape)], actual)]
+                if name == "attentions":
+                    sums = attention_token_sums(actual, missing_padding_rows=MAX_LENGTH - short.shape[1])
+                    compared.append((attention_token_sums(expected)[:, :short.shape[1]], sums))
+            for expected_part, actual_part in compared:
+                if expected_part.shape != actual_part.shape or not np.allclose(expected_part, actual_part, atol=1e-4):
+                    difference = np.abs(expected_part - actual_part).max() if expected_part.shape == actual_part.shape else "shape"
+                    print(f"Patched model output {name} differs on {length} tokens, max difference {difference}")
+                    return False
+    return True
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3):
+        print(__doc__)
+        sys.exit(1)
+    input_path = sys.argv[1]
+    output_path = sys.argv[2] if len(sys.argv) == 3 else input_path
+    model = make_dynamic(onnx.load(input_path))
+    if not check_outputs(input_path, model):
+        print(f"{input_path} has to be re-exported with a dynamic sequence axis, nothing written")
+        sys.exit(1)
+    onnx.save(model, output_path)
+    print(f"Wrote {output_path} with a dynamic sequence axis")
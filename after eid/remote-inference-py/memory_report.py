@@ -0,0 +1,83 @@
+"""Resident and proportional memory of the server processes, to see what the workers share.
+
+RSS counts every page a process maps, so the RSS of workers sharing memory-mapped or
+copy-on-write weights adds up to far more than the node uses. PSS divides every page by
+the number of processes mapping it, so the PSS of all processes adds up to their actual
+footprint; "shared" and "private" split the RSS into pages other processes also map and
+pages only this process does. Read from ``/proc/<pid>/smaps_rollup`` (Linux 4.14+), or
+summed from ``/proc/<pid>/smaps`` on older kernels.
+
+Usage::
+
+    python memory_report.py <gunicorn master pid or pid file>
+"""
+import os
+import sys
+
+# smaps fields in kB and the report column they are added to
+SMAPS_FIELDS = {"Rss": "rss", "Pss": "pss", "Shared_Clean": "shared", "Shared_Dirty": "shared",
+                "Private_Clean": "private", "Private_Dirty": "private", "Swap": "swap"}
+
+
+def process_memory(pid="self") -> dict:
+    """ "rss", "pss", "shared", "private" and "swap" bytes of a process, empty if /proc cannot be read """
+    memory = {column: 0 for column in SMAPS_FIELDS.values()}
+    for file_name in ("smaps_rollup", "smaps"):
+        try:
+            with open(f"/proc/{pid}/{file_name}") as f:
+                for line in f:
+                    field, _, value = line.partition(":")
+                    if field in SMAPS_FIELDS:
+                        memory[SMAPS_FIELDS[field]] += int(value.split()[0]) * 1024
+            return memory
+        except FileNotFoundError:
+            continue
+        except (OSError, ValueError):
+            break
+    return {}
+
+
+def child_pids(pid: int) -> list:
+    """ pids of the processes whose parent is ``pid`` """
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # the command name in parentheses may contain spaces, the parent pid is the second field after it
+                parent = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if parent == pid:
+            children.append(int(entry))
+    return sorted(children)
+
+
+def report(master_pid: int) -> str:
+    """ table of the memory of the master process and each of its workers, with totals """
+    rows = [("master", master_pid)] + [("worker", pid) for pid in child_pids(master_pid)]
+    lines = [f"{'process':<10}{'pid':>8}{'RSS (MB)':>12}{'PSS (MB)':>12}{'shared (MB)':>14}{'private (MB)':>15}"]
+    totals = {"rss": 0, "pss": 0}
+    for role, pid in rows:
+        memory = process_memory(pid)
+        if not memory:
+            continue
+        totals["rss"] += memory["rss"]
+        totals["pss"] += memory["pss"]
+        lines.append(f"{role:<10}{pid:>8}" + "".join(f"{memory[column] / 2 ** 20:>{width}.1f}" for column, width in
+                                                      [("rss", 12), ("pss", 12), ("shared", 14), ("private", 15)]))
+    lines.append(f"{'total':<18}{totals['rss'] / 2 ** 20:>12.1f}{totals['pss'] / 2 ** 20:>12.1f}")
+    lines.append(f"the master and {len(rows) - 1} workers use {totals['pss'] / 2 ** 20:.1f} MB together, "
+                 f"their RSS adds up to {totals['rss'] / 2 ** 20:.1f} MB")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit(__doc__)
+    target = sys.argv[1]
+    if not target.isdigit():
+        with open(target) as pid_file:
+            target = pid_file.read().strip()
+    print(report(int(target)))
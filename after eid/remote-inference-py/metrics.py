@@ -0,0 +1,125 @@
+"""Prometheus metrics of the server, defined with ``prometheus_client``.
+
+With a single process the metrics live in its memory. Under gunicorn set
+``PROMETHEUS_MULTIPROC_DIR`` to an empty directory before the server starts: every worker
+then writes its values to files there and :func:`render` aggregates the files of all
+workers, so one scrape of ``/metrics`` reports the whole server whichever worker answers.
+"""
+import os
+import threading
+import time
+
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+                               disable_created_metrics, generate_latest, multiprocess)
+
+# seconds, from a fast tokenizer call to a long Ollama generation
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+
+MULTIPROCESS = bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+# the "_created" timestamp series double the exposition and no dashboard reads them
+disable_created_metrics()
+
+# (gauge child, function) of every gauge read from a function, see gauge_function
+sampled_gauges = []
+sampling_thread = None
+
+
+def gauge_function(gauge, function):
+    """Read the value of ``gauge`` (a labelled child) from ``function()``.
+
+    With a single process the function is called at every scrape. In multiprocess mode
+    the scraping worker cannot call the functions of the others, so every worker writes
+    their values to its files at each scrape it answers and every ``interval`` seconds of
+    :func:`start_sampling`.
+    """
+    if not MULTIPROCESS:
+        gauge.set_function(function)
+    else:
+        sampled_gauges.append((gauge, function))
+
+
+def sample_gauges():
+    """ write the current value of every :func:`gauge_function` gauge, used in multiprocess mode """
+    for gauge, function in sampled_gauges:
+        gauge.set(function())
+
+
+def start_sampling(interval: float):
+    """Sample the function gauges of this worker every ``interval`` seconds in a daemon thread.
+
+    Only needed in multiprocess mode, and called in each worker after the fork since
+    threads of the master are not inherited.
+    """
+    global sampling_thread
+    if not MULTIPROCESS or not sampled_gauges or interval <= 0 or sampling_thread is not None:
+        return
+
+    def sample():
+        while True:
+            sample_gauges()
+            time.sleep(interval)
+
+    sampling_thread = threading.Thread(target=sample, name="metrics-sampling", daemon=True)
+    sampling_thread.start()
+
+
+def render() -> bytes:
+    """ every metric in the Prometheus text exposition format, of all workers in multiprocess mode """
+    if not MULTIPROCESS:
+        return generate_latest(REGISTRY)
+    sample_gauges()
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry)
+
+
+class RequestTimer:
+    """ASGI middleware observing ``request_seconds`` for every HTTP request.
+
+    The time runs until the response starts, so streamed responses are not timed to their
+    end. Paths without a route of the app share the "other" label, so that requests for
+    arbitrary paths cannot grow the metrics without limit.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+
+        async def timed_send(message):
+            if message["type"] == "http.response.start":
+                routes = scope["app"].routes if "app" in scope else []
+                path = scope["path"] if any(route.path == scope["path"] for route in routes) else "other"
+                request_seconds.labels(path, message["status"]).observe(time.perf_counter() - start)
+            await send(message)
+
+        await self.app(scope, receive, timed_send)
+
+
+stage_seconds = Histogram(
+    "inference_stage_seconds", "Seconds per call of each stage of each model: tokenize, session_run, attention, labels, "
+    "serialize (per endpoint), and generate, decode for the local repair model", ("model", "stage"),
+    buckets=LATENCY_BUCKETS)
+batch_size = Histogram("inference_batch_size", "Functions (or windows) per session run", ("model",),
+                       buckets=BATCH_SIZE_BUCKETS)
+input_tokens = Histogram("inference_input_tokens", "Input tokens per function (or window)", ("model",),
+                         buckets=TOKEN_BUCKETS)
+# summed over the live workers in multiprocess mode
+queue_depth = Gauge("inference_queue_depth", "Calls waiting for an inference worker, requests waiting for their "
+                    "micro-batch and repairs waiting for an Ollama slot", ("queue",), multiprocess_mode="livesum")
+request_seconds = Histogram("http_request_seconds", "Seconds from receiving a request to the start of its response",
+                            ("path", "status"), buckets=LATENCY_BUCKETS)
+ollama_seconds = Histogram("ollama_request_seconds", "Seconds per Ollama generation by outcome: ok, error (an error "
+                           "response or exception) or timeout", ("outcome",), buckets=LATENCY_BUCKETS)
+# one series per live worker, with a "pid" label, in multiprocess mode
+process_memory = Gauge("process_memory_bytes", "Memory of this worker: rss, pss (shared pages divided by the "
+                       "processes mapping them), shared and private bytes", ("kind",), multiprocess_mode="liveall")
+repairs = Counter("repairs_total", "Repaired functions by backend and where the repair came from: model, cache, "
+                  "shared, fallback or invalid", ("backend", "source"))
@@ -0,0 +1,397 @@
+import hashlib
+import inspect
+import os
+import pickle
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+import settings
+from line_scores import newline_token_mask
+from memory_report import process_memory
+
+# onnxruntime, transformers and torch are imported by the loaders that need them, so importing the
+# registry stays cheap and a server only using the ONNX models never imports torch
+if TYPE_CHECKING:
+    import onnxruntime
+    import torch
+    from transformers import T5Config, T5ForConditionalGeneration
+    from statement_t5_model import StatementT5
+
+ONNX_MODELS = {"line": "line_model.onnx", "cwe": "cwe_model.onnx", "sev": "sev_model.onnx",
+               "statement": "statement_t5_model.onnx", "repair_encoder": "repair_encoder.onnx",
+               "repair_decoder_init": "repair_decoder_init.onnx", "repair_decoder": "repair_decoder.onnx"}
+PRECISIONS = ["fp32", "int8", "fp16"]
+# names of the onnxruntime.GraphOptimizationLevel and onnxruntime.ExecutionMode members
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": "ORT_DISABLE_ALL",
+    "basic": "ORT_ENABLE_BASIC",
+    "extended": "ORT_ENABLE_EXTENDED",
+    "all": "ORT_ENABLE_ALL",
+}
+EXECUTION_MODES = {
+    "sequential": "ORT_SEQUENTIAL",
+    "parallel": "ORT_PARALLEL",
+}
+REPAIR_SPECIAL_TOKENS = ["<S2SV_StartBug>", "<S2SV_EndBug>", "<S2SV_blank>", "<S2SV_ModStart>", "<S2SV_ModEnd>"]
+
+
+def precision_variant_path(path: str, precision: str) -> str:
+    """ path of the ``precision`` variant of an fp32 model written by quantize_onnx.py, e.g. ./models/line_model.int8.onnx """
+    if precision == "fp32":
+        return path
+    root, extension = os.path.splitext(path)
+    return f"{root}.{precision}{extension}"
+
+
+@contextmanager
+def file_lock(path: str):
+    """ hold an exclusive lock on ``path`` across processes, a no-op where fcntl is not available """
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def get_rss_bytes() -> int:
+    """ resident set size of the current process in bytes """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        # ru_maxrss is the peak RSS in KiB, the best we can do without /proc
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def torch_mmap_supported() -> bool:
+    """ whether torch.load(mmap=True) and load_state_dict(assign=True) are available, from torch 2.1 """
+    import torch
+    return "mmap" in inspect.signature(torch.load).parameters
+
+
+class ModelRegistry:
+    """Process-wide holder of every tokenizer, ONNX session, label map and torch model.
+
+    Each resource is loaded on first use (or by :meth:`preload` at startup) and then
+    shared by all requests. Load time and the resident memory added by each load
+    are recorded in ``load_report``.
+    """
+
+    def __init__(self, common_dir: str = settings.INFERENCE_COMMON_DIR, models_dir: str = settings.MODELS_DIR):
+        self.common_dir = common_dir
+        self.models_dir = models_dir
+        self.load_report = []
+        self._resources = {}
+        self._digests = {}
+        self._lock = threading.RLock()
+
+    def _get(self, key: str, loader):
+        resource = self._resources.get(key)
+        if resource is not None:
+            return resource
+        with self._lock:
+            # another thread may have loaded it while we waited for the lock
+            if key not in self._resources:
+                rss_before = get_rss_bytes()
+                start = time.perf_counter()
+                self._resources[key] = loader()
+                self.load_report.append({"name": key,
+                                         "load_seconds": time.perf_counter() - start,
+                                         "rss_delta_mb": (get_rss_bytes() - rss_before) / 2 ** 20})
+            return self._resources[key]
+
+    @staticmethod
+    def _providers(gpu: bool) -> list:
+        return ["CUDAExecutionProvider", "CPUExecutionProvider"] if gpu else ["CPUExecutionProvider"]
+
+    @staticmethod
+    def _device(gpu: bool) -> str:
+        return "cuda" if gpu else "cpu"
+
+    def line_tokenizer(self):
+        """ tokenizer shared by the line and severity models """
+        def load():
+            from transformers import RobertaTokenizer
+            return RobertaTokenizer.from_pretrained(os.path.join(self.common_dir, "tokenizer"))
+        return self._get("tokenizer", load)
+
+    def cwe_tokenizer(self):
+        """ line tokenizer extended with the <cls_type> token used by the CWE model """
+        def load():
+            from transformers import RobertaTokenizer
+            tokenizer = RobertaTokenizer.from_pretrained(os.path.join(self.common_dir, "tokenizer"))
+            tokenizer.add_tokens(["<cls_type>"])
+            tokenizer.cls_type_token = "<cls_type>"
+            return tokenizer
+        return self._get("cwe_tokenizer", load)
+
+    def newline_token_mask(self) -> np.ndarray:
+        """ vocabulary mask of the line tokenizer tokens that end a line, see :func:`line_scores.newline_token_mask` """
+        return self._get("newline_token_mask", lambda: newline_token_mask(self.line_tokenizer()))
+
+    def statement_tokenizer(self):
+        """ Rust-backed tokenizer of the statement-level model, encodes all statements of a request in one call """
+        def load():
+            from transformers import RobertaTokenizerFast
+            return RobertaTokenizerFast.from_pretrained(os.path.join(self.common_dir, "statement_t5_tokenizer"))
+        return self._get("statement_tokenizer", load)
+
+    def repair_tokenizer(self):
+        def load():
+            from transformers import RobertaTokenizer
+            tokenizer = RobertaTokenizer.from_pretrained(os.path.join(self.common_dir, "repair_tokenizer"))
+            tokenizer.add_tokens(REPAIR_SPECIAL_TOKENS)
+            return tokenizer
+        return self._get("repair_tokenizer", load)
+
+    def label_maps(self) -> tuple:
+        """ (cwe_id_map, cwe_type_map) mapping predicted indices to CWE-IDs and CWE abstract types """
+        def load():
+            with open(os.path.join(self.common_dir, "label_map.pkl"), "rb") as f:
+                cwe_id_map, cwe_type_map = pickle.load(f)
+            return cwe_id_map, cwe_type_map
+        return self._get("label_map", load)
+
+    def onnx_model_path(self, name: str) -> str:
+        """ path of the "line", "cwe", "sev" or "statement" ONNX model in the precision selected by ``settings.MODEL_PRECISION`` """
+        precision = settings.MODEL_PRECISION[name]
+        if precision not in PRECISIONS:
+            raise ValueError(f"Invalid precision '{precision}' for model '{name}', expected one of {PRECISIONS}")
+        return precision_variant_path(os.path.join(self.models_dir, ONNX_MODELS[name]), precision)
+
+    @staticmethod
+    def session_options(name: str) -> "onnxruntime.SessionOptions":
+        """ SessionOptions of the "line", "cwe", "sev" or "statement" model from :func:`settings.onnx_session_settings` """
+        import onnxruntime
+        config = settings.onnx_session_settings(name)
+        try:
+            optimization = getattr(onnxruntime.GraphOptimizationLevel,
+                                   GRAPH_OPTIMIZATION_LEVELS[config["graph_optimization"].lower()])
+            execution_mode = getattr(onnxruntime.ExecutionMode, EXECUTION_MODES[config["execution_mode"].lower()])
+        except KeyError as e:
+            raise ValueError(f"Invalid ONNX session option {e} for model '{name}', expected one of "
+                             f"{list(GRAPH_OPTIMIZATION_LEVELS)} and {list(EXECUTION_MODES)}")
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = optimization
+        options.execution_mode = execution_mode
+        options.intra_op_num_threads = config["intra_op_threads"]
+        options.inter_op_num_threads = config["inter_op_threads"]
+        options.enable_cpu_mem_arena = config["cpu_mem_arena"]
+        options.enable_mem_pattern = config["mem_pattern"]
+        if config["shared_weights"]:
+            # pre-packed weights are private copies, unpacked ones stay in the memory-mapped data file
+            options.add_session_config_entry("session.disable_prepacking", "1")
+        return options
+
+    def optimized_model_path(self, name: str, gpu: bool = False) -> str:
+        """ where the optimised graph of the model is kept, or "" if ONNX_OPTIMIZED_MODEL_DIR is not set """
+        config = settings.onnx_session_settings(name)
+        if not config["optimized_model_dir"]:
+            return ""
+        # the optimised graph depends on the source weights, the optimisation level and the execution provider
+        digest = self.onnx_digest(self.onnx_model_path(name))[:16]
+        file_name = (f"{name}_model.{settings.MODEL_PRECISION[name]}.{self._device(gpu)}."
+                     f"{config['graph_optimization'].lower()}{'.external' if config['shared_weights'] else ''}.{digest}.onnx")
+        return os.path.join(config["optimized_model_dir"], file_name)
+
+    def onnx_session(self, name: str, gpu: bool = False) -> "onnxruntime.InferenceSession":
+        """ ONNX Runtime session for one of the "line", "cwe", "sev" or "statement" models """
+        def load():
+            import onnxruntime
+            path = self.onnx_model_path(name)
+            options = self.session_options(name)
+            optimized_path = self.optimized_model_path(name, gpu)
+            if optimized_path and os.path.exists(optimized_path):
+                # already optimised by an earlier process, skip the graph transformations
+                options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL
+                return onnxruntime.InferenceSession(optimized_path, options, providers=self._providers(gpu))
+            if not optimized_path:
+                return onnxruntime.InferenceSession(path, options, providers=self._providers(gpu))
+            os.makedirs(os.path.dirname(optimized_path), exist_ok=True)
+            # several workers may start at once, the first to get the lock writes the graph and the others load it
+            with file_lock(f"{optimized_path}.lock"):
+                if os.path.exists(optimized_path):
+                    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL
+                    return onnxruntime.InferenceSession(optimized_path, options, providers=self._providers(gpu))
+                # the graph appears under its name only once it is complete
+                options.optimized_model_filepath = f"{optimized_path}.tmp"
+                if settings.onnx_session_settings(name)["shared_weights"]:
+                    # the weights go to one data file next to the graph, which the renamed graph keeps pointing at
+                    options.add_session_config_entry("session.optimized_model_external_initializers_file_name",
+                                                     f"{os.path.basename(optimized_path)}.data")
+                    options.add_session_config_entry("session.optimized_model_external_initializers_min_size_in_bytes",
+                                                     "1024")
+                session = onnxruntime.InferenceSession(path, options, providers=self._providers(gpu))
+                os.replace(options.optimized_model_filepath, optimized_path)
+            return session
+        return self._get(f"{name}_model[{settings.MODEL_PRECISION[name]},{self._device(gpu)}]", load)
+
+    def dynamic_length(self, name: str, gpu: bool = False) -> bool:
+        """ whether the session of the "line", "cwe" or "sev" model accepts inputs shorter than 512 tokens """
+        sequence_axis = self.onnx_session(name, gpu).get_inputs()[0].shape[1]
+        return not isinstance(sequence_axis, int)
+
+    def statement_model(self, gpu: bool = False) -> "StatementT5":
+        device = self._device(gpu)
+
+        def load():
+            from transformers import T5Config, T5EncoderModel
+            from statement_t5_model import StatementT5
+            config = T5Config.from_pretrained(os.path.join(self.common_dir, "t5_config.json"))
+            model = StatementT5(T5EncoderModel(config=config), self.statement_tokenizer(), device=device)
+            self.load_weights(model, os.path.join(self.models_dir, "statement_t5_model.bin"), device)
+            model.to(device)
+            model.eval()
+            return model
+        return self._get(f"statement_model[{device}]", load)
+
+    def repair_config(self) -> "T5Config":
+        """ config of the repair model, holds the decoder start, end and padding token ids """
+        def load():
+            from transformers import T5Config
+            return T5Config.from_pretrained(os.path.join(self.common_dir, "repair_model_config.json"))
+        return self._get("repair_config", load)
+
+    def repair_sessions(self, gpu: bool = False) -> list:
+        """ encoder, first step decoder and decoder sessions of the repair model exported by export_repair_onnx.py """
+        return [self.onnx_session(name, gpu) for name in ["repair_encoder", "repair_decoder_init", "repair_decoder"]]
+
+    def repair_model(self, gpu: bool = False) -> "T5ForConditionalGeneration":
+        device = self._device(gpu)
+
+        def load():
+            from transformers import T5ForConditionalGeneration
+            model = T5ForConditionalGeneration(config=self.repair_config())
+            model.resize_token_embeddings(len(self.repair_tokenizer()))
+            self.load_weights(model, os.path.join(self.models_dir, "repair_model.bin"), device)
+            model.to(device)
+            model.eval()
+            return model
+        return self._get(f"repair_model[{device}]", load)
+
+    @staticmethod
+    def load_weights(model: "torch.nn.Module", path: str, device: str):
+        """ load a state dict into ``model``, memory-mapped on CPU so that every process reads the same pages """
+        import torch
+        if device == "cpu" and settings.TORCH_MMAP_WEIGHTS and torch_mmap_supported():
+            try:
+                state_dict = torch.load(path, map_location=device, mmap=True)
+            except RuntimeError as e:
+                # files written by torch.save before 1.6 cannot be memory-mapped
+                print(f"Could not memory-map {path}, loading a copy: {e}")
+            else:
+                # the parameters become the mapped tensors instead of copies of them
+                model.load_state_dict(state_dict, assign=True)
+                return
+        model.load_state_dict(torch.load(path, map_location=device))
+
+    def file_digest(self, path: str) -> str:
+        """ sha256 of a model or label map file, computed once per process """
+        if path not in self._digests:
+            sha = hashlib.sha256()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(2 ** 20), b""):
+                    sha.update(chunk)
+            self._digests[path] = sha.hexdigest()
+        return self._digests[path]
+
+    def onnx_digest(self, path: str) -> str:
+        """ digest of an ONNX model, including the data file written by externalize_onnx.py if it has one """
+        digest = self.file_digest(path)
+        if os.path.exists(path + ".data"):
+            digest = hashlib.sha256((digest + self.file_digest(path + ".data")).encode()).hexdigest()
+        return digest
+
+    def model_digest(self, name: str) -> str:
+        """ digest identifying the weights behind the "line", "cwe", "sev", "statement" or "repair" model outputs """
+        if name == "statement" and settings.STATEMENT_BACKEND == "torch":
+            return self.file_digest(os.path.join(self.models_dir, "statement_t5_model.bin"))
+        if name == "repair":
+            if settings.LOCAL_REPAIR_RUNTIME == "onnx":
+                return "".join(self.onnx_digest(self.onnx_model_path(part))[:16]
+                               for part in ["repair_encoder", "repair_decoder_init", "repair_decoder"])
+            return self.file_digest(os.path.join(self.models_dir, "repair_model.bin"))
+        digest = self.onnx_digest(self.onnx_model_path(name))
+        if name == "cwe":
+            # predicted indices are mapped to CWE-IDs through the label map
+            digest += self.file_digest(os.path.join(self.common_dir, "label_map.pkl"))
+        return digest
+
+    def preload(self, names: list, gpu: bool = False):
+        """Load the named models ("line", "cwe", "sev", "statement", "repair") with their tokenizers.
+
+        Models whose weights are missing are skipped so the server can still start and
+        serve the remaining endpoints; they will fail on first use instead.
+        """
+        loaders = {
+            "line": lambda: (self.line_tokenizer(), self.newline_token_mask(), self.onnx_session("line", gpu)),
+            "cwe": lambda: (self.cwe_tokenizer(), self.label_maps(), self.onnx_session("cwe", gpu)),
+            "sev": lambda: (self.line_tokenizer(), self.onnx_session("sev", gpu)),
+            "statement": lambda: (self.statement_tokenizer(), self.onnx_session("statement", gpu)
+                                  if settings.STATEMENT_BACKEND == "onnx" else self.statement_model(gpu)),
+            "repair": lambda: (self.repair_tokenizer(), self.repair_config(), self.repair_sessions(gpu)
+                               if settings.LOCAL_REPAIR_RUNTIME == "onnx" else self.repair_model(gpu)),
+        }
+        for name in names:
+            try:
+                loaders[name]()
+            except KeyError:
+                print(f"Unknown model '{name}' in PRELOAD_MODELS, expected one of {list(loaders)}")
+            except Exception as e:
+                print(f"Could not preload model '{name}': {type(e).__name__} - {str(e)}")
+
+    def preload_before_fork(self, names: list, gpu: bool = False):
+        """Load what the forked workers of a preloading server can share of the named models.
+
+        Tokenizers, label maps and memory-mapped torch models are inherited by every worker.
+        ONNX Runtime sessions are not, their thread pools do not survive a fork, so each worker
+        creates its own in :meth:`preload`, sharing the weights of externalised models through
+        the page cache instead. Nothing is loaded for CUDA, which cannot be used across a fork.
+        """
+        if gpu:
+            return
+        def mmap() -> bool:
+            return settings.TORCH_MMAP_WEIGHTS and torch_mmap_supported()
+        loaders = {
+            "line": lambda: (self.line_tokenizer(), self.newline_token_mask()),
+            "cwe": lambda: (self.cwe_tokenizer(), self.label_maps()),
+            "sev": self.line_tokenizer,
+            # a model loaded without mmap is copied with torch's thread pool, which a fork can leave hanging
+            "statement": lambda: (self.statement_tokenizer(), self.statement_model()
+                                  if settings.STATEMENT_BACKEND == "torch" and mmap() else None),
+            "repair": lambda: (self.repair_tokenizer(), self.repair_config(), self.repair_model()
+                               if settings.LOCAL_REPAIR_RUNTIME == "torch" and mmap() else None),
+        }
+        for name in names:
+            try:
+                loaders[name]()
+            except KeyError:
+                print(f"Unknown model '{name}' in PRELOAD_MODELS, expected one of {list(loaders)}")
+            except Exception as e:
+                print(f"Could not preload model '{name}': {type(e).__name__} - {str(e)}")
+
+    def report(self) -> str:
+        lines = [f"{'resource':<28}{'load time (s)':>16}{'RSS delta (MB)':>18}"]
+        for entry in self.load_report:
+            lines.append(f"{entry['name']:<28}{entry['load_seconds']:>16.3f}{entry['rss_delta_mb']:>18.1f}")
+        lines.append(f"total resident memory: {get_rss_bytes() / 2 ** 20:.1f} MB")
+        memory = process_memory()
+        if memory:
+            # the pages shared with other workers only count their share in the PSS
+            lines.append(f"proportional set size: {memory['pss'] / 2 ** 20:.1f} MB, "
+                         f"{memory['shared'] / 2 ** 20:.1f} MB shared, {memory['private'] / 2 ** 20:.1f} MB private")
+        return "\n".join(lines)
+
+
+registry = ModelRegistry()
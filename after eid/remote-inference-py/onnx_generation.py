@@ -0,0 +1,201 @@
+"""Greedy and beam search decoding over the ONNX export of an encoder-decoder model.
+
+``export_repair_onnx.py`` writes three graphs: the encoder, ``decoder_init`` for the
+first step and ``decoder`` for every later step. Both decoders return the attention
+keys and values of the step as ``present_<layer>_<self|cross>_<key|value>``, and
+``decoder`` takes them back as ``past_*`` inputs. Each step therefore only runs the
+newest token through the decoder, and the encoder output is projected for cross
+attention once. Decoding follows ``generate`` of the installed ``transformers`` with
+``early_stopping=False`` and no other logits processors; beam scores are divided by
+the length including the decoder start token, except that from 4.36 on the beams still
+running after ``max_new_tokens`` are divided by their length without it.
+``export_repair_onnx.py`` checks both decoders against ``generate``.
+"""
+import importlib.metadata
+
+import numpy as np
+
+
+def transformers_version() -> tuple:
+    """ (major, minor) of the installed ``transformers``, read without importing it """
+    try:
+        return tuple(int(part) for part in importlib.metadata.version("transformers").split(".")[:2])
+    except (importlib.metadata.PackageNotFoundError, ValueError):
+        return (0, 0)
+
+
+# tokens not counted in the length of an unfinished beam, see the module docstring
+UNFINISHED_LENGTH_OFFSET = 1 if transformers_version() >= (4, 36) else 0
+
+
+def log_softmax(logits: np.ndarray) -> np.ndarray:
+    logits = logits - logits.max(axis=-1, keepdims=True)
+    return logits - np.log(np.exp(logits).sum(axis=-1, keepdims=True))
+
+
+def run_session(session, feeds: dict) -> dict:
+    """ outputs of ``session`` by name, fed with the entries of ``feeds`` it takes as inputs """
+    names = {session_input.name for session_input in session.get_inputs()}
+    outputs = session.run(None, {name: value for name, value in feeds.items() if name in names})
+    return {output.name: value for output, value in zip(session.get_outputs(), outputs)}
+
+
+class DecoderState:
+    """Encoder output and cached keys/values of a batch being decoded.
+
+    Parameters
+    ----------
+    decoder_init, decoder : :obj:`onnxruntime.InferenceSession`
+        Sessions of the first and of the later decoding steps.
+    encoder_hidden_states : :obj:`np.ndarray`
+        Encoder output with shape [batch size, input length, hidden size].
+    attention_mask : :obj:`np.ndarray`
+        Encoder attention mask with shape [batch size, input length].
+    """
+
+    def __init__(self, decoder_init, decoder, encoder_hidden_states: np.ndarray, attention_mask: np.ndarray):
+        self.decoder_init = decoder_init
+        self.decoder = decoder
+        self.feeds = {"encoder_hidden_states": encoder_hidden_states, "encoder_attention_mask": attention_mask}
+        self.past = {}
+
+    def step(self, tokens: np.ndarray) -> np.ndarray:
+        """ run the decoder on the newest token of every row, returns the logits of the next token """
+        session = self.decoder if self.past else self.decoder_init
+        outputs = run_session(session, {**self.feeds, **self.past, "decoder_input_ids": tokens[:, None]})
+        # the cross attention keys/values come from the first step only, later steps update the self attention ones
+        self.past.update({name.replace("present", "past", 1): value for name, value in outputs.items() if name != "logits"})
+        return outputs["logits"][:, -1]
+
+    def reorder(self, rows: np.ndarray):
+        """ keep the cached keys/values of ``rows``, in that order """
+        self.feeds = {name: value[rows] for name, value in self.feeds.items()}
+        self.past = {name: value[rows] for name, value in self.past.items()}
+
+
+def generate(encoder, decoder_init, decoder, input_ids: np.ndarray, attention_mask: np.ndarray, max_new_tokens: int,
+             decoder_start_token_id: int, eos_token_id: int, pad_token_id: int, num_beams: int = 1,
+             length_penalty: float = 1.0) -> np.ndarray:
+    """Generate output token ids for a padded batch.
+
+    Parameters
+    ----------
+    encoder, decoder_init, decoder : :obj:`onnxruntime.InferenceSession`
+        Sessions of the graphs written by ``export_repair_onnx.py``.
+    input_ids, attention_mask : :obj:`np.ndarray`
+        Padded input ids and their mask with shape [batch size, input length].
+    max_new_tokens : int
+        Number of tokens generated at most after the decoder start token.
+    num_beams : int
+        1 decodes greedily, more runs beam search keeping that many hypotheses per input.
+    length_penalty : float
+        Exponent of the length the beam scores are divided by.
+    Returns
+    -------
+    :obj:`np.ndarray`
+        Generated ids with shape [batch size, generated length], starting with the decoder start
+        token and padded with ``pad_token_id``.
+    """
+    attention_mask = attention_mask.astype(np.int64)
+    encoder_hidden_states = run_session(encoder, {"input_ids": input_ids, "attention_mask": attention_mask})["encoder_hidden_states"]
+    if num_beams <= 1:
+        state = DecoderState(decoder_init, decoder, encoder_hidden_states, attention_mask)
+        return greedy_search(state, len(input_ids), max_new_tokens, decoder_start_token_id, eos_token_id, pad_token_id)
+    rows = np.repeat(np.arange(len(input_ids)), num_beams)
+    state = DecoderState(decoder_init, decoder, encoder_hidden_states[rows], attention_mask[rows])
+    return beam_search(state, len(input_ids), num_beams, max_new_tokens, decoder_start_token_id, eos_token_id,
+                       pad_token_id, length_penalty)
+
+
+def greedy_search(state: DecoderState, batch_size: int, max_new_tokens: int, decoder_start_token_id: int,
+                  eos_token_id: int, pad_token_id: int) -> np.ndarray:
+    sequences = np.full((batch_size, 1), decoder_start_token_id, dtype=np.int64)
+    finished = np.zeros(batch_size, dtype=bool)
+    for _ in range(max_new_tokens):
+        tokens = np.where(finished, pad_token_id, state.step(sequences[:, -1]).argmax(axis=-1))
+        sequences = np.concatenate([sequences, tokens[:, None]], axis=1)
+        finished |= tokens == eos_token_id
+        if finished.all():
+            break
+    return sequences
+
+
+class BeamHypotheses:
+    """ the ``num_beams`` best finished hypotheses of one input """
+
+    def __init__(self, num_beams: int, length_penalty: float):
+        self.num_beams = num_beams
+        self.length_penalty = length_penalty
+        self.beams = []
+        self.worst_score = 1e9
+
+    def add(self, sequence: np.ndarray, sum_logprobs: float, length_offset: int = 0):
+        score = sum_logprobs / ((len(sequence) - length_offset) ** self.length_penalty)
+        if len(self.beams) < self.num_beams or score > self.worst_score:
+            self.beams.append((score, sequence))
+            if len(self.beams) > self.num_beams:
+                self.beams.remove(min(self.beams, key=lambda beam: beam[0]))
+                self.worst_score = min(beam[0] for beam in self.beams)
+            else:
+                self.worst_score = min(score, self.worst_score)
+
+    def is_done(self, best_sum_logprobs: float, length: int) -> bool:
+        """ whether no running beam can still beat the worst finished hypothesis """
+        if len(self.beams) < self.num_beams:
+            return False
+        return self.worst_score >= best_sum_logprobs / length ** self.length_penalty
+
+
+def beam_search(state: DecoderState, batch_size: int, num_beams: int, max_new_tokens: int, decoder_start_token_id: int,
+                eos_token_id: int, pad_token_id: int, length_penalty: float) -> np.ndarray:
+    sequences = np.full((batch_size * num_beams, 1), decoder_start_token_id, dtype=np.int64)
+    # only the first beam of every input is live at the start, so the first step does not pick the same token num_beams times
+    beam_scores = np.zeros((batch_size, num_beams), dtype=np.float32)
+    beam_scores[:, 1:] = -1e9
+    beam_scores = beam_scores.ravel()
+    hypotheses = [BeamHypotheses(num_beams, length_penalty) for _ in range(batch_size)]
+    done = np.zeros(batch_size, dtype=bool)
+    for _ in range(max_new_tokens):
+        length = sequences.shape[1]
+        scores = log_softmax(state.step(sequences[:, -1])) + beam_scores[:, None]
+        vocab_size = scores.shape[-1]
+        scores = scores.reshape(batch_size, num_beams * vocab_size)
+        # twice as many candidates as beams, so num_beams remain even if all finished ones are eos
+        candidates = np.argpartition(-scores, 2 * num_beams, axis=1)[:, :2 * num_beams]
+        candidates = np.take_along_axis(candidates, np.argsort(-np.take_along_axis(scores, candidates, axis=1), axis=1), axis=1)
+        next_scores = np.zeros((batch_size, num_beams), dtype=np.float32)
+        next_tokens = np.full((batch_size, num_beams), pad_token_id, dtype=np.int64)
+        next_rows = np.repeat(np.arange(batch_size) * num_beams, num_beams).reshape(batch_size, num_beams)
+        for b in range(batch_size):
+            if done[b]:
+                continue
+            kept = 0
+            for rank, candidate in enumerate(candidates[b]):
+                row, token, score = b * num_beams + candidate // vocab_size, candidate % vocab_size, scores[b, candidate]
+                if token == eos_token_id:
+                    if rank < num_beams:
+                        hypotheses[b].add(sequences[row], float(score))
+                    continue
+                next_scores[b, kept], next_tokens[b, kept], next_rows[b, kept] = score, token, row
+                kept += 1
+                if kept == num_beams:
+                    break
+            done[b] = hypotheses[b].is_done(float(scores[b, candidates[b, 0]]), length)
+        rows = next_rows.ravel()
+        beam_scores = next_scores.ravel()
+        sequences = np.concatenate([sequences[rows], next_tokens.reshape(-1, 1)], axis=1)
+        if done.all():
+            break
+        state.reorder(rows)
+    for b in range(batch_size):
+        if not done[b]:
+            for row in range(b * num_beams, (b + 1) * num_beams):
+                hypotheses[b].add(sequences[row], float(beam_scores[row]), UNFINISHED_LENGTH_OFFSET)
+    best = [max(hypotheses[b].beams, key=lambda beam: beam[0])[1] for b in range(batch_size)]
+    max_length = max_new_tokens + 1
+    output = np.full((batch_size, min(max(len(sequence) for sequence in best) + 1, max_length)), pad_token_id, dtype=np.int64)
+    for row, sequence in zip(output, best):
+        row[:len(sequence)] = sequence
+        if len(sequence) < max_length:
+            row[len(sequence)] = eos_token_id
+    return output
@@ -0,0 +1,58 @@
+"""Write INT8 or fp16 variants of line_model.onnx, cwe_model.onnx or sev_model.onnx.
+
+INT8 models are dynamically quantised: the weights of the MatMul and Gemm operators
+are stored as 8-bit integers and activations are quantised at run time, which
+shrinks the model about 4x and speeds up CPU inference. fp16 models keep float
+inputs and outputs but store and compute everything else in half precision, which
+mostly pays off on GPUs. The variant is written next to the model as
+``<name>_model.<precision>.onnx``, where ``LINE_MODEL_PRECISION``, ``CWE_MODEL_PRECISION``
+and ``SEV_MODEL_PRECISION`` (or ``MODEL_PRECISION`` for all three) select it when serving.
+Check the accuracy of a variant with ``benchmarks/quantization_benchmark.py`` first.
+
+Usage::
+
+    python quantize_onnx.py ./models/line_model.onnx [--precision int8|fp16] [--per-channel]
+
+Requires the ``onnx`` package, fp16 also requires ``onnxconverter-common``.
+"""
+import argparse
+import os
+
+import onnx
+
+from model_registry import precision_variant_path
+
+PRECISIONS = ["int8", "fp16"]
+
+
+def quantize_int8(input_path: str, output_path: str, per_channel: bool = False):
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    quantize_dynamic(input_path, output_path, op_types_to_quantize=["MatMul", "Gemm"],
+                     per_channel=per_channel, weight_type=QuantType.QInt8)
+
+
+def convert_fp16(input_path: str, output_path: str):
+    try:
+        from onnxconverter_common import float16
+    except ImportError:
+        raise ImportError("fp16 conversion requires onnxconverter-common, run `pip install onnxconverter-common`")
+    # keep the int64 input ids and the float32 outputs so deploy.py serves both variants alike
+    model = float16.convert_float_to_float16(onnx.load(input_path), keep_io_types=True)
+    onnx.save(model, output_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("model")
+    parser.add_argument("--precision", choices=PRECISIONS, default="int8")
+    parser.add_argument("--per-channel", action="store_true", help="one INT8 scale per output channel instead of per tensor")
+    args = parser.parse_args()
+
+    output_path = precision_variant_path(args.model, args.precision)
+    if args.precision == "int8":
+        quantize_int8(args.model, output_path, args.per_channel)
+    else:
+        convert_fp16(args.model, output_path)
+    size = os.path.getsize(args.model) / 2 ** 20
+    variant_size = os.path.getsize(output_path) / 2 ** 20
+    print(f"Wrote {output_path}: {variant_size:.1f} MB instead of {size:.1f} MB")
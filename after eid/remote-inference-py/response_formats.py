@@ -0,0 +1,106 @@
+"""Response bodies of the inference endpoints, as JSON or MessagePack depending on the ``Accept`` header.
+
+Results are serialised once, with orjson, and sent as a JSON object. Clients sending
+``Accept: application/msgpack`` get MessagePack instead: floats are packed as float32
+and every row of the per-line and per-statement score arrays (:data:`FLOAT_ARRAY_KEYS`)
+as one ``bin`` of little-endian floats, float32 by default or float16 with
+``Accept: application/msgpack; precision=float16``. The ``Content-Type`` of the response
+names the precision used. JSON carries the score arrays at float32 precision as well,
+which is the precision of the model outputs they are computed from.
+"""
+from typing import Optional
+
+import msgpack
+import numpy as np
+import orjson
+from fastapi.responses import Response
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+MSGPACK_TYPES = {MSGPACK, "application/x-msgpack", "application/vnd.msgpack"}
+JSON_TYPES = {JSON, "application/*", "*/*"}
+PRECISIONS = {"float32": "<f4", "float16": "<f2"}
+# 2D lists of scores, one row per function
+FLOAT_ARRAY_KEYS = {"batch_line_scores", "batch_statement_pred_prob"}
+
+
+def parse_accept(accept: Optional[str]) -> list:
+    """ (media type, quality, parameters) of every media range of an Accept header """
+    ranges = []
+    for media_range in (accept or "").split(","):
+        media_type, *params = [part.strip() for part in media_range.split(";")]
+        if not media_type:
+            continue
+        params = dict(param.split("=", 1) if "=" in param else (param, "") for param in params)
+        params = {name.strip().lower(): value.strip().strip('"') for name, value in params.items()}
+        try:
+            quality = float(params.pop("q", 1))
+        except ValueError:
+            quality = 0.0
+        ranges.append((media_type.lower(), quality, params))
+    return ranges
+
+
+def negotiate(accept: Optional[str]) -> tuple:
+    """ (media type, precision) of the response, MessagePack only if the client prefers it to JSON """
+    msgpack_quality, json_quality, precision = 0.0, 0.0, "float32"
+    for media_type, quality, params in parse_accept(accept):
+        if media_type in MSGPACK_TYPES and quality > msgpack_quality:
+            msgpack_quality = quality
+            # unknown precisions fall back to float32, the Content-Type tells the client which one was used
+            precision = params.get("precision", "float32").lower()
+            precision = precision if precision in PRECISIONS else "float32"
+        elif media_type in JSON_TYPES:
+            json_quality = max(json_quality, quality)
+    if msgpack_quality > 0 and msgpack_quality >= json_quality:
+        return MSGPACK, precision
+    return JSON, precision
+
+
+def compact_arrays(value, precision: str, binary: bool):
+    """ ``value`` with the rows of :data:`FLOAT_ARRAY_KEYS` as float arrays, or their bytes if ``binary`` """
+    if isinstance(value, dict):
+        return {key: (float_rows(item, precision, binary) if key in FLOAT_ARRAY_KEYS and isinstance(item, list)
+                      else compact_arrays(item, precision, binary))
+                for key, item in value.items()}
+    # results nest dicts in dicts and in lists of dicts, long lists of numbers or strings are not walked
+    if isinstance(value, list) and value and isinstance(value[0], dict):
+        return [compact_arrays(item, precision, binary) for item in value]
+    return value
+
+
+def float_rows(rows: list, precision: str, binary: bool) -> list:
+    dtype = PRECISIONS[precision]
+    rows = [np.asarray(row, dtype=dtype) for row in rows]
+    return [row.tobytes() for row in rows] if binary else rows
+
+
+def encode_json(result) -> bytes:
+    return orjson.dumps(compact_arrays(result, "float32", binary=False), option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+def encode_msgpack(result, precision: str = "float32") -> bytes:
+    return msgpack.packb(compact_arrays(result, precision, binary=True), use_bin_type=True, use_single_float=True)
+
+
+def render(result, accept: Optional[str], string_json: bool = False) -> Response:
+    """Response with ``result`` in the format the ``accept`` header prefers.
+
+    Parameters
+    ----------
+    result : :obj:`dict`
+        Result of an endpoint.
+    accept : str
+        ``Accept`` header of the request, JSON if missing.
+    string_json : bool
+        Send JSON as a JSON-encoded string holding the result, like the endpoints used to,
+        for clients that still parse the body twice.
+    """
+    media_type, precision = negotiate(accept)
+    if media_type == MSGPACK:
+        return Response(encode_msgpack(result, precision), media_type=f"{MSGPACK}; precision={precision}",
+                        headers={"Vary": "Accept"})
+    body = encode_json(result)
+    if string_json:
+        body = orjson.dumps(body.decode())
+    return Response(body, media_type=JSON, headers={"Vary": "Accept"})
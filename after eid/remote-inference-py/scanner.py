@@ -0,0 +1,345 @@
+"""Offline scan of a source tree with the models of ``deploy.py``, without the HTTP server.
+
+``python -m deploy scan <dir>`` walks the C/C++ files of ``<dir>``, extracts their functions
+with :mod:`function_extraction` and hands batches of ``--batch-size`` functions, filled
+across file boundaries, to a pool of worker processes that each load one set of models and
+run :func:`deploy.main_analyze` on them. Records have the format of the ``/scan`` endpoint
+and are appended to a JSONL file once all the functions of a file are analysed; a SARIF
+log of the vulnerable functions is written from it when the scan ends or is interrupted.
+
+Every completed file is also appended to a checkpoint file, together with the length of the
+JSONL file at that point. A scan that finds a checkpoint of the same directory cuts the JSONL
+file back to the last completed file and skips the files already done, so an interrupted scan
+resumes where it stopped. The checkpoint is removed once the scan completes.
+"""
+import argparse
+import concurrent.futures
+import fnmatch
+import json
+import multiprocessing
+import os
+import signal
+import time
+from typing import Iterator, Optional
+from urllib.parse import quote
+
+import orjson
+
+import settings
+from function_extraction import decode_source, extract_functions, is_c_source
+
+# set in every worker process by init_worker
+deploy = None
+worker_gpu = False
+
+SARIF_SCHEMA = "https://json.schemastore.org/sarif-2.1.0.json"
+# severity classes of the severity model as SARIF result levels
+SARIF_LEVELS = {"Low": "note", "Medium": "warning", "High": "error", "Critical": "error"}
+# seconds between progress lines
+PROGRESS_INTERVAL = 10
+
+
+def init_worker(gpu: bool):
+    """ load the models once per worker process """
+    global deploy, worker_gpu
+    # Ctrl-C reaches the whole process group, the parent stops the scan and keeps the checkpoint
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    import deploy as deploy_module
+    deploy, worker_gpu = deploy_module, gpu
+    deploy.registry.preload(["line", "cwe", "sev"], gpu)
+
+
+def analyze_batch(items: list) -> tuple:
+    """ (NDJSON line per function, indices of the vulnerable functions) of a batch of ("function", path, function) items """
+    result = deploy.main_analyze([function.code for _, _, function in items], worker_gpu, deploy.inference_cache)
+    counts = {"files": 0, "functions": 0, "vulnerable": 0, "errors": 0}
+    return deploy.scan_chunk_records(items, result, counts), result["vulnerable"]
+
+
+def source_files(root: str, exclude: list) -> Iterator[str]:
+    """ paths relative to ``root``, with "/" separators, of the C/C++ files below it in a stable order """
+    for directory, dirnames, filenames in os.walk(root):
+        relative = os.path.relpath(directory, root).replace(os.sep, "/")
+        relative = "" if relative == "." else relative + "/"
+        dirnames[:] = sorted(name for name in dirnames
+                             if not any(fnmatch.fnmatch(relative + name, pattern) for pattern in exclude))
+        for name in sorted(filenames):
+            path = relative + name
+            if is_c_source(name) and not any(fnmatch.fnmatch(path, pattern) for pattern in exclude):
+                yield path
+
+
+def read_source(root: str, path: str) -> tuple:
+    """ (text, error) of a source file, ``text`` is None when the file is skipped """
+    full_path = os.path.join(root, path)
+    try:
+        if os.path.getsize(full_path) > settings.SCAN_MAX_FILE_SIZE:
+            return None, f"File larger than {settings.SCAN_MAX_FILE_SIZE} bytes, skipped"
+        with open(full_path, "rb") as f:
+            text = decode_source(f.read())
+    except OSError as e:
+        return None, f"Could not read the file: {e}"
+    return text, None if text is not None else "Binary file, skipped"
+
+
+def load_checkpoint(checkpoint_path: str, root: str) -> Optional[list]:
+    """ entries of the files completed by an earlier scan of ``root``, None if there is no usable checkpoint """
+    if not os.path.exists(checkpoint_path):
+        return None
+    entries = []
+    with open(checkpoint_path, "rb") as f:
+        for number, line in enumerate(f):
+            try:
+                entry = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                # the last line may have been cut off by the interruption
+                break
+            if number == 0:
+                if entry.get("root") != root:
+                    print(f"Checkpoint {checkpoint_path} belongs to a scan of {entry.get('root')}, starting over")
+                    return None
+                continue
+            entries.append(entry)
+    return entries
+
+
+class Scan:
+    """Writes the records of completed files to the JSONL file and the checkpoint.
+
+    Parameters
+    ----------
+    output : file
+        JSONL file opened for binary writing at the end of the completed files.
+    checkpoint : file
+        Checkpoint file opened for appending.
+    """
+
+    def __init__(self, output, checkpoint):
+        self.output = output
+        self.checkpoint = checkpoint
+        self.counts = {"files": 0, "functions": 0, "vulnerable": 0, "errors": 0}
+        # path -> functions not analysed yet, (index in the file, NDJSON line) of the analysed ones and vulnerable count
+        self.pending = {}
+        self.started = time.perf_counter()
+        self.reported = self.started
+        self.analysed = 0
+
+    def add_file(self, path: str, functions: int):
+        if functions:
+            self.pending[path] = {"remaining": functions, "records": [], "vulnerable": 0}
+        else:
+            self.complete(path, [], 0, 0)
+
+    def add_error(self, path: str, error: str):
+        self.complete(path, [orjson.dumps({"event": "error", "file": path, "error": error}) + b"\n"], 0, 1)
+
+    def add_results(self, keys: list, lines: list, vulnerable: list):
+        """ records of one analysed batch, ``keys`` holds the (path, index in the file) of its functions """
+        vulnerable = set(vulnerable)
+        for position, ((path, index), line) in enumerate(zip(keys, lines)):
+            state = self.pending[path]
+            state["records"].append((index, line))
+            state["vulnerable"] += position in vulnerable
+            state["remaining"] -= 1
+            if state["remaining"] == 0:
+                del self.pending[path]
+                records = [line for _, line in sorted(state["records"], key=lambda record: record[0])]
+                self.complete(path, records, state["vulnerable"], 0)
+        self.analysed += len(keys)
+        if time.perf_counter() - self.reported >= PROGRESS_INTERVAL:
+            self.reported = time.perf_counter()
+            print(f"Scanned {self.counts['files']} files, {self.analysed} functions analysed "
+                  f"({self.analysed / (self.reported - self.started):.1f}/s), {len(self.pending)} files in progress")
+
+    def complete(self, path: str, records: list, vulnerable: int, errors: int):
+        self.output.writelines(records)
+        self.output.flush()
+        entry = {"file": path, "offset": self.output.tell(), "functions": len(records) - errors,
+                 "vulnerable": vulnerable, "errors": errors}
+        self.checkpoint.write(orjson.dumps(entry) + b"\n")
+        self.checkpoint.flush()
+        self.count(entry)
+
+    def count(self, entry: dict):
+        self.counts["files"] += 1
+        for key in ("functions", "vulnerable", "errors"):
+            self.counts[key] += entry[key]
+
+
+def scan(root: str, output_path: str, checkpoint_path: str, workers: int, batch_size: int, gpu: bool = False,
+         exclude: list = (), restart: bool = False) -> dict:
+    """Scan the C/C++ files below ``root`` and append their records to ``output_path``.
+
+    Parameters
+    ----------
+    root : str
+        Directory to scan.
+    output_path : str
+        JSONL file receiving the records.
+    checkpoint_path : str
+        Checkpoint of the completed files, resumed from if it belongs to a scan of ``root``.
+    workers : int
+        Worker processes, each with its own set of models.
+    batch_size : int
+        Functions per :func:`deploy.main_analyze` call.
+    gpu : bool
+        Defines if CUDA inference is enabled
+    exclude : :obj:`list`
+        Glob patterns of paths relative to ``root`` that are not scanned.
+    restart : bool
+        Ignore an existing checkpoint.
+    Returns
+    -------
+    :obj:`dict`
+        The counts of the final "done" record.
+    """
+    root = os.path.abspath(root)
+    entries = None if restart else load_checkpoint(checkpoint_path, root)
+    offset = entries[-1]["offset"] if entries else 0
+    if entries is None or not os.path.exists(output_path) or os.path.getsize(output_path) < offset:
+        entries, offset = [], 0
+        with open(checkpoint_path, "wb") as checkpoint:
+            checkpoint.write(orjson.dumps({"root": root}) + b"\n")
+    done = {entry["file"] for entry in entries}
+    if done:
+        print(f"Resuming the scan of {root}, {len(done)} files already done")
+
+    # share the cores between the workers instead of every worker using all of them
+    threads = str(max(1, (os.cpu_count() or 1) // workers))
+    os.environ.setdefault("ONNX_INTRA_OP_THREADS", threads)
+    os.environ.setdefault("OMP_NUM_THREADS", threads)
+    # workers start from a fresh interpreter, so they read the settings and create their sessions themselves
+    context = multiprocessing.get_context("spawn")
+    with open(output_path, "r+b" if offset else "wb") as output, open(checkpoint_path, "ab") as checkpoint, \
+            concurrent.futures.ProcessPoolExecutor(workers, mp_context=context, initializer=init_worker,
+                                                   initargs=(gpu,)) as pool:
+        output.truncate(offset)
+        output.seek(offset)
+        progress = Scan(output, checkpoint)
+        for entry in entries:
+            progress.count(entry)
+        futures = {}
+
+        def collect():
+            # batches are analysed in any order, a file completes once all of its functions are back
+            finished, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                keys = futures.pop(future)
+                progress.add_results(keys, *future.result())
+
+        def submit(batch: list):
+            futures[pool.submit(analyze_batch, [("function", path, function) for path, _, function in batch])] = \
+                [(path, index) for path, index, _ in batch]
+
+        batch = []
+        for path in source_files(root, list(exclude)):
+            if path in done:
+                continue
+            text, error = read_source(root, path)
+            if text is None:
+                progress.add_error(path, error)
+                continue
+            functions = list(extract_functions(text))
+            progress.add_file(path, len(functions))
+            for index, function in enumerate(functions):
+                batch.append((path, index, function))
+                if len(batch) == batch_size:
+                    # two batches per worker keep every worker busy while bounding the functions in memory
+                    while len(futures) >= 2 * workers:
+                        collect()
+                    submit(batch)
+                    batch = []
+        if batch:
+            submit(batch)
+        while futures:
+            collect()
+        output.write(orjson.dumps({"event": "done", **progress.counts}) + b"\n")
+    os.remove(checkpoint_path)
+    return progress.counts
+
+
+def sarif_result(record: dict) -> dict:
+    """ SARIF result of a vulnerable "function" record, located at its highest scored line """
+    cwe, sev = record["cwe"], record["sev"]
+    scores = record["line_scores"]
+    line = record["lines"][scores.index(max(scores))] if scores else record["start_line"]
+    return {
+        "ruleId": cwe["cwe_id"],
+        "level": SARIF_LEVELS.get(sev["sev_class"], "warning"),
+        "message": {"text": f"{record['name']} is likely vulnerable ({record['vul_pred_prob']:.0%}) to {cwe['cwe_id']} "
+                            f"({cwe['cwe_type']}), severity {sev['sev_score']:.1f} ({sev['sev_class']})"},
+        "locations": [{
+            "physicalLocation": {"artifactLocation": {"uri": quote(record["file"]), "uriBaseId": "SRCROOT"},
+                                 "region": {"startLine": line},
+                                 "contextRegion": {"startLine": record["start_line"], "endLine": record["end_line"]}},
+            "logicalLocations": [{"name": record["name"], "kind": "function"}]}],
+        "properties": {"vul_pred_prob": record["vul_pred_prob"], "cwe_id_prob": cwe["cwe_id_prob"],
+                       "cwe_type_prob": cwe["cwe_type_prob"], "sev_score": sev["sev_score"]},
+    }
+
+
+def write_sarif(jsonl_path: str, sarif_path: str, root: str):
+    """ SARIF 2.1.0 log of the vulnerable functions and the skipped files of a scan's JSONL records """
+    results, rules, notifications, complete = [], {}, [], False
+    with open(jsonl_path, "rb") as f:
+        for line in f:
+            try:
+                record = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                break
+            if record["event"] == "function" and record["vulnerable"] and record["cwe"]:
+                results.append(sarif_result(record))
+                cwe_id = record["cwe"]["cwe_id"]
+                rules.setdefault(cwe_id, {"id": cwe_id, "shortDescription": {"text": f"{cwe_id} ({record['cwe']['cwe_type']})"},
+                                          "properties": {"tags": ["security", cwe_id]}})
+            elif record["event"] == "error":
+                notifications.append({"level": "warning", "message": {"text": record["error"]},
+                                      "locations": [{"physicalLocation": {"artifactLocation": {
+                                          "uri": quote(record["file"]), "uriBaseId": "SRCROOT"}}}]})
+            elif record["event"] == "done":
+                complete = True
+    log = {"$schema": SARIF_SCHEMA, "version": "2.1.0", "runs": [{
+        "tool": {"driver": {"name": "AIBugHunter", "rules": [rules[cwe_id] for cwe_id in sorted(rules)]}},
+        "originalUriBaseIds": {"SRCROOT": {"uri": "file://" + quote(os.path.abspath(root).replace(os.sep, "/")) + "/"}},
+        "invocations": [{"executionSuccessful": complete, "toolExecutionNotifications": notifications}],
+        "results": results,
+    }]}
+    # written next to the target and renamed, so a reader never sees half a log
+    with open(sarif_path + ".tmp", "w") as f:
+        json.dump(log, f, indent=1)
+    os.replace(sarif_path + ".tmp", sarif_path)
+
+
+def main(argv: list) -> int:
+    parser = argparse.ArgumentParser(prog="python -m deploy", description="Run the models without the HTTP server.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    scan_parser = commands.add_parser("scan", help="scan the C/C++ files of a directory",
+                                      description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    scan_parser.add_argument("directory")
+    scan_parser.add_argument("--output", default="scan.jsonl", help="JSONL file receiving the records")
+    scan_parser.add_argument("--sarif", default="scan.sarif", help="SARIF log of the findings, '' for none")
+    scan_parser.add_argument("--checkpoint", help="checkpoint file, OUTPUT.checkpoint by default")
+    scan_parser.add_argument("--workers", type=int, help="worker processes, one per core on CPU and one on GPU by default")
+    scan_parser.add_argument("--batch-size", type=int, default=settings.SCAN_CHUNK_SIZE, help="functions per model call")
+    scan_parser.add_argument("--exclude", action="append", default=[], help="glob of relative paths to skip, repeatable")
+    scan_parser.add_argument("--gpu", action="store_true", help="run the models with CUDA")
+    scan_parser.add_argument("--restart", action="store_true", help="ignore the checkpoint of an interrupted scan")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.directory):
+        parser.error(f"{args.directory} is not a directory")
+    workers = args.workers or (1 if args.gpu else os.cpu_count() or 1)
+    checkpoint_path = args.checkpoint or args.output + ".checkpoint"
+    start = time.perf_counter()
+    try:
+        counts = scan(args.directory, args.output, checkpoint_path, workers, args.batch_size, args.gpu,
+                      args.exclude, args.restart)
+    except KeyboardInterrupt:
+        print(f"Interrupted, run the same command again to resume from {checkpoint_path}")
+        return 130
+    finally:
+        if args.sarif and os.path.exists(args.output):
+            write_sarif(args.output, args.sarif, args.directory)
+    print(f"Scanned {counts['files']} files in {time.perf_counter() - start:.1f} s: {counts['functions']} functions, "
+          f"{counts['vulnerable']} vulnerable, {counts['errors']} skipped")
+    return 0
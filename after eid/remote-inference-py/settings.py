@@ -0,0 +1,155 @@
+import os
+
+
+def _env_str(name: str, default: str) -> str:
+    return os.environ.get(name, default)
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    return int(value) if value not in (None, "") else default
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.environ.get(name)
+    return float(value) if value not in (None, "") else default
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    if value in (None, ""):
+        return default
+    return value.lower() in ["true", "1", "yes", "y"]
+
+
+def _env_list(name: str, default: str) -> list:
+    return [item.strip() for item in os.environ.get(name, default).split(",") if item.strip()]
+
+
+# location of the shared tokenizers/configs and of the model weights
+INFERENCE_COMMON_DIR = _env_str("INFERENCE_COMMON_DIR", "./inference-common")
+MODELS_DIR = _env_str("MODELS_DIR", "./models")
+
+# models loaded by the startup hook, any of "line", "cwe", "sev", "statement", "repair"
+PRELOAD_MODELS = _env_list("PRELOAD_MODELS", "line,cwe,sev")
+# load the preloaded models for CUDA instead of CPU
+PRELOAD_GPU = _env_bool("PRELOAD_GPU", False)
+
+# micro-batching of concurrent /predict, /cwe and /sev requests into one session run
+BATCHING_ENABLED = _env_bool("BATCHING_ENABLED", True)
+BATCH_MAX_SIZE = _env_int("BATCH_MAX_SIZE", 32)
+BATCH_MAX_WAIT_MS = _env_float("BATCH_MAX_WAIT_MS", 5.0)
+
+# send JSON results as a JSON-encoded string, as the endpoints did before, for extension versions that parse them twice
+JSON_STRING_RESPONSES = _env_bool("JSON_STRING_RESPONSES", False)
+
+# gzip or zstd compression of responses of at least COMPRESSION_MIN_SIZE bytes, for clients accepting it
+COMPRESSION_ENABLED = _env_bool("COMPRESSION_ENABLED", True)
+COMPRESSION_MIN_SIZE = _env_int("COMPRESSION_MIN_SIZE", 1024)
+GZIP_LEVEL = _env_int("GZIP_LEVEL", 6)
+ZSTD_LEVEL = _env_int("ZSTD_LEVEL", 3)
+# largest accepted gzip or zstd request body in bytes, after decompression
+MAX_DECOMPRESSED_SIZE = _env_int("MAX_DECOMPRESSED_SIZE", 32 * 1024 * 1024)
+
+# /scan analyses the functions of uploaded files this many at a time; limits of one source file and of an archive in bytes
+SCAN_CHUNK_SIZE = _env_int("SCAN_CHUNK_SIZE", 32)
+SCAN_MAX_FILE_SIZE = _env_int("SCAN_MAX_FILE_SIZE", 4 * 1024 * 1024)
+SCAN_MAX_UPLOAD_SIZE = _env_int("SCAN_MAX_UPLOAD_SIZE", 1024 * 1024 * 1024)
+
+# content-addressed cache of per-function results, 0 entries disables the in-memory cache
+INFERENCE_CACHE_SIZE = _env_int("INFERENCE_CACHE_SIZE", 100000)
+# optional SQLite file keeping cached results across restarts
+INFERENCE_CACHE_PATH = _env_str("INFERENCE_CACHE_PATH", "")
+
+# pad each length bucket only to its longest function when the ONNX model has a dynamic sequence axis
+DYNAMIC_PADDING = _env_bool("DYNAMIC_PADDING", True)
+PADDING_BUCKETS = sorted(int(edge) for edge in _env_list("PADDING_BUCKETS", "64,128,256,384,512"))
+
+# statement texts whose token ids are kept for the statement-level model, 0 disables the cache
+STATEMENT_TOKEN_CACHE_SIZE = _env_int("STATEMENT_TOKEN_CACHE_SIZE", 100000)
+# "torch" runs statement_t5_model.bin, "onnx" runs statement_t5_model.onnx written by export_statement_onnx.py
+STATEMENT_BACKEND = _env_str("STATEMENT_BACKEND", "torch").lower()
+# memory-map the weights of the torch statement and repair models (torch 2.1+) so worker processes share them
+TORCH_MMAP_WEIGHTS = _env_bool("TORCH_MMAP_WEIGHTS", True)
+
+# split functions longer than 512 tokens into overlapping windows instead of truncating them
+WINDOWED_INFERENCE = _env_bool("WINDOWED_INFERENCE", False)
+# tokens shared by consecutive windows
+WINDOW_OVERLAP = _env_int("WINDOW_OVERLAP", 128)
+# how window predictions are combined per function: "max" (most vulnerable/confident window) or "mean"
+WINDOW_COMBINE = _env_str("WINDOW_COMBINE", "max")
+
+# worker threads running tokenisation and ONNX inference for the predict, cwe, sev and analyze endpoints
+INFERENCE_WORKERS = _env_int("INFERENCE_WORKERS", 8)
+# requests allowed to wait for a worker, further requests get 503 with Retry-After
+INFERENCE_QUEUE_SIZE = _env_int("INFERENCE_QUEUE_SIZE", 64)
+# seconds sent in the Retry-After header of rejected requests
+INFERENCE_RETRY_AFTER = _env_int("INFERENCE_RETRY_AFTER", 1)
+
+# ONNX Runtime session options, each can be overridden per model with a LINE_, CWE_, SEV_ or STATEMENT_ prefix
+# (e.g. LINE_ONNX_INTRA_OP_THREADS=2), see onnx_session_settings
+ONNX_GRAPH_OPTIMIZATION = _env_str("ONNX_GRAPH_OPTIMIZATION", "all")
+# 0 keeps the ONNX Runtime default (one thread per physical core), lower it when several workers share a box
+ONNX_INTRA_OP_THREADS = _env_int("ONNX_INTRA_OP_THREADS", 0)
+ONNX_INTER_OP_THREADS = _env_int("ONNX_INTER_OP_THREADS", 0)
+ONNX_EXECUTION_MODE = _env_str("ONNX_EXECUTION_MODE", "sequential")
+ONNX_CPU_MEM_ARENA = _env_bool("ONNX_CPU_MEM_ARENA", True)
+ONNX_MEM_PATTERN = _env_bool("ONNX_MEM_PATTERN", True)
+# directory keeping the optimised graphs, later processes load them without optimising again, empty disables
+ONNX_OPTIMIZED_MODEL_DIR = _env_str("ONNX_OPTIMIZED_MODEL_DIR", "")
+# read the weights of models converted by externalize_onnx.py from the page cache, shared by every worker, instead of
+# pre-packing a private copy per process; optimised graphs are then saved with their weights in a data file as well
+ONNX_SHARED_WEIGHTS = _env_bool("ONNX_SHARED_WEIGHTS", False)
+
+
+def onnx_session_settings(name: str) -> dict:
+    """ session options of the "line", "cwe" or "sev" model, ``<NAME>_ONNX_*`` variables override ``ONNX_*`` """
+    prefix = f"{name.upper()}_"
+    return {
+        "graph_optimization": _env_str(prefix + "ONNX_GRAPH_OPTIMIZATION", ONNX_GRAPH_OPTIMIZATION),
+        "intra_op_threads": _env_int(prefix + "ONNX_INTRA_OP_THREADS", ONNX_INTRA_OP_THREADS),
+        "inter_op_threads": _env_int(prefix + "ONNX_INTER_OP_THREADS", ONNX_INTER_OP_THREADS),
+        "execution_mode": _env_str(prefix + "ONNX_EXECUTION_MODE", ONNX_EXECUTION_MODE),
+        "cpu_mem_arena": _env_bool(prefix + "ONNX_CPU_MEM_ARENA", ONNX_CPU_MEM_ARENA),
+        "mem_pattern": _env_bool(prefix + "ONNX_MEM_PATTERN", ONNX_MEM_PATTERN),
+        "optimized_model_dir": _env_str(prefix + "ONNX_OPTIMIZED_MODEL_DIR", ONNX_OPTIMIZED_MODEL_DIR),
+        "shared_weights": _env_bool(prefix + "ONNX_SHARED_WEIGHTS", ONNX_SHARED_WEIGHTS),
+    }
+
+# precision of the served ONNX models, "fp32", "int8" or "fp16" (variants written by quantize_onnx.py).
+# MODEL_PRECISION sets the line, cwe and sev models, LINE_MODEL_PRECISION, CWE_MODEL_PRECISION and
+# SEV_MODEL_PRECISION one each. STATEMENT_MODEL_PRECISION, REPAIR_ENCODER_MODEL_PRECISION,
+# REPAIR_DECODER_INIT_MODEL_PRECISION and REPAIR_DECODER_MODEL_PRECISION are only set by their own variable
+# and default to fp32, so quantising the classifiers does not require variants of the other graphs
+MODEL_PRECISION = {name: _env_str(f"{name.upper()}_MODEL_PRECISION", _env_str("MODEL_PRECISION", "fp32")).lower()
+                   for name in ["line", "cwe", "sev"]}
+MODEL_PRECISION.update({name: _env_str(f"{name.upper()}_MODEL_PRECISION", "fp32").lower()
+                        for name in ["statement", "repair_encoder", "repair_decoder_init", "repair_decoder"]})
+
+# backend of repair requests without ?backend=, "ollama" or "local" (the fine-tuned T5 repair model)
+REPAIR_BACKEND = _env_str("REPAIR_BACKEND", "ollama").lower()
+# how the local repair model runs, "torch" or "onnx" (the graphs written by export_repair_onnx.py)
+LOCAL_REPAIR_RUNTIME = _env_str("LOCAL_REPAIR_RUNTIME", "torch").lower()
+# functions the local repair model generates for at once, batches are padded to their longest function
+LOCAL_REPAIR_BATCH_SIZE = _env_int("LOCAL_REPAIR_BATCH_SIZE", 8)
+# tokens generated at most per local repair
+LOCAL_REPAIR_MAX_NEW_TOKENS = _env_int("LOCAL_REPAIR_MAX_NEW_TOKENS", 256)
+# 1 decodes greedily, more runs beam search with that many beams
+LOCAL_REPAIR_NUM_BEAMS = _env_int("LOCAL_REPAIR_NUM_BEAMS", 1)
+# exponent of the length beam scores are divided by, above 1 favours longer repairs
+LOCAL_REPAIR_LENGTH_PENALTY = _env_float("LOCAL_REPAIR_LENGTH_PENALTY", 1.0)
+
+# Ollama repairs generated at the same time, match OLLAMA_NUM_PARALLEL of the Ollama server
+REPAIR_CONCURRENCY = _env_int("REPAIR_CONCURRENCY", 4)
+# seconds one function may spend in Ollama before the fallback repair is used
+REPAIR_TIMEOUT = _env_float("REPAIR_TIMEOUT", 60.0)
+
+# Ollama repairs kept in memory, 0 disables the repair cache
+REPAIR_CACHE_SIZE = _env_int("REPAIR_CACHE_SIZE", 10000)
+# seconds a cached repair stays valid, 0 keeps repairs until they are evicted
+REPAIR_CACHE_TTL = _env_float("REPAIR_CACHE_TTL", 7 * 24 * 3600)
+# optional SQLite file keeping cached repairs across restarts
+REPAIR_CACHE_PATH = _env_str("REPAIR_CACHE_PATH", "")
+
+# with PROMETHEUS_MULTIPROC_DIR set, seconds between writes of the queue depth and memory gauges of each worker
+METRICS_SAMPLE_INTERVAL = _env_float("METRICS_SAMPLE_INTERVAL", 5.0)
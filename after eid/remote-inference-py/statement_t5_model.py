@@ -46,16 +46,18 @@ class StatementT5(nn.Module):
         # CLS head 
         self.classifier = ClassificationHead(hidden_dim=hidden_dim)
 
+    def statement_embeddings(self, input_ids):
+        """ last GRU state of every statement, [batch, statements, hidden], one GRU call for the whole batch """
+        embed = self.word_embedding(input_ids)
+        batch_size, num_statements, statement_length, hidden = embed.shape
+        out, statement_embed = self.rnn_statement_embedding(
+            embed.reshape(batch_size * num_statements, statement_length, hidden))
+        return statement_embed.reshape(batch_size, num_statements, hidden)
+
     def forward(self, input_ids, statement_mask, labels=None, func_labels=None):
         statement_mask = statement_mask[:, :self.max_num_statement]
         if self.training:
-            embed = self.word_embedding(input_ids)
-            inputs_embeds = torch.randn(embed.shape[0], embed.shape[1], embed.shape[3]).to(self.device)
-            for i in range(len(embed)):
-                statement_of_tokens = embed[i]
-                out, statement_embed = self.rnn_statement_embedding(statement_of_tokens)
-                inputs_embeds[i, :, :] = statement_embed
-            inputs_embeds = inputs_embeds[:, :self.max_num_statement, :]
+            inputs_embeds = self.statement_embeddings(input_ids)[:, :self.max_num_statement, :]
             rep = self.t5(inputs_embeds=inputs_embeds, attention_mask=statement_mask).last_hidden_state
             logits, func_logits = self.classifier(rep)
             loss_fct = nn.CrossEntropyLoss()
@@ -64,13 +66,7 @@ class StatementT5(nn.Module):
             func_loss = loss_fct_2(func_logits, func_labels)
             return statement_loss, func_loss
         else:
-            embed = self.word_embedding(input_ids)
-            inputs_embeds = torch.randn(embed.shape[0], embed.shape[1], embed.shape[3]).to(self.device)
-            for i in range(len(embed)):
-                statement_of_tokens = embed[i]
-                out, statement_embed = self.rnn_statement_embedding(statement_of_tokens)
-                inputs_embeds[i, :, :] = statement_embed
-            inputs_embeds = inputs_embeds[:, :self.max_num_statement, :]
+            inputs_embeds = self.statement_embeddings(input_ids)[:, :self.max_num_statement, :]
             rep = self.t5(inputs_embeds=inputs_embeds, attention_mask=statement_mask).last_hidden_state
             logits, func_logits = self.classifier(rep)
             probs = torch.sigmoid(logits)
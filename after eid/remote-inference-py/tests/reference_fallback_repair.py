@@ -0,0 +1,264 @@
+"""The fallback repair as it was before ``fallback_repair.py``, kept to compare outputs with.
+
+Copied from ``deploy.py`` with one fix: the addition rule built its pattern with an
+unescaped ``+``, which repeated the assignment group instead of matching the operator, so
+it rewrote ``p = malloc(`` as ``p = mallo+c(`` and never flagged an addition. The operator is
+escaped here as in ``fallback_repair.py``. The unanchored and nested regexes take quadratic
+or exponential time on some inputs, so only run this on ordinary code.
+"""
+import re
+
+
+def provide_fallback_repair(code: str) -> str:
+    """Provide a fallback repair if the Ollama API fails.
+    
+    Parameters
+    ----------
+    code : str
+        The code to repair
+        
+    Returns
+    -------
+    str
+        The repaired code with basic heuristics applied
+    """
+    # First, analyze code structure to understand logical flow
+    lines = code.split("\n")
+    functions = []
+    current_func = []
+    in_function = False
+    
+    # Basic code structure analysis to identify functions and blocks
+    for line in lines:
+        stripped = line.strip()
+        if re.match(r'^[a-zA-Z_][a-zA-Z0-9_]*\s+[a-zA-Z_][a-zA-Z0-9_]*\s*\(', stripped) and '{' in stripped:
+            in_function = True
+            current_func = [line]
+        elif in_function:
+            current_func.append(line)
+            if stripped == '}':
+                # Check if this is actually the end of the function
+                brace_count = ''.join(current_func).count('{') - ''.join(current_func).count('}')
+                if brace_count == 0:
+                    functions.append(current_func)
+                    current_func = []
+                    in_function = False
+        else:
+            # Global scope code
+            pass
+    
+    # Add remaining function if any
+    if current_func:
+        functions.append(current_func)
+    
+    # Add necessary includes based on code content
+    includes_needed = []
+    
+    # Check for necessary includes
+    if "strn" in code or "str" in code:
+        includes_needed.append("string.h")
+    
+    if "malloc" in code or "free" in code or "calloc" in code or "realloc" in code:
+        includes_needed.append("stdlib.h")
+    
+    if "INT_MAX" in code or "overflow" in code or "UINT_MAX" in code:
+        includes_needed.append("limits.h")
+
+    if "printf" in code or "scanf" in code or "fgets" in code or "FILE" in code:
+        includes_needed.append("stdio.h")
+    
+    if "isalpha" in code or "isdigit" in code or "toupper" in code:
+        includes_needed.append("ctype.h")
+        
+    if "errno" in code:
+        includes_needed.append("errno.h")
+        
+    if "memcpy" in code or "memmove" in code:
+        includes_needed.append("string.h")
+        
+    if "socket" in code or "connect" in code:
+        includes_needed.append("sys/socket.h")
+        includes_needed.append("netinet/in.h")
+
+    # Add includes if not already in the code
+    repaired_code = code
+    for include in includes_needed:
+        include_statement = f"#include <{include}>"
+        if include_statement not in repaired_code:
+            if "#include" in repaired_code:
+                # Add after the last include
+                includes = [line for line in repaired_code.split("\n") if line.strip().startswith("#include")]
+                last_include = includes[-1]
+                repaired_code = repaired_code.replace(last_include, last_include + f"\n{include_statement}")
+            else:
+                # Add at the beginning
+                repaired_code = include_statement + "\n" + repaired_code
+    
+    # Track variable declarations to understand data flow
+    var_declarations = re.findall(r'(char|int|float|double|long|unsigned|size_t)\s+([a-zA-Z_][a-zA-Z0-9_]*)\s*(\[\s*[0-9]+\s*\])?', repaired_code)
+    buffer_vars = [name for type, name, array in var_declarations if array]  # Identify buffer variables
+    
+    # Replace potentially dangerous functions with safer alternatives
+    # Buffer overflow fixes - PRESERVE FUNCTIONALITY
+    if "gets(" in repaired_code:
+        # Replace gets with fgets and appropriate buffer size
+        repaired_code = re.sub(
+            r'gets\s*\(\s*([^,\)]+)\s*\)',
+            lambda m: f'fgets({m.group(1)}, sizeof({m.group(1)}), stdin)',
+            repaired_code
+        )
+    
+    if "strcpy" in repaired_code:
+        # Replace strcpy with strncpy + null termination (preserving functionality)
+        repaired_code = re.sub(
+            r'strcpy\s*\(\s*([^,]+)\s*,\s*([^,\)]+)\s*\)',
+            lambda m: f'strncpy({m.group(1)}, {m.group(2)}, sizeof({m.group(1)})-1); {m.group(1)}[sizeof({m.group(1)})-1] = \'\\0\'',
+            repaired_code
+        )
+        
+        # Also detect if we're overwriting buffer contents immediately after reading input
+        repaired_code = re.sub(
+            r'(fgets|gets|scanf|read|recv)([^;]+);[\s\n]*strncpy\s*\(\s*([^,]+)\s*,\s*([^,]+)\s*,\s*sizeof\([^)]+\)-1\)',
+            # Preserve both operations but add a comment explaining the logical issue
+            lambda m: f'{m.group(1)}{m.group(2)}; // Read input into buffer\n    // Warning: Input above may be ignored by the following operation\n    strncpy({m.group(3)}, {m.group(4)}, sizeof({m.group(3)})-1)',
+            repaired_code
+        )
+        
+        # Also check if buffer size is too small for the string literal being copied
+        repaired_code = re.sub(
+            r'char\s+([a-zA-Z_][a-zA-Z0-9_]*)\s*\[\s*(\d+)\s*\][^;]*;[\s\n]*strncpy\s*\(\s*\1\s*,\s*"([^"]+)"\s*,',
+            lambda m: (f'char {m.group(1)}[{max(int(m.group(2)), len(m.group(3))+1)}] /* Increased buffer size */;' if len(m.group(3)) >= int(m.group(2)) else f'char {m.group(1)}[{m.group(2)}];') + f'\n    strncpy({m.group(1)}, "{m.group(3)}",',
+            repaired_code
+        )
+    
+    if "strcat" in repaired_code:
+        # Replace strcat with strncat (preserving functionality)
+        repaired_code = re.sub(
+            r'strcat\s*\(\s*([^,]+)\s*,\s*([^,\)]+)\s*\)',
+            lambda m: f'strncat({m.group(1)}, {m.group(2)}, sizeof({m.group(1)}) - strlen({m.group(1)}) - 1)',
+            repaired_code
+        )
+        
+        # Check for buffer size when concatenating fixed strings
+        repaired_code = re.sub(
+            r'char\s+([a-zA-Z_][a-zA-Z0-9_]*)\s*\[\s*(\d+)\s*\][^;]*;(?:[\s\n]*[^;]+;)*[\s\n]*strncat\s*\(\s*\1\s*,\s*"([^"]+)"\s*,',
+            lambda m: f'char {m.group(1)}[{max(int(m.group(2)), len(m.group(3))*2)}] /* Increased buffer size */;\n    {m.group(1)}[0] = \'\\0\'; /* Initialize for strncat */\n    strncat({m.group(1)}, "{m.group(3)}",',
+            repaired_code
+        )
+    
+    # Format string vulnerability fixes - PRESERVE FUNCTIONALITY
+    if "printf" in repaired_code or "fprintf" in repaired_code:
+        # Fix printf with user-controlled format strings by adding explicit %s format
+        repaired_code = re.sub(
+            r'(f?printf\s*\(\s*[^,]*,\s*)([^"].*?[^"%,\)]+)(\s*\))',
+            lambda m: f'{m.group(1)}"%s", {m.group(2)}{m.group(3)}' if not (m.group(2).strip().startswith('"') and m.group(2).strip().endswith('"')) else f'{m.group(1)}{m.group(2)}{m.group(3)}',
+            repaired_code
+        )
+    
+    # Integer overflow/underflow checks - ADD CHECKS BUT PRESERVE OPERATIONS
+    if re.search(r'[a-zA-Z_][a-zA-Z0-9_]*\s*[+\-*/]\s*[a-zA-Z_0-9]+', repaired_code):
+        # Add basic integer overflow checks for arithmetic operations
+        for op in ['+', '-', '*']:
+            # Find patterns like "a + b" or "a * b" where a and b could be variables or constants
+            pattern = r'(\b[a-zA-Z_][a-zA-Z0-9_]*\s*=\s*[a-zA-Z_0-9]+\s*)' + re.escape(op) + r'(\s*[a-zA-Z_0-9]+\b)'
+            if re.search(pattern, repaired_code):
+                # We don't replace the actual operation, but add a check beforehand
+                includes_needed.append("limits.h")
+                
+                # For integer overflow, add a comment about the potential issue
+                # In a real implementation we'd add actual checks based on types
+                if op == '+':
+                    repaired_code = re.sub(
+                        pattern,
+                        lambda m: f'/* Check for potential overflow before: */ {m.group(1)}{op}{m.group(2)}',
+                        repaired_code
+                    )
+    
+    # Command injection vulnerability checks - SANITIZE BUT PRESERVE FUNCTIONALITY
+    if "system(" in repaired_code or "exec" in repaired_code or "popen" in repaired_code:
+        # Add a warning comment for potential command injection vulnerabilities
+        # In a proper implementation, this would add input validation while preserving the command's functionality
+        validate_function = """
+// Function to validate command input - prevents command injection
+int validate_command_input(const char *str) {
+    if (!str) return 0;
+    
+    // Check for potentially dangerous shell characters
+    while (*str) {
+        if (*str == '|' || *str == ';' || *str == '&' || 
+            *str == '`' || *str == '\\'' || *str == '\\\"' || 
+            *str == '>' || *str == '<' || *str == '$' ||
+            *str == '(' || *str == ')') {
+            return 0;
+        }
+        str++;
+    }
+    return 1;
+}
+"""
+        
+        # Add the validation function if it's not already there
+        if "validate_command_input" not in repaired_code:
+            # Find the position to insert the function (before the first function definition)
+            func_match = re.search(r'^[a-zA-Z_][a-zA-Z0-9_]*\s+[a-zA-Z_][a-zA-Z0-9_]*\s*\(', repaired_code, re.MULTILINE)
+            if func_match:
+                # Insert before the first function
+                pos = func_match.start()
+                repaired_code = repaired_code[:pos] + validate_function + repaired_code[pos:]
+            else:
+                # Append to the end if no function definitions found
+                repaired_code += validate_function
+        
+        # Add checks to system calls without removing the calls themselves
+        repaired_code = re.sub(
+            r'(system\s*\(\s*)([^)]+)(\s*\))',
+            lambda m: f'(validate_command_input({m.group(2)}) ? {m.group(1)}{m.group(2)}{m.group(3)} : -1)',
+            repaired_code
+        )
+    
+    # Memory leak fixes - ADD MISSING FREE BUT PRESERVE ALLOCATIONS
+    # Analyze function returns to avoid adding free() that could lead to double-free
+    malloc_vars = re.findall(r'([a-zA-Z_][a-zA-Z0-9_]*)\s*=\s*(malloc|calloc|realloc)\(', repaired_code)
+    for var, alloc_func in malloc_vars:
+        # Check if there's a free for this variable
+        if f"free({var})" not in repaired_code:
+            # Add a comment suggesting where a free should be added
+            pattern = r'(return[^;]*;)'
+            if re.search(pattern, repaired_code):
+                repaired_code = re.sub(
+                    pattern,
+                    lambda m: f'/* Consider adding: free({var}); */ {m.group(1)}',
+                    repaired_code,
+                    count=1  # Only add one suggestion per function
+                )
+    
+    # SQL Injection check - Add comments about parameterization
+    if "SELECT" in repaired_code and "FROM" in repaired_code and ("sprintf" in repaired_code or "strcat" in repaired_code):
+        repaired_code = re.sub(
+            r'(sprintf\s*\(\s*[^,]+,\s*"[^"]*SELECT[^"]*FROM[^"]*")',
+            lambda m: f'/* SQL Injection risk: Use parameterized queries instead */ {m.group(1)}',
+            repaired_code
+        )
+    
+    # Race condition warnings for file operations
+    if re.search(r'(fopen|open|access|stat)[^;]+;[\s\n]+(fopen|open|write|chmod)', repaired_code):
+        repaired_code = re.sub(
+            r'((fopen|open|access|stat)[^;]+;)',
+            lambda m: f'/* Potential TOCTOU race condition: */ {m.group(1)}',
+            repaired_code
+        )
+    
+    # Add random data initialization for security-sensitive variables
+    if "password" in repaired_code.lower() or "key" in repaired_code.lower() or "secret" in repaired_code.lower():
+        includes_needed.append("stdlib.h")
+        includes_needed.append("time.h")
+        if "srand(time(NULL));" not in repaired_code and "srand(" not in repaired_code:
+            # Add initialization of random number generator if dealing with security-sensitive data
+            func_match = re.search(r'(int\s+main\s*\([^)]*\)\s*{)', repaired_code)
+            if func_match:
+                repaired_code = repaired_code.replace(
+                    func_match.group(1),
+                    func_match.group(1) + "\n    /* Initialize random number generator for security operations */\n    srand(time(NULL));"
+                )
+    
+    return repaired_code
@@ -0,0 +1,68 @@
+"""The per-function line score mapping that ``line_scores.py`` replaced, kept to compare with.
+
+Copied unchanged from ``deploy.py``, with the loop that used to sum the attentions of each
+function in ``main`` as :func:`reference_line_scores`.
+"""
+import numpy as np
+
+
+def get_word_att_scores(tokens: list, att_scores: list) -> list:
+    word_att_scores = []
+    for i in range(len(tokens)):
+        token, att_score = tokens[i], att_scores[i]
+        word_att_scores.append([token, att_score])
+    return word_att_scores
+
+
+def get_all_lines_score(word_att_scores: list):
+    # word_att_scores -> [[token, att_value], [token, att_value], ...]
+    separator = "Ċ"
+    # to return
+    all_lines_score = []
+    score_sum = 0
+    line_idx = 0
+    line = ""
+    for i in range(len(word_att_scores)):
+        # summerize if meet line separator or the last token
+        if ((separator in word_att_scores[i][0]) or (i == (len(word_att_scores) - 1))) and score_sum != 0:
+            score_sum += word_att_scores[i][1]
+            # append line score as float instead of tensor
+            all_lines_score.append(score_sum.item())
+            score_sum = 0
+            line_idx += 1
+        # else accumulate score
+        elif separator not in word_att_scores[i][0]:
+            line += word_att_scores[i][0]
+            score_sum += word_att_scores[i][1]
+    return all_lines_score
+
+
+def clean_special_token_values(all_values, padding=False):
+    # special token in the beginning of the seq 
+    all_values[0] = 0
+    if padding:
+        # get the last non-zero value which represents the att score for </s> token
+        idx = [index for index, item in enumerate(all_values) if item != 0][-1]
+        all_values[idx] = 0
+    else:
+        # special token in the end of the seq 
+        all_values[-1] = 0
+    return all_values
+
+
+def reference_line_scores(tokenizer, model_input: np.ndarray, attentions: np.ndarray, missing_padding_rows: int = 0) -> list:
+    """ line scores computed one function and one token at a time """
+    batch_line_scores = []
+    for input_ids, att_of_one_func in zip(model_input.tolist(), attentions):
+        tokens = [token.replace("Ġ", "").replace("ĉ", "Ċ") for token in tokenizer.convert_ids_to_tokens(input_ids)]
+        att_weight_sum = None
+        for layer_attention in att_of_one_func:
+            layer_attention = sum(layer_attention)
+            att_weight_sum = layer_attention if att_weight_sum is None else att_weight_sum + layer_attention
+        if missing_padding_rows:
+            att_weight_sum += missing_padding_rows * att_of_one_func[:, -1, :].sum(axis=0)
+        att_weight_sum -= att_weight_sum.min()
+        att_weight_sum /= att_weight_sum.max()
+        att_weight_sum = clean_special_token_values(att_weight_sum, padding=True)
+        batch_line_scores.append(get_all_lines_score(get_word_att_scores(tokens, att_weight_sum)))
+    return batch_line_scores
@@ -0,0 +1,46 @@
+import threading
+
+import pytest
+
+from batching import MicroBatcher
+
+
+def run_batch(functions: list) -> dict:
+    if "bad" in functions:
+        raise ValueError("bad function")
+    return {"length": [len(function) for function in functions]}
+
+
+def submit_together(batcher: MicroBatcher, requests: list) -> list:
+    """ submit the requests from concurrent threads so the batcher merges them """
+    barrier = threading.Barrier(len(requests))
+    futures = [None] * len(requests)
+
+    def submit(i):
+        barrier.wait()
+        futures[i] = batcher.submit(requests[i])
+    threads = [threading.Thread(target=submit, args=(i,)) for i in range(len(requests))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return futures
+
+
+def test_results_are_sliced_back_to_each_request():
+    calls = []
+    batcher = MicroBatcher(lambda functions: calls.append(list(functions)) or run_batch(functions),
+                           max_batch_size=32, max_wait_ms=200)
+    futures = submit_together(batcher, [["a"], ["bb", "ccc"]])
+    assert sorted(tuple(future.result(timeout=5)["length"]) for future in futures) == [(1,), (2, 3)]
+    assert len(calls) == 1
+    batcher.close()
+
+
+def test_error_only_reaches_the_request_that_caused_it():
+    batcher = MicroBatcher(run_batch, max_batch_size=32, max_wait_ms=200)
+    good, bad = submit_together(batcher, [["ok", "fine"], ["bad"]])
+    assert good.result(timeout=5) == {"length": [2, 4]}
+    with pytest.raises(ValueError):
+        bad.result(timeout=5)
+    batcher.close()
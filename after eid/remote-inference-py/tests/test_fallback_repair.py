@@ -0,0 +1,86 @@
+import glob
+import os
+import time
+
+import pytest
+
+import fallback_repair
+import reference_fallback_repair
+from fallback_repair import MAX_ARGUMENT, MAX_STATEMENT, provide_fallback_repair
+
+SAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..",
+                           "SecureCodeAnalyzer", "src", "vulnerable_code")
+SAMPLES = sorted(glob.glob(os.path.join(SAMPLES_DIR, "*.c*")))
+
+# one snippet per rule, on which the old and the new implementation agree
+SNIPPETS = [
+    "void f() {\n    char buf[16];\n    gets(buf);\n}",
+    "#include <stdio.h>\nvoid f(char *s) {\n    char buf[8];\n    strcpy(buf, s);\n}",
+    "void f(int fd) {\n    char buf[8];\n    read(fd, buf, 8);\n    strcpy(buf, \"default\");\n}",
+    "void f() {\n    char name[4];\n    strcpy(name, \"too long\");\n}",
+    "void f(char *s) {\n    char out[32];\n    strcat(out, s);\n}",
+    "void f(char *user) {\n    printf(user);\n    fprintf(stderr, user);\n    printf(\"%d\\n\", 1);\n}",
+    "int f(int a, int b) {\n    int c = a + b;\n    return c;\n}",
+    "int main(int argc, char **argv) {\n    system(argv[1]);\n    return 0;\n}",
+    "char *f() {\n    char *p = malloc(10);\n    return 0;\n}",
+    "void f(char *q, char *name) {\n    sprintf(q, \"SELECT * FROM users WHERE name = '%s'\", name);\n    strcat(q, name);\n}",
+    "void f(char *path) {\n    access(path, 0);\n    fopen(path, \"w\");\n}",
+    "int main() {\n    char password[16];\n    return 0;\n}",
+    "#include <errno.h>\nint f() { return errno + isdigit('1'); }",
+    "void f(int s) { connect(s, 0, 0); memcpy(0, 0, 0); }",
+    "",
+]
+
+# fragments that made the old regexes backtrack, repeated to about 200 KB; the old code took 29 s for 100 KB of "gets("
+PATHOLOGICAL = {
+    "deep nesting": ("void f() ", "{ if (x) ", "strcpy(a, b); " + "}" * 5000),
+    "long argument list": ("printf(fmt", ", arg", ");"),
+    "long strcpy argument": ("strcpy(a", " + b", ", c);"),
+    "unterminated string": ('FROM\nsprintf(q, "SELECT ', "x %s ", ""),
+    "unterminated comment": ("/* ", "gets( strcat(", ""),
+    "calls without )": ("", "gets(system(", ""),
+    "strcpy without comma": ("", "strcpy(", ""),
+    "strcat buffer then statements": ("strcat(x, y);\nchar b[4];", "  a;", " strncat(c"),
+    "printf arguments without )": ("printf(a, ", 'b"%', ""),
+    "reads without ;": ("strcpy(a, b);\n", "read ", "strncpy(a, b, sizeof(a)-1)"),
+    "stat without ;": ("", "static ", ""),
+    "returns without ;": ("p = malloc(1);\n", "return ", ""),
+}
+SIZE = 200000
+TIME_BOUND = 2.0
+
+
+@pytest.mark.parametrize("code", SNIPPETS + [open(path).read() for path in SAMPLES])
+def test_matches_the_old_implementation(code):
+    assert provide_fallback_repair(code) == reference_fallback_repair.provide_fallback_repair(code)
+
+
+@pytest.mark.parametrize("name", list(PATHOLOGICAL))
+def test_pathological_input_finishes_in_time(name):
+    prefix, fragment, suffix = PATHOLOGICAL[name]
+    code = prefix + fragment * (SIZE // len(fragment)) + suffix
+    start = time.perf_counter()
+    provide_fallback_repair(code)
+    assert time.perf_counter() - start < TIME_BOUND
+
+
+def test_arguments_longer_than_the_cap_are_left_alone():
+    short = "strcpy(" + "a" * MAX_ARGUMENT + ", b);"
+    long = "strcpy(" + "a" * (MAX_ARGUMENT + 1) + ", b);"
+    assert "strncpy" in provide_fallback_repair(short)
+    assert "strncpy" not in provide_fallback_repair(long)
+
+
+def test_statements_longer_than_the_cap_are_left_alone():
+    def code(length: int) -> str:
+        return "p = malloc(1);\nreturn " + "x" * length + ";"
+    assert "Consider adding: free(p)" in provide_fallback_repair(code(MAX_STATEMENT - len("return ")))
+    assert "Consider adding: free(p)" not in provide_fallback_repair(code(MAX_STATEMENT))
+
+
+def test_strcat_buffer_rule_keeps_the_statements_in_between():
+    code = 'void f() {\n    char b[4];\n    int n = 1;\n    strcat(b, "xy");\n    strncat(b, "abc", 1);\n}'
+    repaired = provide_fallback_repair(code)
+    assert "int n = 1;" in repaired
+    assert fallback_repair.STRNCAT_LITERAL.search(repaired)
+    assert "char b[6] /* Increased buffer size */;" in repaired
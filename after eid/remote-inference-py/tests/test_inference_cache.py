@@ -0,0 +1,29 @@
+import pytest
+
+from inference_cache import InferenceCache
+
+
+def run_model(functions: list) -> dict:
+    return {"length": [len(c) for c in functions]}
+
+
+def test_non_string_functions_are_rejected():
+    cache = InferenceCache(100)
+    cache.run("predict", ["1"], run_model)
+    with pytest.raises(TypeError):
+        cache.run("predict", [1], run_model)
+
+
+def test_miss_batch_is_written_in_one_transaction(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = InferenceCache(100, path)
+    statements = []
+    cache._db.set_trace_callback(statements.append)
+    functions = [f"int f{i}() {{ return {i}; }}" for i in range(32)]
+    assert cache.run("predict", functions, run_model) == run_model(functions)
+    assert sum(statement.startswith("COMMIT") for statement in statements) == 1
+
+    # a new process reads every result back from disk without running the model
+    def fail(functions: list) -> dict:
+        raise AssertionError("cached functions reached the model")
+    assert InferenceCache(100, path).run("predict", functions, fail) == run_model(functions)
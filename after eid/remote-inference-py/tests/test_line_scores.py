@@ -0,0 +1,51 @@
+import os
+
+import numpy as np
+import pytest
+
+from line_scores import attention_line_scores
+from model_registry import ModelRegistry
+from reference_line_scores import reference_line_scores
+
+COMMON_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "inference-common")
+FUNCTIONS = [
+    "int add(int a, int b) {\n  int c = a + b;\n  return c;\n}",
+    "void copy(char *dst, const char *src) {\n\twhile (*src)\n\t\t*dst++ = *src++;\n\t*dst = 0;\n}",
+    "static int parse(const char *buf, size_t len) {\n  char tmp[16];\n\n  memcpy(tmp, buf, len);\n  return atoi(tmp);\n}",
+    "void f() {}",
+]
+# the line model has 12 heads and reads 512 tokens, dynamic padding runs shorter buckets
+HEADS = 12
+
+
+@pytest.fixture(scope="module")
+def tokenizer_and_mask():
+    registry = ModelRegistry(common_dir=COMMON_DIR)
+    return registry.line_tokenizer(), registry.newline_token_mask()
+
+
+def masked_attentions(model_input: np.ndarray, pad_token_id: int, seed: int = 0) -> np.ndarray:
+    """ softmax attention weights over the non-padding tokens, shape [batch, heads, length, length] """
+    rng = np.random.default_rng(seed)
+    logits = rng.normal(size=(model_input.shape[0], HEADS, model_input.shape[1], model_input.shape[1])).astype(np.float32)
+    logits[np.broadcast_to((model_input == pad_token_id)[:, None, None, :], logits.shape)] = -np.inf
+    weights = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return weights / weights.sum(axis=-1, keepdims=True)
+
+
+@pytest.mark.parametrize("length", [512, 128, 64])
+def test_vectorised_line_scores_match_the_per_function_loop(tokenizer_and_mask, length):
+    tokenizer, newline_mask = tokenizer_and_mask
+    input_ids = tokenizer(FUNCTIONS, truncation=True, max_length=512).input_ids
+    model_input = np.full((len(input_ids), length), tokenizer.pad_token_id, dtype=np.int64)
+    for row, ids in zip(model_input, input_ids):
+        row[:len(ids)] = ids
+    attentions = masked_attentions(model_input, tokenizer.pad_token_id)
+    # shorter buckets stand in for the padding rows cut off by dynamic padding
+    missing_padding_rows = 512 - length
+    expected = reference_line_scores(tokenizer, model_input, attentions.copy(), missing_padding_rows)
+    actual = attention_line_scores(model_input, attentions.copy(), newline_mask, missing_padding_rows)
+    assert [len(lines) for lines in actual] == [len(lines) for lines in expected]
+    for expected_lines, actual_lines in zip(expected, actual):
+        # the loop accumulates in float32
+        np.testing.assert_allclose(actual_lines, expected_lines, rtol=1e-4, atol=1e-5)
@@ -0,0 +1,40 @@
+import asyncio
+import os
+import subprocess
+import sys
+
+import httpx
+
+import deploy
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# one worker process: counts two repairs and reports a queue depth of 3 through a function gauge
+WORKER = """
+import metrics
+metrics.repairs.labels("ollama", "model").inc(2)
+metrics.gauge_function(metrics.queue_depth.labels("inference"), lambda: 3)
+metrics.sample_gauges()
+"""
+
+
+def test_metrics_endpoint_reports_requests():
+    async def scrape():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=deploy.app), base_url="http://test") as client:
+            await client.post("/api/v1/cpu/predict", json={"code": 1})
+            return await client.get("/metrics")
+    response = asyncio.run(scrape())
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'http_request_seconds_count{path="/api/v1/cpu/predict",status="400"}' in response.text
+    assert 'inference_queue_depth{queue="inference"} 0.0' in response.text
+
+
+def test_multiprocess_metrics_sum_every_worker(tmp_path):
+    environment = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(tmp_path))
+    for _ in range(2):
+        subprocess.run([sys.executable, "-c", WORKER], env=environment, cwd=SERVER_DIR, check=True)
+    scrape = subprocess.run([sys.executable, "-c", "import metrics; print(metrics.render().decode())"],
+                            env=environment, cwd=SERVER_DIR, check=True, capture_output=True, text=True)
+    assert 'repairs_total{backend="ollama",source="model"} 4.0' in scrape.stdout
+    # the queue depth is summed over live workers only, the two finished processes above are not marked dead
+    assert 'inference_queue_depth{queue="inference"} 6.0' in scrape.stdout
@@ -0,0 +1,21 @@
+import os
+import subprocess
+import sys
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# one server worker creating the session of the line model
+WORKER = """
+from model_registry import registry
+registry.onnx_session("line")
+"""
+
+
+def test_workers_starting_together_write_one_optimized_graph(tmp_path):
+    environment = dict(os.environ, ONNX_OPTIMIZED_MODEL_DIR=str(tmp_path), ONNX_SHARED_WEIGHTS="true")
+    workers = [subprocess.Popen([sys.executable, "-c", WORKER], env=environment, cwd=SERVER_DIR) for _ in range(4)]
+    assert all(worker.wait() == 0 for worker in workers)
+    # a later worker loads the graph written by the first one
+    subprocess.run([sys.executable, "-c", WORKER], env=environment, cwd=SERVER_DIR, check=True)
+    suffixes = sorted(name.split(".onnx", 1)[1] for name in os.listdir(tmp_path))
+    assert suffixes == ["", ".data", ".lock"]
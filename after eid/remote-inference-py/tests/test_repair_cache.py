@@ -0,0 +1,23 @@
+import deploy
+from fallback_repair import provide_fallback_repair
+
+CODE = "void copy(char *dst, const char *src) {\n  strcpy(dst, src);\n}"
+
+
+def test_prose_response_is_passed_on_to_finalize():
+    assert deploy.clean_ollama_response(CODE, "Sorry, I can't.") == "Sorry, I can't."
+
+
+def test_fallback_repair_is_not_cached(monkeypatch):
+    monkeypatch.setattr(deploy, "repair_cache", deploy.InferenceCache(100))
+    repair = deploy.finalize_repair(CODE, deploy.clean_ollama_response(CODE, "Sorry, I can't."))
+    assert repair == provide_fallback_repair(CODE)
+    assert deploy.repair_cache.get(deploy.repair_cache_key(CODE)) is None
+
+
+def test_model_repair_is_cached(monkeypatch):
+    monkeypatch.setattr(deploy, "repair_cache", deploy.InferenceCache(100))
+    fixed = "void copy(char *dst, const char *src, size_t n) {\n  strncpy(dst, src, n);\n}"
+    repair = deploy.finalize_repair(CODE, deploy.clean_ollama_response(CODE, f"```c\n{fixed}\n```"))
+    assert repair == fixed
+    assert deploy.repair_cache.get(deploy.repair_cache_key(CODE)) == {"repair": fixed}
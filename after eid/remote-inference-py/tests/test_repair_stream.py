@@ -0,0 +1,26 @@
+import asyncio
+import json
+
+import httpx
+
+import deploy
+from fallback_repair import provide_fallback_repair
+
+CODE = "void copy(char *dst, const char *src) {\n  strcpy(dst, src);\n}"
+
+
+def test_failing_local_model_ends_the_stream_with_fallbacks(monkeypatch):
+    def fail(code, gpu=False):
+        raise RuntimeError("repair model config does not match its weights")
+    monkeypatch.setattr(deploy, "main_repair", fail)
+    monkeypatch.setattr(deploy, "repair_cache", deploy.InferenceCache(100))
+
+    async def stream():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=deploy.app), base_url="http://test") as client:
+            return await client.post("/api/v1/cpu/repair?backend=local&stream=ndjson", json=[CODE, ""])
+    response = asyncio.run(stream())
+    assert response.status_code == 200
+    events = [json.loads(line) for line in response.text.splitlines()]
+    assert [event["event"] for event in events] == ["error", "repair", "repair", "done"]
+    assert "does not match" in events[0]["error"]
+    assert events[-1]["batch_repair"] == [provide_fallback_repair(CODE), "Error: Empty code provided."]
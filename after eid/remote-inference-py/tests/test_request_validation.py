@@ -0,0 +1,33 @@
+import asyncio
+
+import httpx
+import pytest
+
+import deploy
+
+
+async def post(path: str, body) -> httpx.Response:
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=deploy.app), base_url="http://test") as client:
+        if isinstance(body, bytes):
+            return await client.post(path, content=body, headers={"content-type": "application/json"})
+        return await client.post(path, json=body)
+
+
+@pytest.mark.parametrize("path", ["predict", "cwe", "sev", "statement", "analyze"])
+@pytest.mark.parametrize("body", [[{"a": 1}], ["int f() {}", 1], "int f() {}", {"code": "int f() {}"},
+                                  b"int f() {}", b'["int f() {}"', b"\xff\xfe"])
+def test_malformed_bodies_are_rejected_before_inference(path, body, monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("malformed input reached the models")
+    monkeypatch.setattr(deploy.inference_executor, "run", fail)
+    response = asyncio.run(post(f"/api/v1/cpu/{path}", body))
+    assert response.status_code == 400
+    assert "error" in response.json()
+
+
+@pytest.mark.parametrize("path", ["gpu/repair", "cpu/repair", "cpu/repair?stream=ndjson"])
+@pytest.mark.parametrize("body", [b"int f() {}", b'{"code": "int f() {}"'])
+def test_repair_bodies_that_are_not_json_are_rejected(path, body):
+    response = asyncio.run(post(f"/api/v1/{path}", body))
+    assert response.status_code == 400
+    assert "error" in response.json()
@@ -0,0 +1,18 @@
+import json
+import os
+import subprocess
+import sys
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def model_precision(**environment) -> dict:
+    result = subprocess.run([sys.executable, "-c", "import json, settings; print(json.dumps(settings.MODEL_PRECISION))"],
+                            env={**os.environ, **environment}, cwd=SERVER_DIR, check=True, capture_output=True, text=True)
+    return json.loads(result.stdout)
+
+
+def test_global_precision_only_selects_the_classifier_variants():
+    precision = model_precision(MODEL_PRECISION="int8", SEV_MODEL_PRECISION="fp16", REPAIR_DECODER_MODEL_PRECISION="int8")
+    assert precision == {"line": "int8", "cwe": "int8", "sev": "fp16", "statement": "fp32", "repair_encoder": "fp32",
+                         "repair_decoder_init": "fp32", "repair_decoder": "int8"}
@@ -0,0 +1,38 @@
+import numpy as np
+
+from line_scores import attention_token_scores, attention_token_sums
+from windowing import normalize_window_scores, split_windows, stitch_token_scores
+
+BOS, EOS = 0, 2
+
+
+def function_ids(length: int) -> list:
+    return [BOS] + list(range(10, 10 + length)) + [EOS]
+
+
+def test_windows_with_different_raw_ranges_share_one_scale():
+    input_ids = [function_ids(30)]
+    windows, owners = split_windows(input_ids, 1, 1, overlap=4, max_length=20)
+    assert len(windows) > 1
+    rng = np.random.default_rng(0)
+    # the last window attends far more strongly than the others
+    window_sums = [rng.uniform(1, 2, len(window)).astype(np.float32) for window in windows]
+    window_sums[-1] *= 50
+    scores = stitch_token_scores(input_ids, windows, owners, normalize_window_scores(window_sums, owners, 1), 1, 1)[0]
+    # one token of the whole function is the most attended one, not one per window
+    assert np.count_nonzero(scores >= 1 - 1e-6) == 1
+    assert np.argmax(scores) >= 1 + owners[-1][1]
+    # tokens only covered by the weak windows stay on the strong window's scale
+    first_only = slice(1, 1 + owners[1][1])
+    assert scores[first_only].max() < 0.05
+
+
+def test_single_window_scores_are_unchanged():
+    rng = np.random.default_rng(1)
+    attentions = rng.uniform(0, 1, (3, 2, 16, 16)).astype(np.float32)
+    expected = attention_token_scores(attentions.copy(), missing_padding_rows=4)
+    sums = attention_token_sums(attentions.copy(), missing_padding_rows=4)
+    owners = [(0, 0), (1, 0), (2, 0)]
+    scores = normalize_window_scores(list(sums), owners, 3)
+    for row, expected_row in zip(scores, expected):
+        assert np.array_equal(row, expected_row)
@@ -0,0 +1,56 @@
+import threading
+from collections import OrderedDict
+
+
+class TokenCache:
+    """Bounded LRU cache from text to token ids.
+
+    Lines such as ``}`` or ``return 0;`` repeat across a whole codebase, so only the
+    texts not seen yet are passed to the tokenizer, all of them in one batch call.
+
+    Parameters
+    ----------
+    max_entries : int
+        Maximum number of texts kept, 0 disables the cache.
+    """
+
+    def __init__(self, max_entries: int = 100000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def encode(self, tokenizer, texts: list, max_length: int) -> dict:
+        """ token ids of every text without special tokens, truncated to ``max_length``, keyed by text """
+        ids = {}
+        missing = []
+        with self._lock:
+            for text in dict.fromkeys(texts):
+                key = (text, max_length)
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    ids[text] = self._entries[key]
+                    self.hits += 1
+                else:
+                    missing.append(text)
+            self.misses += len(missing)
+        if missing:
+            encoded = tokenizer(missing, add_special_tokens=False, truncation=True, max_length=max_length).input_ids
+            ids.update(zip(missing, encoded))
+            with self._lock:
+                for text, text_ids in zip(missing, encoded):
+                    self._remember((text, max_length), text_ids)
+        return ids
+
+    def _remember(self, key: tuple, value: list):
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,108 @@
+import numpy as np
+
+from line_scores import normalize_token_scores
+
+
+def split_windows(input_ids: list, prefix_length: int, suffix_length: int, overlap: int,
+                  max_length: int = 512) -> tuple:
+    """Split input ids longer than ``max_length`` into overlapping windows.
+
+    Each input is ``prefix_length`` special tokens, the code tokens and ``suffix_length``
+    special tokens. Inputs that fit are kept as a single window, longer ones become windows
+    of ``max_length`` tokens with the same special tokens around consecutive slices of the
+    code tokens, each slice overlapping the previous one by at least ``overlap`` tokens.
+
+    Returns
+    -------
+    :obj:`tuple`
+        (windows, owners), the list of window input ids and, for each window, the index of
+        its input and the position of its first code token within the code tokens of that input.
+    """
+    windows, owners = [], []
+    content_length = max_length - prefix_length - suffix_length
+    step = max(1, content_length - overlap)
+    for i, ids in enumerate(input_ids):
+        if len(ids) <= max_length:
+            windows.append(ids)
+            owners.append((i, 0))
+            continue
+        prefix, content, suffix = ids[:prefix_length], ids[prefix_length:len(ids) - suffix_length], ids[len(ids) - suffix_length:]
+        starts = list(range(0, len(content) - content_length, step)) + [len(content) - content_length]
+        for start in starts:
+            windows.append(prefix + content[start:start + content_length] + suffix)
+            owners.append((i, start))
+    return windows, owners
+
+
+def normalize_window_scores(window_sums: list, owners: list, count: int) -> list:
+    """Normalise the attention sums of every window on the scale of its whole input.
+
+    All windows of an input share the minimum and maximum over all of them, so their
+    scores stay comparable once stitched and only the highest scoring token of the input
+    reaches 1. An input that fits in one window gets the same scores as without windowing.
+    """
+    low = np.full(count, np.inf)
+    high = np.full(count, -np.inf)
+    for (i, _), sums in zip(owners, window_sums):
+        low[i] = min(low[i], sums.min())
+        high[i] = max(high[i], sums.max())
+    scores = []
+    for (i, _), sums in zip(owners, window_sums):
+        dtype = sums.dtype
+        scores.append(normalize_token_scores(sums[None, :].copy(), np.array([[low[i]]], dtype=dtype),
+                                             np.array([[high[i]]], dtype=dtype))[0])
+    return scores
+
+
+def stitch_token_scores(input_ids: list, windows: list, owners: list, window_scores: list,
+                        prefix_length: int, suffix_length: int) -> list:
+    """Merge per-token scores of the windows back into one score per token of each input.
+
+    The window scores must share one scale per input, see :func:`normalize_window_scores`. A code token covered by several windows takes its score from the window in which it is
+    furthest from the window edges. Special tokens score 0, as they do after cleanup.
+    """
+    scores = [np.zeros(len(ids), dtype=np.float64) for ids in input_ids]
+    distance = [np.full(len(ids), -1) for ids in input_ids]
+    for window, (i, start), window_score in zip(windows, owners, window_scores):
+        content_length = len(window) - prefix_length - suffix_length
+        positions = np.arange(content_length)
+        # distance to the closer edge of the window
+        window_distance = np.minimum(positions, content_length - 1 - positions)
+        target = slice(prefix_length + start, prefix_length + start + content_length)
+        better = window_distance > distance[i][target]
+        scores[i][target][better] = window_score[prefix_length:prefix_length + content_length][better]
+        distance[i][target][better] = window_distance[better]
+    return scores
+
+
+def combine_windows(rows: np.ndarray, owners: list, count: int, rule: str, key) -> np.ndarray:
+    """Combine per-window model outputs into one output per input.
+
+    Parameters
+    ----------
+    rows : :obj:`np.ndarray`
+        Model output with one row per window.
+    owners : :obj:`list`
+        Owners of the windows as returned by :func:`split_windows`.
+    count : int
+        Number of inputs.
+    rule : str
+        "max" keeps the row of the window with the highest ``key``, "mean" averages the rows.
+    key : callable
+        Maps the rows of one input to the value compared by the "max" rule.
+    """
+    if rule not in ("max", "mean"):
+        raise ValueError(f"Unknown window combination rule '{rule}', expected 'max' or 'mean'")
+    combined = np.empty((count,) + rows.shape[1:], dtype=rows.dtype)
+    window_indices = [[] for _ in range(count)]
+    for window_index, (i, _) in enumerate(owners):
+        window_indices[i].append(window_index)
+    for i, indices in enumerate(window_indices):
+        function_rows = rows[indices]
+        if len(indices) == 1:
+            combined[i] = function_rows[0]
+        elif rule == "max":
+            combined[i] = function_rows[np.argmax(key(function_rows))]
+        else:
+            combined[i] = function_rows.mean(axis=0)
+    return combined